@@ -8,10 +8,8 @@ Created on 24 Feb 2010
 from nipype.interfaces.base import BaseInterface,\
     traits, TraitedSpec, File, InputMultiPath, OutputMultiPath
 from nipype.utils.misc import isdefined
-import nipype.externals.pynifti as nifti
 import numpy as np
 from math import floor, ceil
-from scipy.ndimage.morphology import grey_dilation
 import os
 from nipype.utils.filemanip import fname_presuffix, split_filename
 
@@ -36,6 +34,7 @@ class PickAtlas(BaseInterface):
     output_spec = PickAtlasOutputSpec
 
     def _run_interface(self, runtime):
+        import nipype.externals.pynifti as nifti
         nim = self._get_brodmann_area()
         nifti.save(nim, self._gen_output_filename())
 
@@ -51,6 +50,8 @@ class PickAtlas(BaseInterface):
         return output
         
     def _get_brodmann_area(self):
+        import nipype.externals.pynifti as nifti
+        from scipy.ndimage.morphology import grey_dilation
         nii = nifti.load(self.inputs.atlas)
         origdata = nii.get_data()
         newdata = np.zeros(origdata.shape)
@@ -92,6 +93,7 @@ class SimpleThreshold(BaseInterface):
     output_spec = SimpleThresholdOutputSpec
     
     def _run_interface(self, runtime):
+        import nipype.externals.pynifti as nifti
         for fname in self.inputs.volumes:
             img = nifti.load(fname)
             data = np.array(img.get_data())
@@ -13,11 +13,8 @@ import os
 from copy import deepcopy
 
 import numpy as np
-from scipy.signal import convolve
-from scipy.special import gammaln
 #from scipy.stats.distributions import gamma
 
-from nipype.externals.pynifti import load
 from nipype.interfaces.base import BaseInterface, TraitedSpec,\
  InputMultiPath, traits, File
 from nipype.utils.misc import isdefined
@@ -200,6 +197,7 @@ class SpecifyModel(BaseInterface):
           -5.82063147e-03  -2.61854250e-03  -1.07732374e-03  -4.10443522e-04
           -1.46257507e-04]
         """
+        from scipy.special import gammaln
         p     = np.array([6,16,1,1,6,0,32],dtype=float)
         if len(P)>0:
             p[0:len(P)] = P
@@ -222,6 +220,7 @@ class SpecifyModel(BaseInterface):
 
            see Ghosh et al. (2009) OHBM 2009
         """
+        from scipy.signal import convolve
         if bplot:
             import matplotlib.pyplot as plt
         TR = np.round(self.inputs.time_repetition*1000)  # in ms
@@ -322,6 +321,7 @@ class SpecifyModel(BaseInterface):
         designs.
         
         """
+        from nipype.externals.pynifti import load
         infoout = deepcopy(infolist)
         for i,info in enumerate(infolist):
             infoout[i].conditions = None
@@ -414,6 +414,7 @@ class SpecifyModel(BaseInterface):
         return sessinfo
     
     def _concatenate_info(self,infolist):
+        from nipype.externals.pynifti import load
         nscans = []
         for i,f in enumerate(filename_to_list(self.inputs.functional_runs)):
             if isinstance(f,list):
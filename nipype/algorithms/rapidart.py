@@ -23,13 +23,10 @@ from glob import glob
 from copy import deepcopy
 
 import numpy as np
-from scipy import signal
-import scipy.io as sio
 
 from nipype.interfaces.base import (Bunch, InterfaceResult, BaseInterface,
                                     traits, InputMultiPath, OutputMultiPath,
                                     TraitedSpec, File)
-from nipype.externals.pynifti import load, funcs
 from nipype.utils.filemanip import filename_to_list, list_to_filename
 from nipype.utils.misc import find_indices
 #import matplotlib as mpl
@@ -197,6 +194,7 @@ class ArtifactDetect(BaseInterface):
         norm : at each time point
         
         """
+        from scipy import signal
         respos=np.diag([70,70,75]);resneg=np.diag([-70,-110,-45]);
         # respos=np.diag([50,50,50]);resneg=np.diag([-50,-50,-50]);
         # XXX - SG why not the above box
@@ -230,6 +228,8 @@ class ArtifactDetect(BaseInterface):
         """
         Core routine for detecting outliers
         """
+        from scipy import signal
+        from nipype.externals.pynifti import load, funcs
         if not cwd:
             cwd = os.getcwd()
         # read in motion parameters
@@ -473,6 +473,7 @@ class StimulusCorrelation(BaseInterface):
     def _run_interface(self, runtime):
         """Execute this module.
         """
+        import scipy.io as sio
         motparamlist = self.inputs.realignment_parameters
         intensityfiles = self.inputs.intensity_values
         spmmat = sio.loadmat(self.inputs.spm_mat_file)
@@ -8,11 +8,14 @@ Exaples  FSL, matlab/SPM , afni
 Requires Packages to be installed
 """
 
+from collections import deque
 import os
 import subprocess
 from copy import deepcopy
 from socket import gethostname
+from stat import S_ISREG
 from string import Template
+from threading import Thread
 from time import time
 from warnings import warn
 
@@ -21,11 +24,13 @@ import enthought.traits.api as traits
 from enthought.traits.trait_handlers import TraitDictObject, TraitListObject
 from nipype.interfaces.traits import Undefined
 
-from nipype.utils.filemanip import md5, hash_infile, FileNotFoundError, \
-    hash_timestamp
+from nipype.utils.filemanip import md5, hash_files, FileNotFoundError
 from nipype.utils.misc import is_container
 from enthought.traits.trait_errors import TraitError
 from nipype.utils.config import config
+from nipype.utils.environ import environ_snapshot
+from nipype.utils.profiler import ResourceMonitor
+from nipype.utils.runtimedb import peak_rss
 from nipype.utils.misc import isdefined
 from ConfigParser import NoOptionError
 
@@ -139,22 +144,8 @@ class Bunch(object):
         stuff = adict[key]
         if not is_container(stuff):
             stuff = [stuff]
-        file_list = []
-        for afile in stuff:
-            if os.path.isfile(afile):
-                md5obj = md5()
-                fp = file(afile, 'rb')
-                while True:
-                    data = fp.read(8192)
-                    if not data:
-                        break
-                    md5obj.update(data)
-                fp.close()
-                md5hex = md5obj.hexdigest()
-            else:
-                md5hex = None
-            file_list.append((afile, md5hex))
-        return file_list
+        # always md5, so bunch hashes do not depend on the hash_digest option
+        return zip(stuff, hash_files(stuff, method='content', digest='md5'))
 
     def _get_bunch_hash(self):
         """Return a dictionary of our items with hashes for each file.
@@ -249,6 +240,28 @@ class InterfaceResult(object):
         * stdout : The output of running the ``cmdline``.
         * stderr : Any error messages output from running ``cmdline``.
         * returncode : The code returned from running the ``cmdline``.
+        * environ : The environment variables recorded for the run (a
+          shared snapshot, see :mod:`nipype.utils.environ`).
+        * environ_digest : The digest identifying ``environ``.
+        * duration : The number of seconds the interface ran.
+        * peak_rss : The peak memory use (in MB) during the run or None if
+          it is not known.
+        * cpu_user, cpu_sys : The user and system CPU seconds used by the
+          command and its child processes.
+        * read_bytes, write_bytes : The number of bytes read and written
+          by the command and its child processes.
+        * num_threads : The peak number of threads of the command and its
+          child processes.
+        * stdout_file, stderr_file : The files the output of a command line
+          interface was written to if the `stream_output` option is set.
+          ``stdout`` and ``stderr`` then only contain the last
+          `output_tail_lines` lines.
+
+        The CPU, I/O and thread fields (and a sampled ``peak_rss``) are
+        only recorded for command line interfaces when the
+        `profile_runtime` option is set (see :mod:`nipype.utils.profiler`).
+        When the `use_runtime_history` option is set, ``peak_rss`` of a
+        command line interface is sampled from the command as well.
 
     """
 
@@ -361,18 +374,15 @@ class BaseTraitedSpec(traits.HasTraits):
         stuff = adict[key]
         if not is_container(stuff):
             stuff = [stuff]
+        files = [afile for afile in stuff if not is_container(afile)]
+        hashes = dict(zip(files, hash_files(files)))
         file_list = []
         for afile in stuff:
             if is_container(afile):
                 hashlist = self._hash_infile({'infiles':afile}, 'infiles')
                 hash = [val[1] for val in hashlist]
             else:
-                if config.get('execution', 'hash_method').lower() == 'timestamp':
-                    hash = hash_timestamp(afile)
-                elif config.get('execution', 'hash_method').lower() == 'content':
-                    hash = hash_infile(afile)
-                else:
-                    raise Exception("Unknown hash method: %s" % config.get('execution', 'hash_method'))
+                hash = hashes[afile]
             file_list.append((afile, hash))
         return file_list
 
@@ -413,7 +423,6 @@ class BaseTraitedSpec(traits.HasTraits):
                 out = undefinedval
         return out
 
-    #@traits.cached_property
     @property
     def hashval(self):
         """Return a dictionary of our items with hashes for each file.
@@ -426,6 +435,11 @@ class BaseTraitedSpec(traits.HasTraits):
         value of a file. The path and name of the file are not used in
         the overall hash calculation.
 
+        The result is cached until a trait changes or the stat metadata
+        of a string valued input change (e.g., because a file was
+        rewritten or created). Mutating nested containers in place is not
+        detected.
+
         Returns
         -------
         dict_withhash : dict
@@ -435,39 +449,102 @@ class BaseTraitedSpec(traits.HasTraits):
             The md5 hash value of the traited spec
 
         """
-        dict_withhash = self._get_sorteddict(self.get(),True)
-        dict_nofilename = self._get_sorteddict(self.get())
-        return (dict_withhash, md5(str(dict_nofilename)).hexdigest())
-
-    def _get_sorteddict(self, object, dictwithhash=False):
+        method = (config.get('execution', 'hash_method').lower(),
+                  config.get('execution', 'hash_digest').lower())
+        # the cache lives in the instance dict, which neither clone_traits
+        # (deepcopy) nor pickling carry over together with the notifier
+        cached = self.__dict__.get('_hashval_cache')
+        if cached is not None:
+            cached_method, stats, hashval = cached
+            if cached_method == method and \
+                    stats == [(path, _stat_signature(path))
+                              for path, _ in stats]:
+                return hashval
+        inputs = self.get()
+        hashes, stats = self._get_filehashes(inputs)
+        dict_withhash, dict_nofilename = self._get_sorteddict(inputs, hashes)
+        hashval = (dict_withhash, md5(str(dict_nofilename)).hexdigest())
+        if not self.__dict__.get('_hashval_notifier'):
+            self.on_trait_change(self._invalidate_hashval)
+            self.__dict__['_hashval_notifier'] = True
+        self.__dict__['_hashval_cache'] = (method, stats, hashval)
+        return hashval
+
+    def _invalidate_hashval(self):
+        self.__dict__['_hashval_cache'] = None
+
+    def __getstate__(self):
+        state = super(BaseTraitedSpec, self).__getstate__()
+        state.pop('_hashval_cache', None)
+        state.pop('_hashval_notifier', None)
+        return state
+
+    def _get_filehashes(self, object):
+        """Hash all existing files referenced in `object`
+
+        All files are hashed at once so that they can be read
+        concurrently. Returns a dict mapping each file to its hash and
+        the stat signatures of all strings in `object`.
+        """
+        files = []
+        stats = []
+        stack = [object]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, dict):
+                stack.extend(item.values())
+            elif isinstance(item, (list, tuple)):
+                stack.extend(item)
+            elif isinstance(item, str):
+                signature = _stat_signature(item)
+                stats.append((item, signature))
+                if signature is not None and signature[0]:
+                    files.append(item)
+        files = list(set(files))
+        return dict(zip(files, hash_files(files))), stats
+
+    def _get_sorteddict(self, object, hashes):
+        """Return sorted copies of `object` with each file replaced by a
+        (file, hash) tuple and by its hash, respectively
+        """
         if isinstance(object, dict):
-            out = {}
+            withhash = {}
+            nofilename = {}
             for key, val in sorted(object.items()):
                 if isdefined(val):
-                    out[key] = self._get_sorteddict(val, dictwithhash)
+                    withhash[key], nofilename[key] = \
+                        self._get_sorteddict(val, hashes)
         elif isinstance(object, (list,tuple)):
-            out = []
+            withhash = []
+            nofilename = []
             for val in object:
                 if isdefined(val):
-                    out.append(self._get_sorteddict(val, dictwithhash))
+                    out = self._get_sorteddict(val, hashes)
+                    withhash.append(out[0])
+                    nofilename.append(out[1])
             if isinstance(object, tuple):
-                out = tuple(out)
+                withhash = tuple(withhash)
+                nofilename = tuple(nofilename)
         else:
             if isdefined(object):
-                if isinstance(object, str) and os.path.isfile(object):
-                    if config.get('execution', 'hash_method').lower() == 'timestamp':
-                        hash = hash_timestamp(object)
-                    elif config.get('execution', 'hash_method').lower() == 'content':
-                        hash = hash_infile(object)
-                    else:
-                        raise Exception("Unknown hash method: %s" % config.get('execution', 'hash_method'))
-                    if dictwithhash:
-                        out = (object, hash)
-                    else:
-                        out = hash
+                if isinstance(object, str) and object in hashes:
+                    hash = hashes[object]
+                    withhash = (object, hash)
+                    nofilename = hash
                 else:
-                    out = object
-        return out
+                    withhash = nofilename = object
+        return withhash, nofilename
+
+def _stat_signature(path):
+    """Return (isfile, inode, size, mtime, ctime) of `path` or None if it
+    does not exist
+    """
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError, ValueError):
+        return None
+    return (S_ISREG(st.st_mode), st.st_ino, st.st_size, st.st_mtime,
+            st.st_ctime)
 
 class DynamicTraitedSpec(BaseTraitedSpec):
     """ A subclass to handle dynamic traits
@@ -516,6 +593,8 @@ class Interface(object):
     input_spec = None # A traited input specification
     output_spec = None # A traited output specification
     can_resume = False # defines if the interface can reuse partial results after interruption
+    n_procs = 1 # number of processors used when run by a workflow plugin
+    memory_gb = 0.25 # memory (in GB) needed when run by a workflow plugin
 
     def __init__(self, **inputs):
         """Initialize command with given args and inputs."""
@@ -738,15 +817,23 @@ class BaseInterface(Interface):
         self.inputs.set(**inputs)
         self._check_mandatory_inputs()
         # initialize provenance tracking
-        env = deepcopy(os.environ.data)
+        environ_digest, env = environ_snapshot()
         runtime = Bunch(cwd=os.getcwd(),
                         returncode=None,
                         duration=None,
                         environ=env,
+                        environ_digest=environ_digest,
                         hostname=gethostname())
+        rss = peak_rss()
         t = time()
         runtime = self._run_interface(runtime)
         runtime.duration = time() - t
+        if getattr(runtime, 'peak_rss', None) is None:
+            # the process wide high-water mark only tells the peak of this
+            # run if the run raised it
+            runtime.peak_rss = peak_rss()
+            if runtime.peak_rss is not None and runtime.peak_rss <= rss:
+                runtime.peak_rss = None
         results = InterfaceResult(deepcopy(self), runtime)
         if results.runtime.returncode is None:
             raise Exception('Returncode from an interface cannot be None')
@@ -831,6 +918,13 @@ class CommandLine(BaseInterface):
     """
 
     input_spec = CommandLineInputSpec
+    # called with the stream name ('stdout' or 'stderr') and the line for
+    # every line the command writes, if the `stream_output` option is set.
+    # Must be a module-level function (not a lambda, closure or bound
+    # method), so the interface and its results can be pickled. It may be
+    # set on an instance or as a class attribute of a subclass; it is
+    # called without the interface in either case.
+    line_callback = None
 
     def __init__(self, command=None, **inputs):
         super(CommandLine, self).__init__(**inputs)
@@ -877,7 +971,12 @@ class CommandLine(BaseInterface):
         setattr(runtime, 'stdout', None)
         setattr(runtime, 'stderr', None)
         setattr(runtime, 'cmdline', self.cmdline)
-        runtime.environ.update(self.inputs.environ)
+        # the recorded snapshot may be restricted to a whitelist, the
+        # command always gets the full environment
+        env = dict(os.environ)
+        env.update(self.inputs.environ)
+        runtime.environ_digest, runtime.environ = \
+            environ_snapshot(self.inputs.environ)
         if not self._exists_in_path(self.cmd.split()[0]):
             raise IOError("%s could not be found on host %s"%(self.cmd.split()[0],
                                                          runtime.hostname))
@@ -886,11 +985,84 @@ class CommandLine(BaseInterface):
                                  stderr=subprocess.PIPE,
                                  shell=True,
                                  cwd=runtime.cwd,
-                                 env=runtime.environ)
-        runtime.stdout, runtime.stderr = proc.communicate()
+                                 env=env)
+        monitor = None
+        profile = config.getboolean('execution', 'profile_runtime')
+        # the runtime history only needs the peak memory of the command
+        if profile or config.getboolean('execution', 'use_runtime_history'):
+            monitor = ResourceMonitor(proc.pid,
+                                      config.getfloat('execution',
+                                                      'profile_interval'))
+            monitor.start()
+        if config.getboolean('execution', 'stream_output'):
+            runtime.stdout, runtime.stderr = self._stream_output(proc,
+                                                                 runtime.cwd)
+            runtime.stdout_file = os.path.join(runtime.cwd, 'stdout.log')
+            runtime.stderr_file = os.path.join(runtime.cwd, 'stderr.log')
+        else:
+            runtime.stdout, runtime.stderr = proc.communicate()
         runtime.returncode = proc.returncode
+        if monitor is not None:
+            usage = monitor.stop()
+            if not profile:
+                usage = dict(peak_rss=usage['peak_rss'])
+            for key, value in usage.items():
+                setattr(runtime, key, value)
         return runtime
 
+    def _stream_output(self, proc, cwd):
+        """Copy the output of a running command line by line to the files
+        stdout.log and stderr.log in `cwd`
+
+        Waits for the command to finish and returns the last
+        `output_tail_lines` lines of stdout and stderr.
+        """
+        maxlen = config.getint('execution', 'output_tail_lines')
+        threads = []
+        tails = []
+        for name, pipe in [('stdout', proc.stdout), ('stderr', proc.stderr)]:
+            tail = deque(maxlen=maxlen)
+            thread = Thread(target=self._copy_lines,
+                            args=(name, pipe,
+                                  os.path.join(cwd, '%s.log' % name), tail))
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+            tails.append(tail)
+        for thread in threads:
+            thread.join()
+        proc.wait()
+        return [''.join(tail) for tail in tails]
+
+    def _get_line_callback(self):
+        """Return `line_callback` without binding it to the instance
+        """
+        if 'line_callback' in self.__dict__:
+            return self.__dict__['line_callback']
+        for klass in type(self).__mro__:
+            if 'line_callback' in klass.__dict__:
+                callback = klass.__dict__['line_callback']
+                if isinstance(callback, staticmethod):
+                    callback = callback.__get__(None, klass)
+                return callback
+        return None
+
+    def _copy_lines(self, name, pipe, filename, tail):
+        callback = self._get_line_callback()
+        fp = open(filename, 'wt')
+        try:
+            for line in iter(pipe.readline, ''):
+                fp.write(line)
+                tail.append(line)
+                if callback is not None:
+                    try:
+                        callback(name, line)
+                    except Exception, e:
+                        warn('line callback failed: %s' % e)
+        finally:
+            fp.close()
+            pipe.close()
+
     def _exists_in_path(self, cmd):
         '''
         Based on a code snippet from http://orip.org/2009/08/python-checking-if-executable-exists-in.html
@@ -15,7 +15,6 @@ import os
 from glob import glob
 import numpy as np
 
-from nipype.externals.pynifti import load
 from nipype.utils.filemanip import fname_presuffix
 from nipype.interfaces.io import FreeSurferSource
 
@@ -358,6 +357,7 @@ class MRIConvert(FSCommand):
         return outfile
         
     def _list_outputs(self):
+        from nipype.externals.pynifti import load
         outputs = self.output_spec().get()
         outfile = self._get_outfilename()
         if isdefined(self.inputs.out_type):
@@ -590,6 +590,7 @@ class ReconAll(FSCommand):
     _cmd = 'recon-all'
     input_spec = ReconAllInputSpec
     output_spec = FreeSurferSource.output_spec
+    memory_gb = 3
 
     def _list_outputs(self):
         """
@@ -23,12 +23,10 @@ from nipype.interfaces.fsl.dti import (EddyCorrect, BEDPOSTX, DTIFit,
                                        FindTheBiggest)
 
 
-import nose
-
-
 def setup():
     print 'test setup'
     if no_fsl():
+        import nose
         raise nose.SkipTest
 
 def teardown():
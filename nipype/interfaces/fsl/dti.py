@@ -189,6 +189,7 @@ class BEDPOSTX(FSLCommand):
     input_spec = BEDPOSTXInputSpec
     output_spec = BEDPOSTXOutputSpec
     can_resume = True
+    memory_gb = 2
 
     def _run_interface(self, runtime):
         
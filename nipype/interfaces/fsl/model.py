@@ -25,7 +25,6 @@ from nipype.interfaces.base import (Bunch, load_template,
                                     InputMultiPath, OutputMultiPath)
 from nipype.utils.filemanip import (list_to_filename, filename_to_list,
                                     loadflat)
-from nipype.externals.pynifti import load
 from nipype.utils.misc import isdefined
 from nipype.interfaces.traits import Directory
 
@@ -247,6 +246,7 @@ class Level1Design(BaseInterface):
         return func_files
 
     def _run_interface(self, runtime):
+        from nipype.externals.pynifti import load
         cwd = os.getcwd()
         fsf_header = load_template('feat_header_l1.tcl')
         fsf_postscript = load_template('feat_nongui.tcl')
@@ -21,8 +21,6 @@ from nipype.interfaces.base import (TraitedSpec, File, InputMultiPath,
 from nipype.utils.filemanip import split_filename
 from nipype.utils.misc import isdefined
 
-from nipype.externals.pynifti import load
-
 
 warn = warnings.warn
 warnings.filterwarnings('always', category=UserWarning)
@@ -499,6 +497,7 @@ class MCFLIRT(FSLCommand):
     output_spec = MCFLIRTOutputSpec
 
     def _list_outputs(self):
+        from nipype.externals.pynifti import load
         cwd = os.getcwd()
         outputs = self._outputs().get()
 
@@ -686,6 +685,7 @@ class FNIRT(FSLCommand):
     _cmd = 'fnirt'
     input_spec = FNIRTInputSpec
     output_spec = FNIRTOutputSpec
+    memory_gb = 3
 
     out_map = dict(warped_file='_warped',
                    field_file='_field',
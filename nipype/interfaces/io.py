@@ -144,9 +144,9 @@ class DataSink(IOBase):
     def _substitute(self, pathstr):
         if isdefined(self.inputs.substitutions):
             for key, val in self.inputs.substitutions:
-                iflogger.debug(str((pathstr, key, val)))
+                iflogger.debug('%s', (pathstr, key, val))
                 pathstr = pathstr.replace(key, val)
-                iflogger.debug('new: ' + pathstr)
+                iflogger.debug('new: %s', pathstr)
         return pathstr
         
     def _list_outputs(self):
@@ -161,7 +161,7 @@ class DataSink(IOBase):
         if not os.path.exists(outdir):
             os.makedirs(outdir)
         for key,files in self.inputs._outputs.items():
-            iflogger.debug("key: %s files: %s"%(key, str(files)))
+            iflogger.debug("key: %s files: %s", key, files)
             files = filename_to_list(files)
             outfiles = []
             tempoutdir = outdir
@@ -178,7 +178,7 @@ class DataSink(IOBase):
                     path,_ = os.path.split(dst)
                     if not os.path.exists(path):
                         os.makedirs(path)
-                    iflogger.debug("copyfile: %s %s"%(src, dst))
+                    iflogger.debug("copyfile: %s %s", src, dst)
                     copyfile(src, dst, copy=True)
                 elif os.path.isdir(src):
                     dst = self._get_dst(os.path.join(src,''))
@@ -188,9 +188,9 @@ class DataSink(IOBase):
                     if not os.path.exists(path):
                         os.makedirs(path)
                     if os.path.exists(dst):
-                        iflogger.debug("removing: %s"%dst)
+                        iflogger.debug("removing: %s", dst)
                         shutil.rmtree(dst)
-                    iflogger.debug("copydir: %s %s"%(src, dst))
+                    iflogger.debug("copydir: %s %s", src, dst)
                     shutil.copytree(src, dst)
         return None
 
@@ -13,13 +13,11 @@ import re
 
 # Third-party imports
 import numpy as np
-from scipy.io import savemat
 
 # Local imports
 from nipype.interfaces.base import BaseInterface, traits, TraitedSpec,\
     InputMultiPath
 from nipype.utils.misc import isdefined
-from nipype.externals.pynifti import load
 from nipype.interfaces.matlab import MatlabCommand
 
 import nipype.utils.spm_docs as sd
@@ -29,6 +27,7 @@ logger = logging.getLogger('iflogger')
 
 def func_is_3d(in_file):
     """Checks if input functional files are 3d."""
+    from nipype.externals.pynifti import load
     
     if isinstance(in_file, list):
         return func_is_3d(in_file[0])
@@ -54,6 +53,7 @@ def scans_for_fname(fname):
     Opens images so will fail if they are not found.
     
     """
+    from nipype.externals.pynifti import load
     if isinstance(fname,list):
         scans = np.zeros((len(fname),),dtype=object)
         for sno,f in enumerate(fname):
@@ -359,6 +359,7 @@ class SPMCommand(BaseInterface):
             contents of a script called by matlab
             
         """
+        from scipy.io import savemat
         cwd = os.getcwd()
         mscript  = """
         %% Generated by nipype.interfaces.spm
@@ -20,7 +20,6 @@ from glob import glob
 
 # Third-party imports
 import numpy as np
-import scipy.io as sio
 
 # Local imports
 from nipype.interfaces.base import Bunch, traits, \
@@ -196,6 +195,7 @@ class EstimateModel(SPMCommand):
         return einputs
 
     def _list_outputs(self):
+        import scipy.io as sio
         outputs = self._outputs().get()
         pth, _ = os.path.split(self.inputs.spm_mat_file)
         mask = os.path.join(pth, 'mask.img')
@@ -343,6 +343,7 @@ class EstimateContrast(SPMCommand):
         return script
 
     def _list_outputs(self):
+        import scipy.io as sio
         outputs = self._outputs().get()
         pth, _ = os.path.split(self.inputs.spm_mat_file)
         spm = sio.loadmat(self.inputs.spm_mat_file)
@@ -617,6 +618,7 @@ class MultipleRegression(SPMCommand):
         return script
 
     def _list_outputs(self):
+        import scipy.io as sio
         outputs = self._outputs().get()
         pth = os.getcwd()
         spm = sio.loadmat(os.path.join(pth, 'SPM.mat'))
@@ -5,10 +5,12 @@ from nipype.testing import assert_equal, assert_not_equal, assert_raises, assert
 import os
 import tempfile
 import shutil
+import pickle
 from nipype.testing import (assert_equal, assert_not_equal, assert_raises,
                             assert_true, assert_false, with_setup, package_check, skipif)
 import nipype.interfaces.base as nib
 from nipype.interfaces.base import Undefined
+from nipype.interfaces.traits import start_stat_cache, stop_stat_cache
 from nipype.interfaces.base import InterfaceResult
 from nipype.utils.config import config
 
@@ -57,6 +59,14 @@ def test_bunch_hash():
     fp.close()
     yield assert_equal, newbdict['infile'][0][1], jshash.hexdigest()
     yield assert_equal, newbdict['yat'], True
+    # the digest option does not change bunch hashes
+    config.set('execution', 'hash_digest', 'sha1')
+    try:
+        newbdict, bhash = b._get_bunch_hash()
+    finally:
+        config.set('execution', 'hash_digest', 'md5')
+    yield assert_equal, bhash, 'ddcc7b4ec5675df8cf317a48bd1857fa'
+    yield assert_equal, newbdict['infile'][0][1], jshash.hexdigest()
 
 
 # create a temp file
@@ -115,6 +125,53 @@ def test_TraitedSpec_withFile():
         yield assert_equal, infields.hashval[1], '8c227fb727c32e00cd816c31d8fea9b9'
     teardown_file(tmpd)
     
+def test_TraitedSpec_hashval_cache():
+    tmp_infile = setup_file()
+    tmpd, nme = os.path.split(tmp_infile)
+    class spec3(nib.TraitedSpec):
+        moo = nib.File(exists=True)
+        doo = nib.traits.List(nib.traits.Int)
+    infields = spec3(moo=tmp_infile, doo=[1])
+    hashval = infields.hashval
+    yield assert_true, infields.hashval is hashval
+    infields.doo.append(2)
+    yield assert_equal, infields.hashval[0]['doo'], [1, 2]
+    infields.moo = Undefined
+    yield assert_equal, infields.hashval[0], {'doo': [1, 2]}
+    infields.moo = tmp_infile
+    hashval = infields.hashval
+    # rewriting the file invalidates the cached hash
+    open(tmp_infile, 'w').writelines('abcdefghijklmnop')
+    yield assert_not_equal, infields.hashval[1], hashval[1]
+    # copies do not share the cache but are invalidated as well
+    from copy import deepcopy
+    dup = deepcopy(infields)
+    yield assert_equal, dup.hashval, infields.hashval
+    dup.doo = [3]
+    yield assert_not_equal, dup.hashval[1], infields.hashval[1]
+    teardown_file(tmpd)
+
+def test_stat_cache():
+    tmp_infile = setup_file()
+    tmpd, nme = os.path.split(tmp_infile)
+    class spec4(nib.TraitedSpec):
+        moo = nib.File(exists=True)
+        doo = nib.traits.List(nib.Directory(exists=True))
+    infields = spec4()
+    start_stat_cache()
+    try:
+        infields.moo = tmp_infile
+        infields.doo = [tmpd, tmpd]
+        os.remove(tmp_infile)
+        # the removal is not seen while the cache is active
+        infields.moo = tmp_infile
+        yield assert_equal, infields.moo, tmp_infile
+    finally:
+        stop_stat_cache()
+    yield assert_raises, nib.traits.TraitError, setattr, infields, 'moo', \
+        tmp_infile
+    teardown_file(tmpd)
+
 def test_Interface():
     yield assert_equal, nib.Interface.input_spec, None
     yield assert_equal, nib.Interface.output_spec, None
@@ -205,6 +262,17 @@ def test_Commandline():
     res = ci3.run()
     yield assert_equal, res.runtime.environ['MYENV'], 'foo'
     yield assert_equal, res.outputs, None
+    # only whitelisted variables are recorded, but the command still
+    # gets the full environment
+    config.set('execution', 'environ_whitelist', 'PATH')
+    try:
+        ci4 = nib.CommandLine(command='echo', args='$HOME $MYENV')
+        ci4.inputs.environ = {'MYENV' : 'foo'}
+        res = ci4.run()
+    finally:
+        config.set('execution', 'environ_whitelist', '')
+    yield assert_equal, sorted(res.runtime.environ.keys()), ['MYENV', 'PATH']
+    yield assert_equal, res.runtime.stdout.split(), [os.environ['HOME'], 'foo']
 
     class CommandLineInputSpec1(nib.CommandLineInputSpec):
         foo = nib.traits.Str(argstr='%s', desc='a str')
@@ -241,3 +309,83 @@ def test_Commandline():
     ci6 = DerivedClass(command='cmd')
     yield assert_equal, ci6._parse_inputs()[0], 'filename'
     nib.CommandLine.input_spec = nib.CommandLineInputSpec
+
+@skipif(not os.path.isdir('/proc'))
+def test_Commandline_peak_rss():
+    # memory held by the interpreter is not counted for the command
+    held = ' ' * (200 * 1024 ** 2)
+    config.set('execution', 'use_runtime_history', 'true')
+    config.set('execution', 'profile_interval', '0.05')
+    try:
+        res = nib.CommandLine(command='sleep', args='0.3').run()
+    finally:
+        config.set('execution', 'use_runtime_history', 'false')
+        config.set('execution', 'profile_interval', '1')
+    del held
+    yield assert_true, 0 < res.runtime.peak_rss < 100
+    # the other resource fields are only recorded by profile_runtime
+    yield assert_equal, getattr(res.runtime, 'cpu_user', None), None
+
+streamed_lines = []
+
+def _collect_line(name, line):
+    streamed_lines.append((name, line))
+
+def test_Commandline_stream_output():
+    tmpdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(tmpdir)
+    del streamed_lines[:]
+    config.set('execution', 'stream_output', 'true')
+    config.set('execution', 'output_tail_lines', '2')
+    try:
+        ci = nib.CommandLine(command='seq', args='5')
+        ci.line_callback = _collect_line
+        res = ci.run()
+        # the results (with a copy of the interface) can be pickled
+        pickled = pickle.dumps(res)
+        stdout = open(res.runtime.stdout_file).read()
+        ci2 = nib.CommandLine(command='ls', args='not_a_file')
+        res2 = ci2.run()
+    finally:
+        config.set('execution', 'stream_output', 'false')
+        config.set('execution', 'output_tail_lines', '100')
+        os.chdir(cwd)
+    # the full output is in the log file, only the tail in memory
+    yield assert_equal, res.runtime.stdout, '4\n5\n'
+    yield assert_equal, res.runtime.stdout_file, \
+        os.path.join(tmpdir, 'stdout.log')
+    yield assert_equal, stdout, '1\n2\n3\n4\n5\n'
+    yield assert_equal, streamed_lines, \
+        [('stdout', '%d\n' % i) for i in range(1, 6)]
+    yield assert_equal, pickle.loads(pickled).interface.line_callback, \
+        _collect_line
+    yield assert_equal, res.runtime.returncode, 0
+    yield assert_true, res2.runtime.returncode != 0
+    yield assert_true, 'not_a_file' in open(res2.runtime.stderr_file).read()
+    shutil.rmtree(tmpdir)
+
+class SeqCommand(nib.CommandLine):
+    _cmd = 'seq'
+    line_callback = _collect_line
+
+class StaticSeqCommand(nib.CommandLine):
+    _cmd = 'seq'
+    line_callback = staticmethod(_collect_line)
+
+def test_Commandline_line_callback_subclass():
+    tmpdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(tmpdir)
+    del streamed_lines[:]
+    config.set('execution', 'stream_output', 'true')
+    try:
+        SeqCommand(args='2').run()
+        StaticSeqCommand(args='1').run()
+    finally:
+        config.set('execution', 'stream_output', 'false')
+        os.chdir(cwd)
+    # class attributes are called without the interface
+    yield assert_equal, streamed_lines, \
+        [('stdout', '1\n'), ('stdout', '2\n'), ('stdout', '1\n')]
+    shutil.rmtree(tmpdir)
@@ -18,6 +18,56 @@ all of these bugs and they've been fixed in enthought svn repository
 
 import enthought.traits.api as traits
 import os
+import stat
+
+# path -> mode of the path (or None if it does not exist), while a stat
+# cache is active
+_stat_cache = None
+_stat_cache_users = 0
+
+def start_stat_cache():
+    """Reuse the results of existence checks of files and directories
+    until `stop_stat_cache` is called
+
+    Used while a batch of inputs is set from the outputs of a node, so
+    that each path is checked once instead of once per input it is
+    assigned to. Calls can be nested.
+    """
+    global _stat_cache, _stat_cache_users
+    if _stat_cache is None:
+        _stat_cache = {}
+    _stat_cache_users += 1
+
+def stop_stat_cache():
+    """Stop reusing the results of existence checks
+    """
+    global _stat_cache, _stat_cache_users
+    _stat_cache_users -= 1
+    if _stat_cache_users <= 0:
+        _stat_cache = None
+        _stat_cache_users = 0
+
+def _path_mode(path):
+    """Return the mode of a path or None if it does not exist
+    """
+    cache = _stat_cache
+    if cache is not None and path in cache:
+        return cache[path]
+    try:
+        mode = os.stat(path).st_mode
+    except (OSError, TypeError, ValueError):
+        mode = None
+    if cache is not None:
+        cache[path] = mode
+    return mode
+
+def _isfile(path):
+    mode = _path_mode(path)
+    return mode is not None and stat.S_ISREG(mode)
+
+def _isdir(path):
+    mode = _path_mode(path)
+    return mode is not None and stat.S_ISDIR(mode)
 
 class BaseFile ( traits.BaseStr ):
     """ Defines a trait whose value must be the name of a file.
@@ -66,7 +116,7 @@ class BaseFile ( traits.BaseStr ):
         validated_value = super( BaseFile, self ).validate( object, name, value )
         if not self.exists:
             return validated_value
-        elif os.path.isfile( value ):
+        elif _isfile( value ):
             return validated_value
 
         self.error( object, name, value )
@@ -154,7 +204,7 @@ class BaseDirectory ( traits.BaseStr ):
         if not self.exists:
             return validated_value
 
-        if os.path.isdir( value ):
+        if _isdir( value ):
             return validated_value
 
         self.error( object, name, value )
@@ -0,0 +1,240 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Crash records of workflow nodes
+
+When a node fails, the workflow writes a small record of the failure to
+``crash-<time>-<user>-<node>.pklz`` (a gzip compressed pickle) in the
+`crashdump_dir` or the current directory. A record is a dict with the
+fields
+
+    node : the name of the node (as in the execution graph)
+    host, user, time : where and when the node failed
+    interface : class name of the interface of the node
+    inputs : the values of the defined inputs of the node
+    iterfield : the iterated inputs of a MapNode or None
+    upstream : the names of the nodes the node depends on
+    edges : the connections among the upstream nodes and the node
+    signature : digest of the code locations in the traceback
+    exception : the last line of the traceback
+    traceback : the traceback or None if it is the same as that of
+        `duplicate_of`
+    duplicate_of : the first crash file with the same signature or None
+
+Tracebacks with the same signature have the same cause (e.g., a missing
+license fails every subject at the same place), so only the first one
+in a directory is stored. Records are written by a background thread,
+so reporting a crash does not hold up the scheduler; `flush` waits until
+all records are written and ends the deduplication, so every run stores
+the tracebacks of its own crashes.
+
+The crashes in a directory can be summarized by cause with::
+
+    python -m nipype.pipeline.crash [directory]
+"""
+
+import cPickle
+from glob import glob
+import gzip
+import logging
+import os
+import re
+import sys
+from optparse import OptionParser
+from Queue import Queue
+from threading import Lock, Thread
+
+from nipype.utils.filemanip import md5
+
+logger = logging.getLogger('workflow')
+
+_location = re.compile(r'^\s*File "(.*)", line (\d+), in (.*)$')
+
+
+def crash_signature(traceback):
+    """Return a digest of the code locations and the exception type of a
+    traceback
+
+    The exception message, which often names the inputs of the failing
+    node, is left out.
+    """
+    lines = ''.join(traceback).splitlines()
+    locations = [line.strip() for line in lines if _location.match(line)]
+    exception = ''
+    if lines:
+        exception = lines[-1].split(':')[0]
+    return md5('\n'.join(locations + [exception])).hexdigest()
+
+def upstream_graph(graph, node):
+    """Return the names of the nodes `node` depends on and the edges among
+    them and `node`
+    """
+    upstream = set()
+    stack = [node]
+    while stack:
+        for parent in graph.predecessors_iter(stack.pop()):
+            if parent not in upstream:
+                upstream.add(parent)
+                stack.append(parent)
+    edges = []
+    for child in list(upstream) + [node]:
+        edges.extend([(str(parent), str(child)) for parent in \
+                          graph.predecessors_iter(child)])
+    return sorted([str(parent) for parent in upstream]), sorted(edges)
+
+def save_crashfile(filename, record):
+    """Write a crash record
+    """
+    tmpfile = '%s.%d.tmp' % (filename, os.getpid())
+    fp = gzip.open(tmpfile, 'wb')
+    try:
+        cPickle.dump(record, fp, cPickle.HIGHEST_PROTOCOL)
+    finally:
+        fp.close()
+    os.rename(tmpfile, filename)
+
+def load_crashfile(filename):
+    """Return the crash record stored in a file
+    """
+    fp = gzip.open(filename, 'rb')
+    try:
+        return cPickle.load(fp)
+    finally:
+        fp.close()
+
+def crash_interface(record):
+    """Return the interface of a crash record with its inputs set
+
+    Running the interface re-creates the crash. The iterated inputs of
+    MapNodes are lists and are left for the caller to set.
+    """
+    modname, _, clsname = record['interface'].rpartition('.')
+    __import__(modname)
+    interface = getattr(sys.modules[modname], clsname)()
+    for key, val in record['inputs'].items():
+        if key not in (record['iterfield'] or []):
+            setattr(interface.inputs, key, val)
+    return interface
+
+
+class CrashWriter(Thread):
+    """Writes crash records in the background
+
+    Records with the signature of an earlier record in the same
+    directory are written without their traceback until `flush` is
+    called.
+    """
+
+    def __init__(self):
+        Thread.__init__(self)
+        self.setDaemon(True)
+        self._queue = Queue()
+        # (directory, signature) -> the first crash file with the signature
+        self._signatures = {}
+
+    def write(self, filename, record):
+        """Queue a crash record for writing
+        """
+        key = (os.path.dirname(os.path.abspath(filename)),
+               record['signature'])
+        first = self._signatures.setdefault(key, filename)
+        if first != filename:
+            record['duplicate_of'] = first
+            record['traceback'] = None
+        self._queue.put((filename, record))
+
+    def run(self):
+        while True:
+            filename, record = self._queue.get()
+            try:
+                save_crashfile(filename, record)
+            except Exception, e:
+                logger.error('Could not write crash file %s: %s', filename,
+                             e)
+            self._queue.task_done()
+
+    def flush(self):
+        """Wait until all queued records are written and forget their
+        signatures
+        """
+        self._queue.join()
+        self._signatures.clear()
+
+_writer = None
+_writer_lock = Lock()
+
+def write_crashfile(filename, record):
+    """Write a crash record in the background
+    """
+    global _writer
+    _writer_lock.acquire()
+    try:
+        # the thread does not survive a fork
+        if _writer is None or not _writer.isAlive():
+            _writer = CrashWriter()
+            _writer.start()
+        _writer.write(filename, record)
+    finally:
+        _writer_lock.release()
+
+def flush():
+    """Wait until all crash records are written
+
+    Later records store their traceback even if an earlier one had the
+    same signature.
+    """
+    if _writer is not None and _writer.isAlive():
+        _writer.flush()
+
+def summarize(filenames):
+    """Group crash records by the signature of their traceback
+
+    Returns a list of dicts with the fields `signature`, `count`,
+    `nodes`, `crashfile` (the file with the traceback), `traceback` and
+    `exception` (of that traceback), with the most frequent cause first.
+    """
+    groups = {}
+    for filename in sorted(filenames):
+        try:
+            record = load_crashfile(filename)
+        except Exception, e:
+            logger.debug('Could not read crash file %s: %s', filename, e)
+            continue
+        group = groups.setdefault(record['signature'],
+                                  dict(signature=record['signature'],
+                                       exception=record['exception'],
+                                       count=0, nodes=[], crashfile=None,
+                                       traceback=None))
+        group['count'] += 1
+        group['nodes'].append(record['node'])
+        if group['traceback'] is None and record['traceback']:
+            group['crashfile'] = filename
+            group['traceback'] = record['traceback']
+            group['exception'] = record['exception']
+    return sorted(groups.values(), key=lambda group: -group['count'])
+
+def main(args=None):
+    """Print the crashes in a directory grouped by cause
+    """
+    parser = OptionParser(usage='%prog [options] [directory]')
+    parser.add_option('-t', '--traceback', action='store_true',
+                      default=False, help='print a traceback of each cause')
+    options, args = parser.parse_args(args)
+    directory = os.getcwd()
+    if args:
+        directory = args[0]
+    groups = summarize(glob(os.path.join(directory, 'crash-*.pklz')))
+    if not groups:
+        print 'No crash files in %s' % directory
+    for group in groups:
+        nodes = ', '.join(group['nodes'][:3])
+        if group['count'] > 3:
+            nodes += ', ...'
+        print '%d crashes: %s' % (group['count'], group['exception'])
+        print '    nodes: %s' % nodes
+        print '    crash file: %s' % group['crashfile']
+        if options.traceback and group['traceback']:
+            print ''.join(['    ' + line for line in \
+                               ''.join(group['traceback']).splitlines(True)])
+
+if __name__ == '__main__':
+    main()
@@ -12,64 +12,118 @@ The `Pipeline` class provides core functionality for batch processing.
 
 """
 
-from copy import deepcopy
-import logging.handlers
+from copy import copy, deepcopy
+from heapq import heapify, heappop, heappush
+import logging
 import os
 import pwd
 from shutil import rmtree
 from socket import gethostname
 import sys
 from tempfile import mkdtemp
-from time import sleep, strftime
+from time import strftime, time
 from traceback import format_exception
 from warnings import warn
 
-from enthought.traits.trait_handlers import TraitDictObject, TraitListObject
 import numpy as np
 
 from nipype.utils.misc import package_check
 import shutil
 package_check('networkx', '1.0')
 import networkx as nx
-try:
-    from IPython.kernel.contexts import ConnectionRefusedError
-except:
-    pass
 
 from nipype.interfaces.base import (traits, File, Directory, InputMultiPath,
                                     CommandLine, Undefined,
                                     OutputMultiPath, TraitedSpec,
                                     DynamicTraitedSpec,
                                     Bunch, InterfaceResult)
+from nipype.interfaces.traits import start_stat_cache, stop_stat_cache
 from nipype.utils.misc import isdefined
 from nipype.utils.filemanip import (save_json, FileNotFoundError,
                                     filename_to_list, list_to_filename,
                                     copyfiles, fnames_presuffix)
 
 from nipype.pipeline.utils import (_generate_expanded_graph,
-                                   _create_pickleable_graph, export_graph,
-                                   _report_nodes_not_run, make_output_dir)
+                                   export_graph,
+                                   _report_nodes_not_run, make_output_dir,
+                                   save_resultfile, load_resultfile,
+                                   critical_path_lengths, _existing_files,
+                                   PROFILE_FIELDS, _copy_graph)
+from nipype.pipeline.plugins import get_plugin, run_node
+from nipype.pipeline.journal import ExecutionJournal, fingerprint
+from nipype.pipeline.crash import (crash_signature, upstream_graph,
+                                   write_crashfile, flush as flush_crashfiles)
 from nipype.utils.config import config
+from nipype.utils.runtimedb import (get_runtime_history, interface_name,
+                                    input_signature)
+from nipype.utils.environ import environ_snapshot
+from nipype.utils.logs import (setup_logging, log_event, QueueListener,
+                               init_worker_logging)
 
-#Sets up logging for pipeline and nodewrapper execution
-LOG_FILENAME = 'pypeline.log'
-logging.basicConfig()
 logger = logging.getLogger('workflow')
 fmlogger = logging.getLogger('filemanip')
 iflogger = logging.getLogger('interface')
-hdlr = logging.handlers.RotatingFileHandler(LOG_FILENAME,
-                                            maxBytes=256000,
-                                            backupCount=4)
-formatter = logging.Formatter(fmt='%(asctime)s,%(msecs)d %(name)-2s '\
-                                  '%(levelname)-2s:\n\t %(message)s',
-                              datefmt='%y%m%d-%H:%M:%S')
-hdlr.setFormatter(formatter)
-logger.addHandler(hdlr)
-logger.setLevel(logging.getLevelName(config.get('logging','workflow_level')))
-fmlogger.addHandler(hdlr)
-fmlogger.setLevel(logging.getLevelName(config.get('logging','filemanip_level')))
-iflogger.addHandler(hdlr)
-iflogger.setLevel(logging.getLevelName(config.get('logging','interface_level')))
+
+_immutable_types = (str, unicode, int, long, float, bool, type(None))
+
+def _copy_value(value):
+    """Return a copy of an input value that shares no mutable state
+
+    Strings, numbers and tuples of them are returned as is, lists and
+    dicts (including those of traits) are copied item by item and other
+    objects are deep-copied.
+    """
+    if isinstance(value, _immutable_types):
+        return value
+    if isinstance(value, list):
+        if all([isinstance(val, _immutable_types) for val in value]):
+            return list(value)
+        return [_copy_value(val) for val in value]
+    if isinstance(value, tuple):
+        if all([isinstance(val, _immutable_types) for val in value]):
+            return value
+        return tuple([_copy_value(val) for val in value])
+    if isinstance(value, dict):
+        return dict([(key, _copy_value(val)) for key, val in value.items()])
+    return deepcopy(value)
+
+def _make_runtime(returncode):
+    """Return the runtime of a result that was not produced by running
+    an interface (e.g., a failed or a cached run)
+    """
+    environ_digest, environ = environ_snapshot()
+    return Bunch(returncode=returncode, environ=environ,
+                 environ_digest=environ_digest, hostname=gethostname())
+
+def _run_item(item):
+    """Run an (index, node) item of a MapNode in a worker process
+    """
+    return item[0], run_node(item[1])
+
+def _get_profile(runtime):
+    """Return the duration and resource use recorded in a runtime
+    """
+    profile = dict(duration=getattr(runtime, 'duration', None))
+    for key in PROFILE_FIELDS:
+        profile[key] = getattr(runtime, key, None)
+    return profile
+
+def _sum_profiles(profiles):
+    """Combine the resource use of several runs: peaks are maximized, all
+    other values are added up
+    """
+    total = {}
+    for profile in profiles:
+        for key, value in profile.items():
+            if value is None:
+                total.setdefault(key, None)
+            elif total.get(key) is None:
+                total[key] = value
+            elif key in ['peak_rss', 'num_threads']:
+                total[key] = max(total[key], value)
+            else:
+                total[key] += value
+    return total
 
 class WorkflowBase(object):
     """ Define common attributes and functions for workflows and nodes
@@ -120,6 +174,7 @@ class WorkflowBase(object):
             self._flatgraph = None
         if hasattr(self, '_execgraph'):
             self._execgraph = None
+            self._execindex = None
         clone = deepcopy(self)
         clone.name = name
         clone._id = name
@@ -174,9 +229,9 @@ class WorkflowBase(object):
                                          exc_traceback)
         timeofcrash = strftime('%Y%m%d-%H%M%S')
         login_name = pwd.getpwuid(os.geteuid())[0]
-        crashfile = 'crash-%s-%s-%s.npz' % (timeofcrash,
-                                            login_name,
-                                            name)
+        crashfile = 'crash-%s-%s-%s.pklz' % (timeofcrash,
+                                             login_name,
+                                             name)
         if hasattr(self, 'config') and ('crashdump_dir' in self.config.keys()):
             if not os.path.exists(self.config['crashdump_dir']):
                 os.makedirs(self.config['crashdump_dir'])
@@ -184,11 +239,25 @@ class WorkflowBase(object):
                                      crashfile)
         else:
             crashfile = os.path.join(os.getcwd(), crashfile)
-        pklgraph = _create_pickleable_graph(execgraph,
-                                            show_connectinfo=True)
-        logger.info('Saving crash info to %s' % crashfile)
-        logger.info(''.join(traceback))
-        np.savez(crashfile, node=self, execgraph=pklgraph, traceback=traceback)
+        upstream, edges = [], []
+        if execgraph is not None and self in execgraph:
+            upstream, edges = upstream_graph(execgraph, self)
+        inputs = {}
+        interface = getattr(self, '_interface', None)
+        if interface is not None:
+            inputs = _copy_value(self._get_input_values())
+            interface = interface_name(interface)
+        lines = ''.join(traceback).splitlines()
+        record = dict(node=str(self), host=host, user=login_name,
+                      time=timeofcrash, interface=interface, inputs=inputs,
+                      iterfield=getattr(self, 'iterfield', None),
+                      upstream=upstream, edges=edges,
+                      signature=crash_signature(traceback),
+                      exception=(lines or [''])[-1], traceback=traceback,
+                      duplicate_of=None)
+        logger.info('Saving crash info to %s', crashfile)
+        logger.info('%s', ''.join(traceback))
+        write_crashfile(crashfile, record)
         return crashfile
 
 class Workflow(WorkflowBase):
@@ -198,22 +267,28 @@ class Workflow(WorkflowBase):
     def __init__(self, **kwargs):
         super(Workflow, self).__init__(**kwargs)
         self._graph = nx.DiGraph()
-        self.ipyclient = None
-        self.taskclient = None
-        try:
-            name = 'IPython.kernel.client'
-            __import__(name)
-            self.ipyclient = sys.modules[name]
-        except ImportError:
-            warn("Ipython kernel not found.  Parallel execution will be" \
-                     "unavailable", ImportWarning)
         # attributes for running with manager
         self.procs = None
-        self.depidx = None
+        self.procidx = None
+        self.indegree = None
+        self.readytorun = None
         self.proc_done = None
         self.proc_pending = None
         self._flatgraph = None
         self._execgraph = None
+        # incremented by every change of the graph; the flat graph is
+        # cached until a (sub)workflow changes
+        self._version = 0
+        self._flatkey = None
+        # node of the flat graph -> node of the workflow it was copied from
+        self._flatorigins = None
+        # name -> node of the nodes of the graph
+        self._nodenames = {}
+        # (execution graph, str(node) -> node) of the last execution graph
+        self._execindex = None
+        # journal of the current run and its completed nodes
+        self._journal = None
+        self._journaled = {}
 
     # PUBLIC API
 
@@ -261,18 +336,18 @@ class Workflow(WorkflowBase):
             connection_list = [(args[0], args[2], [(args[1], args[3])])]
         else:
             raise Exception('unknown set of parameters to connect function')
+        self._version += 1
         not_found = []
         newnodes = []
         for srcnode, destnode, _ in connection_list:
-            if (srcnode not in newnodes) and (srcnode not in self._graph.nodes()):
-                newnodes.append(srcnode)
-            if (destnode not in newnodes) and (destnode not in self._graph.nodes()):
-                newnodes.append(destnode)
+            newnodes.extend([srcnode, destnode])
+        newnodes = self._new_nodes(newnodes)
         if newnodes:
             self._check_nodes(newnodes)
             for node in newnodes:
                 if node._hierarchy is None:
                     node._hierarchy = self.name
+            self._index_nodes(newnodes)
         for srcnode, destnode, connects in connection_list:
             for source, dest in connects:
                 # Currently datasource/sink/grabber.io modules
@@ -303,19 +378,18 @@ class Workflow(WorkflowBase):
         for srcnode, destnode, connects in connection_list:
             edge_data = self._graph.get_edge_data(srcnode, destnode, None)
             if edge_data:
-                logger.debug('(%s, %s): Edge data exists: %s' % \
-                                 (srcnode, destnode, str(edge_data)))
+                logger.debug('(%s, %s): Edge data exists: %s',
+                             srcnode, destnode, edge_data)
                 for data in connects:
                     if data not in edge_data['connect']:
                         edge_data['connect'].append(data)
                 self._graph.add_edges_from([(srcnode, destnode, edge_data)])
             else:
-                logger.debug('(%s, %s): No edge data' % (srcnode, destnode))
+                logger.debug('(%s, %s): No edge data', srcnode, destnode)
                 self._graph.add_edges_from([(srcnode, destnode,
                                              {'connect': connects})])
-            edge_data = self._graph.get_edge_data(srcnode, destnode, None)
-            logger.debug('(%s, %s): new edge data: %s'% (srcnode, destnode,
-                                                         str(edge_data)))
+            logger.debug('(%s, %s): new edge data: %s', srcnode, destnode,
+                         self._graph.get_edge_data(srcnode, destnode, None))
 
     def add_nodes(self, nodes):
         """ Wraps the networkx functionality in a more semantically
@@ -326,10 +400,11 @@ class Workflow(WorkflowBase):
         nodes : list
             A list of WorkflowBase-based objects
         """
-        newnodes = [node for node in nodes if node not in self._graph.nodes()]
+        newnodes = self._new_nodes(nodes)
         if not newnodes:
             logger.debug('no new nodes to add')
             return
+        self._version += 1
         for node in newnodes:
             if not issubclass(node.__class__, WorkflowBase):
                 raise Exception('Node %s must be a subclass of WorkflowBase' % str(node))
@@ -338,6 +413,7 @@ class Workflow(WorkflowBase):
             if node._hierarchy is None:
                 node._hierarchy = self.name
         self._graph.add_nodes_from(newnodes)
+        self._index_nodes(newnodes)
 
     @property
     def inputs(self):
@@ -353,22 +429,27 @@ class Workflow(WorkflowBase):
         return None
         
     def get_exec_node(self, name):
+        """Return a node of the execution graph by its full name (e.g.,
+        ``pipe.subpipe.mod1``)
+        """
         if self._execgraph:
-            return [node  for node in self._execgraph.nodes() if name == str(node)].pop()
+            if self._execindex is None or \
+                    self._execindex[0] is not self._execgraph:
+                # the index is rebuilt whenever the graph is regenerated
+                self._execindex = (self._execgraph,
+                                   dict([(str(node), node) for node in \
+                                             self._execgraph.nodes()]))
+            return self._execindex[1][name]
         return None
 
     def get_node(self, name):
         """Return an internal node by name
         """
         nodenames = name.split('.')
-        nodename = nodenames[0]
-        outnode = [node for node in self._graph.nodes() if str(node).endswith(nodename)]
-        if outnode:
-            outnode = outnode[0]
-            if nodenames[1:] and issubclass(outnode.__class__, Workflow):
+        outnode = self._nodenames.get(nodenames[0])
+        if outnode is not None and nodenames[1:]:
+            if issubclass(outnode.__class__, Workflow):
                 outnode = outnode.get_node('.'.join(nodenames[1:]))
-        else:
-            outnode = None
         return outnode
 
     def write_graph(self, dotfilename='graph.dot', graph2use='orig'):
@@ -383,10 +464,10 @@ class Workflow(WorkflowBase):
         if graph2use == 'exec':
             graph = self._execgraph
             if graph is None:
-                graph = _generate_expanded_graph(deepcopy(self._flatgraph))
+                graph = _generate_expanded_graph(self._copy_flat_graph())
         export_graph(graph, self.base_dir, dotfilename=dotfilename)
 
-    def run(self, inseries=False):
+    def run(self, inseries=False, plugin=None, plugin_args=None):
         """ Execute the workflow
 
         Parameters
@@ -394,59 +475,264 @@ class Workflow(WorkflowBase):
         
         inseries: Boolean
             Execute workflow in series
+        plugin: string
+            Execution plugin used to run the workflow in parallel
+            ('ipython', 'multiproc', 'batch' or 'linear'). Defaults to the `plugin`
+            option of the `execution` section of the config file.
+        plugin_args: dict
+            Options passed on to the execution plugin (e.g., n_procs)
         """
+        setup_logging()
         self._create_flat_graph()
-        self._execgraph = _generate_expanded_graph(deepcopy(self._flatgraph))
+        self._execgraph = _generate_expanded_graph(self._copy_flat_graph())
         for node in self._execgraph.nodes():
             node.config = self.config
+        self._journal = None
+        self._journaled = {}
+        if self.base_dir is not None and \
+                config.getboolean('execution', 'use_journal'):
+            self._journal = ExecutionJournal(os.path.join(self.base_dir,
+                                                          self.name,
+                                                          'journal.jsonl'))
+            self._journaled = self._journal.completed()
+        if plugin is None:
+            plugin = config.get('execution', 'plugin')
         if inseries == True:
-            self._execute_in_series()
-        else:
-            self._execute_with_manager()
+            plugin = 'linear'
+        log_event('workflow_start', workflow=self.name, plugin=plugin,
+                  nodes=self._execgraph.number_of_nodes())
+        try:
+            if plugin == 'linear':
+                self._execute_in_series()
+            else:
+                self._execute_with_manager(plugin, plugin_args)
+        finally:
+            # crash files are written in the background
+            flush_crashfiles()
+            log_event('workflow_end', workflow=self.name)
+        if config.getboolean('execution', 'profile_runtime'):
+            self._write_resource_profile()
         
+    def plan(self):
+        """ Predict which nodes a run of the workflow would execute
+
+        The execution graph is walked in topological order. The inputs of
+        each node are set from the stored results of its upstream nodes,
+        which determines the hash of the node and thus whether a previous
+        result can be reused. Nodes downstream of a node that executes
+        are assumed to execute as well. No interface is run and nothing
+        is written to disk.
+
+        Returns
+        -------
+        plan : list of dicts, in execution order, with the fields
+
+            node : the name of the node (as in crash files)
+            status : 'skip' if a previous result will be reused, 'run'
+                otherwise
+            duration : estimated duration (in seconds) of the node, taken
+                from a previous run or from the runtime history, or None
+                if unknown. Zero for skipped nodes.
+        """
+        self._create_flat_graph()
+        # the graph and its nodes are copies, so the nodes of the last run
+        # are left alone
+        graph = _generate_expanded_graph(self._copy_flat_graph())
+        plan = []
+        cached = {}
+        estimates = {}
+        for node in nx.topological_sort(graph):
+            node.config = self.config
+            status = 'run'
+            if self.base_dir is not None and \
+                    all([cached.get(parent) for parent in \
+                             graph.predecessors_iter(node)]):
+                for parent, _, data in graph.in_edges_iter(node, data=True):
+                    for sourceinfo, destname in data['connect']:
+                        self._set_node_input(node, destname, parent,
+                                             sourceinfo)
+                node.base_dir = self._get_output_directory_base(node)
+                skip, result = node._get_cached_result()
+                if skip:
+                    status = 'skip'
+                if result is not None:
+                    node._result = result
+                    cached[node] = True
+            duration = 0
+            if status == 'run':
+                duration = self._get_duration(node, estimates)
+            plan.append(dict(node=str(node), status=status,
+                             duration=duration))
+        nrun = len([item for item in plan if item['status'] == 'run'])
+        known = [item['duration'] for item in plan \
+                     if item['duration'] is not None]
+        logger.info('Plan: %d of %d nodes will run, estimated duration '
+                    '%.0f seconds (%d nodes without estimate)', nrun,
+                    len(plan), sum(known), len(plan) - len(known))
+        return plan
+
     # PRIVATE API AND FUNCTIONS
 
+    def _write_resource_profile(self):
+        """Write the resource use of all nodes and its totals to
+        resource_profile.json in the workflow directory
+        """
+        nodes = {}
+        total = dict(duration=0.)
+        for node in self._execgraph.nodes():
+            if node.result is None or not node.result.runtime:
+                continue
+            runtimes = node.result.runtime
+            if not isinstance(runtimes, list):
+                runtimes = [runtimes]
+            profile = _sum_profiles([_get_profile(runtime) \
+                                         for runtime in runtimes])
+            nodes[str(node)] = profile
+            total = _sum_profiles([total, profile])
+        outdir = os.path.join(self.base_dir, self.name)
+        if not os.path.exists(outdir):
+            os.makedirs(outdir)
+        save_json(os.path.join(outdir, 'resource_profile.json'),
+                  dict(nodes=nodes, total=total))
+
+    def _resume_node(self, node):
+        """Take the result of a node from the journal of a previous run
+
+        Returns True if the node completed before with the same input
+        values (see :mod:`nipype.pipeline.journal`).
+        """
+        entry = self._journaled.get(str(node))
+        if entry is None or entry['outputs'] is None or node.overwrite or \
+                entry['fingerprint'] != node._get_fingerprint():
+            return False
+        try:
+            outputs = node._restore_outputs(entry['outputs'])
+        except Exception, e:
+            logger.debug('Could not restore outputs of %s: %s', node, e)
+            return False
+        runtime = _make_runtime(returncode=0)
+        if entry['start'] is not None:
+            runtime.duration = entry['end'] - entry['start']
+        node._result = InterfaceResult(interface=None, runtime=runtime,
+                                       outputs=outputs)
+        logger.info('Resuming %s from the journal', node)
+        log_event('node_resume', node=str(node))
+        return True
+
+    def _journal_node(self, node, status, start=None, crashfile=None):
+        """Record the outcome of running a node in the event log and the
+        journal
+        """
+        duration = None
+        if start is not None:
+            duration = time() - start
+        log_event('node_' + status, node=str(node), hash=node._hashvalue,
+                  duration=duration, crashfile=crashfile)
+        if self._journal is None:
+            return
+        outputs = None
+        if status == 'done' and node._result is not None and \
+                node._result.outputs is not None:
+            # MapNodes collect their outputs in a Bunch
+            if isinstance(node._result.outputs, Bunch):
+                values = node._result.outputs.dictcopy()
+            else:
+                values = node._result.outputs.get()
+            outputs = dict([(key, val) for key, val in values.items() \
+                                if isdefined(val)])
+        outputdir = None
+        if node.base_dir is not None:
+            outputdir = node._output_directory()
+        self._journal.record(str(node), status, node._get_fingerprint(),
+                             hashvalue=node._hashvalue, outputs=outputs,
+                             outputdir=outputdir, crashfile=crashfile,
+                             start=start)
+
     def _check_nodes(self, nodes):
-        "docstring for _check_nodes"
-        node_names = [node.name for node in self._graph.nodes()]
-        node_lineage = [node._hierarchy for node in self._graph.nodes()]
+        """Raise an exception if a node has the name of another node at
+        the same level of the hierarchy
+        """
+        node_lineage = {}
         for node in nodes:
-            if node.name in node_names:
-                idx = node_names.index(node.name)
-                if node._hierarchy == node_lineage[idx]:
-                    raise Exception('Duplicate node name %s found.'%node.name)
+            # nodes without a hierarchy are about to join this workflow
+            hierarchy = node._hierarchy or self.name
+            if node.name in self._nodenames:
+                lineage = self._nodenames[node.name]._hierarchy
+            elif node.name in node_lineage:
+                lineage = node_lineage[node.name]
             else:
-                node_names.append(node.name)
+                node_lineage[node.name] = hierarchy
+                continue
+            if hierarchy == lineage:
+                raise Exception('Duplicate node name %s found.'%node.name)
 
-    def _has_attr(self, parameter, subtype='in'):
-        if subtype == 'in':
-            subobject = self.inputs
-        else:
-            subobject = self.outputs
-        attrlist = parameter.split('.')
-        cur_out = subobject
-        for attr in attrlist:
-            if not hasattr(cur_out, attr):
-                return False
-            cur_out = getattr(cur_out, attr)
-        return True
+    def _new_nodes(self, nodes):
+        """Return the nodes that are not in the graph, without duplicates
+        """
+        newnodes = []
+        seen = set()
+        for node in nodes:
+            if node not in self._graph and node not in seen:
+                seen.add(node)
+                newnodes.append(node)
+        return newnodes
+
+    def _index_nodes(self, nodes):
+        """Add nodes of the graph to the name index
+        """
+        for node in nodes:
+            self._nodenames.setdefault(node.name, node)
+
+    def _unindex_nodes(self, nodes):
+        """Remove nodes from the name index
+        """
+        for node in nodes:
+            if self._nodenames.get(node.name) is node:
+                del self._nodenames[node.name]
 
     def _get_parameter_node(self, parameter, subtype='in'):
-        if subtype == 'in':
-            subobject = self.inputs
-        else:
-            subobject = self.outputs
+        """Return the node providing an input or output of the workflow
+
+        `parameter` is the dotted path of the input or output (e.g.,
+        ``subworkflow.node.in_file``). Inputs connected within their
+        workflow are not available.
+        """
         attrlist = parameter.split('.')
-        cur_out = subobject
-        for attr in attrlist[:-1]:
-            cur_out = getattr(cur_out, attr)
-        return cur_out.traits()[attrlist[-1]].node
+        workflow = self
+        node = None
+        for name in attrlist[:-1]:
+            if node is not None:
+                workflow = node
+            node = workflow._nodenames.get(name)
+            if node is None:
+                raise AttributeError('%s has no node %s' % (workflow.name,
+                                                            name))
+        if node is None:
+            raise AttributeError('%s is not a parameter of a node' % parameter)
+        name = attrlist[-1]
+        if subtype == 'in':
+            taken = [cd[1] for _, _, d in \
+                         workflow._graph.in_edges_iter(nbunch=node, data=True)\
+                         for cd in d['connect']]
+            if not node._check_inputs(name) or name in taken:
+                raise AttributeError('%s has no input %s' % (node.name, name))
+        elif not node._check_outputs(name):
+            raise AttributeError('%s has no output %s' % (node.name, name))
+        return node
 
     def _check_outputs(self, parameter):
-        return self._has_attr(parameter, subtype='out')
+        try:
+            self._get_parameter_node(parameter, subtype='out')
+        except AttributeError:
+            return False
+        return True
 
     def _check_inputs(self, parameter):
-        return self._has_attr(parameter, subtype='in')
+        try:
+            self._get_parameter_node(parameter, subtype='in')
+        except AttributeError:
+            return False
+        return True
 
     def _get_inputs(self):
         inputdict = TraitedSpec()
@@ -487,27 +773,84 @@ class Workflow(WorkflowBase):
         object.traits()[name].node.set_input(name, newvalue)
 
     def _set_node_input(self, node, param, source, sourceinfo):
-        """Set inputs of a node given the edge connection"""
+        """Set inputs of a node given the edge connection
+
+        The value is copied once, by `set_input`.
+        """
         if isinstance(sourceinfo, str):
             val = source.get_output(sourceinfo)
         elif isinstance(sourceinfo, tuple):
             if callable(sourceinfo[1]):
                 val = sourceinfo[1](source.get_output(sourceinfo[0]),
                                     *sourceinfo[2:])
-        newval = val
-        if isinstance(val, TraitDictObject):
-            newval = dict(val)
-        if isinstance(val, TraitListObject):
-            newval = val[:]
-        logger.debug('setting node input: %s->%s', param, str(newval))
-        node.set_input(param, deepcopy(newval))
+        logger.debug('setting node input: %s->%s', param, val)
+        node.set_input(param, val)
 
     def _create_flat_graph(self):
+        """Flatten the hierarchy of workflows into a graph of nodes
+
+        The flat graph is made of lazy copies of the nodes and is reused
+        until `connect` or `add_nodes` is called on this workflow or any
+        of its subworkflows.
+        """
+        key = self._graph_version()
+        if self._flatgraph is not None and self._flatkey == key:
+            return
         self._flatgraph = None
         self._execgraph = None
-        workflowcopy = deepcopy(self)
+        origins = {}
+        workflowcopy = self._lazy_copy(origins)
         workflowcopy._generate_execgraph()
         self._flatgraph = workflowcopy._graph
+        self._flatorigins = origins
+        self._flatkey = key
+
+    def _graph_version(self):
+        """Identify the state of the graphs of this workflow and all its
+        subworkflows
+        """
+        return (id(self), self._version) + \
+            tuple([node._graph_version() for node in self._graph.nodes() \
+                       if isinstance(node, Workflow)])
+
+    def _lazy_copy(self, origins=None):
+        """Return a copy of the workflow and its subworkflows made of lazy
+        copies of the nodes
+
+        `origins` is updated with the node each copy was made from.
+        """
+        if origins is None:
+            origins = {}
+        workflowcopy = copy(self)
+        workflowcopy._flatgraph = None
+        workflowcopy._execgraph = None
+        workflowcopy._flatorigins = None
+        workflowcopy._execindex = None
+        copies = {}
+        for node in self._graph.nodes():
+            if isinstance(node, Workflow):
+                copies[node] = node._lazy_copy(origins)
+            else:
+                copies[node] = node._lazy_copy()
+                origins[copies[node]] = node
+        workflowcopy._graph = _copy_graph(self._graph, copies)
+        workflowcopy._nodenames = dict([(name, copies[node]) for name, node in \
+                                            self._nodenames.items()])
+        return workflowcopy
+
+    def _copy_flat_graph(self):
+        """Return a copy of the flat graph for expansion and execution
+
+        The copy is made from fresh lazy copies of the nodes of the
+        workflow, so that changes of the nodes (e.g., of their inputs or
+        iterables) since the flat graph was created are taken into account.
+        """
+        copies = {}
+        for node in self._flatgraph.nodes():
+            nodecopy = self._flatorigins[node]._lazy_copy()
+            nodecopy._hierarchy = node._hierarchy
+            copies[node] = nodecopy
+        return _copy_graph(self._flatgraph, copies)
 
     def _reset_hierarchy(self):
         for node in self._graph.nodes():
@@ -527,7 +870,7 @@ class Workflow(WorkflowBase):
                 nodes2remove.append(node)
                 for u, _, d in self._graph.in_edges_iter(nbunch=node, data=True):
                     for cd in d['connect']:
-                        logger.debug("in: %s" % str (cd))
+                        logger.debug("in: %s", cd)
                         dstnode = node._get_parameter_node(cd[1],subtype='in')
                         srcnode = u
                         srcout = cd[0]
@@ -535,7 +878,7 @@ class Workflow(WorkflowBase):
                         self.connect(srcnode, srcout, dstnode, dstin)
                 for _, v, d in self._graph.out_edges_iter(nbunch=node, data=True):
                     for cd in d['connect']:
-                        logger.debug("out: %s" % str (cd))
+                        logger.debug("out: %s", cd)
                         dstnode = v
                         if isinstance(cd[0], tuple):
                             parameter = cd[0][0]
@@ -556,8 +899,10 @@ class Workflow(WorkflowBase):
                     innernode._hierarchy = '.'.join((self.name,innernode._hierarchy))
                 self._graph.add_nodes_from(node._graph.nodes())
                 self._graph.add_edges_from(node._graph.edges(data=True))
+                self._index_nodes(node._graph.nodes())
         if nodes2remove:
             self._graph.remove_nodes_from(nodes2remove)
+            self._unindex_nodes(nodes2remove)
 
     def _execute_in_series(self, updatehash=False, force_execute=None):
         """Executes a pre-defined pipeline in a serial order.
@@ -578,7 +923,7 @@ class Workflow(WorkflowBase):
         logger.info("Running serially.")
         old_wd = os.getcwd()
         notrun = []
-        donotrun = []
+        donotrun = set()
         for node in nx.topological_sort(self._execgraph):
             # Assign outputs from dependent executed nodes to current node.
             # The dependencies are stored as data on edges connecting
@@ -586,14 +931,22 @@ class Workflow(WorkflowBase):
             try:
                 if node in donotrun:
                     continue
-                for edge in self._execgraph.in_edges_iter(node):
-                    data = self._execgraph.get_edge_data(*edge)
-                    logger.debug('setting input: %s->%s %s',
-                                 edge[0], edge[1], str(data))
-                    for sourceinfo, destname in data['connect']:
-                        self._set_node_input(node, destname,
-                                             edge[0], sourceinfo)
+                start_stat_cache()
+                try:
+                    for edge in self._execgraph.in_edges_iter(node):
+                        data = self._execgraph.get_edge_data(*edge)
+                        logger.debug('setting input: %s->%s %s',
+                                     edge[0], edge[1], data)
+                        for sourceinfo, destname in data['connect']:
+                            self._set_node_input(node, destname,
+                                                 edge[0], sourceinfo)
+                finally:
+                    stop_stat_cache()
                 self._set_output_directory_base(node)
+                if self._resume_node(node):
+                    continue
+                start = time()
+                log_event('node_start', node=str(node))
                 redo = None
                 if force_execute:
                     if isinstance(force_execute, str):
@@ -604,33 +957,43 @@ class Workflow(WorkflowBase):
                     node.run(updatehash=updatehash)
                 else:
                     node.run(force_execute=redo)
+                self._journal_node(node, 'done', start)
             except:
                 os.chdir(old_wd)
                 if config.getboolean('execution', 'stop_on_first_crash'):
+                    self._journal_node(node, 'crashed')
                     raise
                 # bare except, but i really don't know where a
                 # node might fail
                 crashfile = node._report_crash(execgraph=self._execgraph)
+                self._journal_node(node, 'crashed', crashfile=crashfile)
                 # remove dependencies from queue
                 subnodes = nx.dfs_preorder(self._execgraph, node)
                 notrun.append(dict(node = node,
                                    dependents = subnodes,
                                    crashfile = crashfile))
-                donotrun.extend(subnodes)
+                donotrun.update(subnodes)
         _report_nodes_not_run(notrun)
 
 
-    def _set_output_directory_base(self, node):
-        """Determine output directory and create it
+    def _get_output_directory_base(self, node):
+        """Determine the directory the output directory of a node is
+        created in
         """
-        # update parameterization of output directory
-        if self.base_dir is None:
-            self.base_dir = mkdtemp()
         outputdir = self.base_dir
         if node._hierarchy:
             outputdir = os.path.join(outputdir, *node._hierarchy.split('.'))
         if node.parameterization:
             outputdir = os.path.join(outputdir, *node.parameterization)
+        return outputdir
+
+    def _set_output_directory_base(self, node):
+        """Determine output directory and create it
+        """
+        # update parameterization of output directory
+        if self.base_dir is None:
+            self.base_dir = mkdtemp()
+        outputdir = self._get_output_directory_base(node)
         if not os.path.exists(outputdir):
             os.makedirs(outputdir)
         node.base_dir = os.path.abspath(outputdir)
@@ -644,153 +1007,229 @@ class Workflow(WorkflowBase):
 
         procs: list (N) of underlying interface elements to be
         processed
+        procidx: a dict mapping each element of procs to its index
         proc_done: a boolean vector (N) signifying whether a process
         has been executed
         proc_pending: a boolean vector (N) signifying whether a
         process is currently running.
         Note: A process is finished only when both proc_done==True and
         proc_pending==False
-        depidx: a boolean matrix (NxN) storing the dependency
-        structure accross processes. Process dependencies are derived
-        from each column.
+        indegree: a list (N) storing the number of unfinished processes
+        each process depends on
+        priority: a list (N) storing the length of the longest path from
+        each process to the end of the execution graph
+        readytorun: a heap of (-priority, index) tuples of processes whose
+        dependencies have been satisfied and that have not been submitted
+        yet
         """
         if not self._execgraph:
             raise Exception('Execution graph has not been generated')
         self.procs = self._execgraph.nodes()
-        self.depidx = nx.adj_matrix(self._execgraph).__array__()
+        self.procidx = dict([(node, jobid) for jobid, node in \
+                                 enumerate(self.procs)])
+        self.indegree = [self._execgraph.in_degree(node) \
+                             for node in self.procs]
+        self.priority = self._get_priorities()
+        self.readytorun = [(-self.priority[jobid], jobid) for jobid, count in \
+                               enumerate(self.indegree) if count == 0]
+        heapify(self.readytorun)
         self.proc_done    = np.zeros(len(self.procs), dtype=bool)
         self.proc_pending = np.zeros(len(self.procs), dtype=bool)
+        # processes whose memory needs were looked up in the runtime history
+        self._estimated = set()
+        # submission time of the processes
+        self._started = {}
+
+    def _get_priorities(self):
+        """Returns the critical path length of each process
+
+        The priority of a process is its expected duration plus the
+        largest priority of its children, so processes that start long
+        chains are dispatched first. Durations are taken from the results
+        of previous runs of the workflow; processes that have not run
+        before are assumed to take the median of the known durations.
+        """
+        # runtime history estimates per interface
+        estimates = {}
+        durations = [self._get_duration(node, estimates) \
+                         for node in self.procs]
+        known = sorted([duration for duration in durations \
+                            if duration is not None])
+        default = 1.
+        if known:
+            default = known[(len(known) - 1) / 2]
+        weights = {}
+        for node, duration in zip(self.procs, durations):
+            if duration is None:
+                duration = default
+            weights[node] = duration
+        lengths = critical_path_lengths(self._execgraph, weights)
+        return [lengths[node] for node in self.procs]
+
+    def _get_duration(self, node, estimates=None):
+        """Returns the duration of the previous run of a node or None
+
+        `estimates` caches the runtime history estimates of the interfaces.
+        """
+        if self.base_dir is None:
+            return None
+        outputdir = self._get_output_directory_base(node)
+        resultfile = os.path.join(outputdir, node.name,
+                                  'result_%s.pklz' % node._id)
+        result = load_resultfile(resultfile, check_files=False)
+        if result is not None:
+            return result['runtime'].get('duration', None)
+        history = get_runtime_history()
+        if history is None or isinstance(node, MapNode):
+            return None
+        # the inputs are not known yet, so all runs of the interface count
+        name = interface_name(node._interface)
+        if estimates is None:
+            estimates = {}
+        if name not in estimates:
+            estimates[name] = history.estimate(name)
+        estimate = estimates[name]
+        if estimate is None:
+            return None
+        return estimate['duration']
 
     def _remove_node_deps(self, jobid, crashfile):
         subnodes = nx.dfs_preorder(self._execgraph, self.procs[jobid])
         for node in subnodes:
-            idx = self.procs.index(node)
+            idx = self.procidx[node]
             self.proc_done[idx] = True
             self.proc_pending[idx] = False
         return dict(node = self.procs[jobid],
                     dependents = subnodes,
                     crashfile = crashfile)
 
-    def _execute_with_manager(self):
-        """Executes a pre-defined pipeline is distributed approaches
-        based on IPython's parallel processing interface
+    def _execute_with_manager(self, plugin, plugin_args=None):
+        """Executes a pre-defined pipeline in a distributed manner using
+        one of the execution plugins in :mod:`nipype.pipeline.plugins`
         """
         if config.getboolean('execution', 'run_in_series'):
             self._execute_in_series()
             return
-        # retrieve clients again
-        if not self.taskclient:
-            try:
-                self.taskclient = self.ipyclient.TaskClient()
-            except Exception, e:
-                if isinstance(e, ConnectionRefusedError):
-                    warn("No clients found, running serially for now.")
-                if isinstance(e, ValueError):
-                    warn("Ipython kernel not installed")
-                self._execute_in_series()
-                return
+        try:
+            runner = get_plugin(plugin, plugin_args)
+        except (ImportError, RuntimeError), e:
+            warn("%s plugin unavailable (%s), running serially for now." % \
+                     (plugin, str(e)))
+            self._execute_in_series()
+            return
         logger.info("Running in parallel.")
-        # self.taskclient.clear()
         # in the absence of a dirty bit on the object, generate the
         # parameterization each time before running
         # Generate appropriate structures for worker-manager model
         self._generate_dependency_list()
-        # get number of ipython clients available
-        self.pending_tasks = []
-        self.readytorun = []
-        # setup polling
+        # maps task ids of the plugin to job ids
+        self.pending_tasks = {}
         notrun = []
-        while np.any(self.proc_done==False) | np.any(self.proc_pending==True):
-            toappend = []
-            # trigger callbacks for any pending results
-            while self.pending_tasks:
-                taskid, jobid = self.pending_tasks.pop()
-                try:
-                    res = self.taskclient.get_task_result(taskid, block=False)
-                    if res:
+        try:
+            while self.readytorun or self.pending_tasks:
+                self._send_procs_to_workers(runner)
+                if not self.pending_tasks:
+                    continue
+                # block until the plugin reports finished tasks
+                for taskid, res in runner.wait_for_results():
+                    jobid = self.pending_tasks.pop(taskid)
+                    node = self.procs[jobid]
+                    try:
                         if res['traceback']:
                             self.procs[jobid]._result = res['result']
                             self.procs[jobid]._traceback = res['traceback']
                             crashfile = self.procs[jobid]._report_crash(traceback=res['traceback'],
                                                                         execgraph=self._execgraph)
+                            self._journal_node(node, 'crashed',
+                                               self._started.get(jobid),
+                                               crashfile)
                             # remove dependencies from queue
                             notrun.append(self._remove_node_deps(jobid, crashfile))
                         else:
                             self._task_finished_cb(res['result'], jobid)
-                    else:
-                        toappend.insert(0, (taskid, jobid))
-                except:
-                    crashfile = self.procs[jobid]._report_crash(execgraph=self._execgraph)
-                    # remove dependencies from queue
-                    notrun.append(self._remove_node_deps(jobid, crashfile))
-            if toappend:
-                self.pending_tasks.extend(toappend)
-            #else:
-            #    self.taskclient.clear()
-            self._send_procs_to_workers()
-            sleep(2)
-        #self.taskclient.clear()
+                            self._journal_node(node, 'done',
+                                               self._started.get(jobid))
+                    except:
+                        crashfile = self.procs[jobid]._report_crash(execgraph=self._execgraph)
+                        self._journal_node(node, 'crashed',
+                                           self._started.get(jobid), crashfile)
+                        # remove dependencies from queue
+                        notrun.append(self._remove_node_deps(jobid, crashfile))
+        finally:
+            runner.shutdown()
         _report_nodes_not_run(notrun)
 
-    def _send_procs_to_workers(self):
-        """ Sends jobs to workers using ipython's taskclient interface
+    def _send_procs_to_workers(self, runner):
+        """ Sends jobs to workers using the execution plugin
         """
-        while np.any(self.proc_done == False):
-            # Check to see if a job is available
-            jobids = np.flatnonzero((self.proc_done == False) & \
-                                        np.all(self.depidx==0, axis=0))
-            if len(jobids)>0:
-                # send all available jobs
-                logger.info('Submitting %d jobs' % len(jobids))
-                for jobid in jobids:
-                    # change job status in appropriate queues
-                    self.proc_done[jobid] = True
-                    self.proc_pending[jobid] = True
-                    self._set_output_directory_base(self.procs[jobid])
-                    # Send job to task manager and add to pending tasks
-                    _, hashvalue = self.procs[jobid]._get_hashval()
-                    logger.info('Executing: %s ID: %d H:%s' % \
-                                    (self.procs[jobid]._id, jobid, hashvalue))
-                    cmdstr = """import sys
-from traceback import format_exception
-traceback=None
-try:
-    result = task.run()
-except:
-    etype, eval, etr = sys.exc_info()
-    traceback = format_exception(etype,eval,etr)
-    result = task.result
-"""
-                    task = self.ipyclient.StringTask(cmdstr,
-                                                     push = dict(task=self.procs[jobid]),
-                                                     pull = ['result','traceback'])
-                    tid = self.taskclient.run(task, block = False)
-                    #logger.info('Task id: %d' % tid)
-                    self.pending_tasks.insert(0, (tid, jobid))
-            else:
-                break
+        if self.readytorun:
+            # send available jobs, highest priority first
+            logger.info('%d jobs ready to run', len(self.readytorun))
+        history = get_runtime_history()
+        held = []
+        while self.readytorun:
+            item = heappop(self.readytorun)
+            jobid = item[1]
+            if self.proc_done[jobid]:
+                continue
+            if self._journaled and self._resume_node(self.procs[jobid]):
+                self.proc_done[jobid] = True
+                self._task_finished_cb(self.procs[jobid]._result, jobid)
+                continue
+            if history is not None and jobid not in self._estimated:
+                self.procs[jobid]._estimate_memory(history)
+                self._estimated.add(jobid)
+            if not runner.can_run(self.procs[jobid]):
+                # try to fit lower priority jobs into the free resources
+                held.append(item)
+                continue
+            # change job status in appropriate queues
+            self.proc_done[jobid] = True
+            self.proc_pending[jobid] = True
+            self._set_output_directory_base(self.procs[jobid])
+            # Send job to task manager and add to pending tasks
+            _, hashvalue = self.procs[jobid]._get_hashval()
+            self.procs[jobid]._hashvalue = hashvalue
+            logger.info('Executing: %s ID: %d H:%s', self.procs[jobid]._id,
+                        jobid, hashvalue)
+            self._started[jobid] = time()
+            log_event('node_start', node=str(self.procs[jobid]),
+                      hash=hashvalue)
+            tid = runner.submit_job(self.procs[jobid])
+            self.pending_tasks[tid] = jobid
+        for item in held:
+            heappush(self.readytorun, item)
 
     def _task_finished_cb(self, result, jobid):
         """ Extract outputs and assign to inputs of dependent tasks
 
         This is called when a job is completed.
         """
-        logger.info('[Job finished] jobname: %s jobid: %d' % \
-                        (self.procs[jobid]._id, jobid))
+        logger.info('[Job finished] jobname: %s jobid: %d',
+                    self.procs[jobid]._id, jobid)
         # Update job and worker queues
         self.proc_pending[jobid] = False
         if self.procs[jobid]._result != result:
             self.procs[jobid]._result = result
         # Update the inputs of all tasks that depend on this job's outputs
+        # and the job dependency structure
         graph = self._execgraph
+        # the outputs are checked once for all children
+        start_stat_cache()
+        try:
+            for edge in graph.out_edges_iter(self.procs[jobid]):
+                data = graph.get_edge_data(*edge)
+                for sourceinfo, destname in data['connect']:
+                    logger.debug('%s %s %s %s',edge[1], destname, self.procs[jobid], sourceinfo)
+                    self._set_node_input(edge[1], destname,
+                                         self.procs[jobid], sourceinfo)
+        finally:
+            stop_stat_cache()
         for edge in graph.out_edges_iter(self.procs[jobid]):
-            data = graph.get_edge_data(*edge)
-            for sourceinfo, destname in data['connect']:
-                logger.debug('%s %s %s %s',edge[1], destname, self.procs[jobid], sourceinfo)
-                self._set_node_input(edge[1], destname,
-                                     self.procs[jobid], sourceinfo)
-        # update the job dependency structure
-        self.depidx[jobid, :] = 0.
+            childid = self.procidx[edge[1]]
+            self.indegree[childid] -= 1
+            if self.indegree[childid] == 0 and not self.proc_done[childid]:
+                heappush(self.readytorun, (-self.priority[childid], childid))
 
 
 
@@ -810,6 +1249,12 @@ class Node(WorkflowBase):
         of tuples
         node.iterables = ('frac',[0.5,0.6,0.7])
         node.iterables = [('fwhm',[2,4]),('fieldx',[0.5,0.6,0.7])]
+    n_procs : int
+        number of processors the node uses while running. Defaults to the
+        `n_procs` attribute of the interface.
+    memory_gb : float
+        memory (in GB) the node needs while running. Defaults to the
+        `memory_gb` attribute of the interface.
 
     Notes
     -----
@@ -828,18 +1273,49 @@ class Node(WorkflowBase):
     >>> realign.run() # doctest: +SKIP
 
     """
-    def __init__(self, interface, iterables={}, **kwargs):
+    def __init__(self, interface, iterables={}, n_procs=None, memory_gb=None,
+                 **kwargs):
         # interface can only be set at initialization
         super(Node, self).__init__(**kwargs)
         if interface is None:
             raise Exception('Interface must be provided')
         self._interface  = interface
+        self._interface_shared = False
         self._result     = None
         self.iterables  = iterables
         self.parameterization = None
+        self._n_procs = n_procs
+        self._memory_gb = memory_gb
+        # memory needs estimated from the runtime history
+        self._memory_estimate = None
+        # hash of the inputs of the last run
+        self._hashvalue = None
+
+    def _get_n_procs(self):
+        if self._n_procs is None:
+            return getattr(self._interface, 'n_procs', 1)
+        return self._n_procs
+
+    def _set_n_procs(self, value):
+        self._n_procs = value
+
+    n_procs = property(_get_n_procs, _set_n_procs)
+
+    def _get_memory_gb(self):
+        if self._memory_gb is not None:
+            return self._memory_gb
+        if self._memory_estimate is not None:
+            return self._memory_estimate
+        return getattr(self._interface, 'memory_gb', 0)
+
+    def _set_memory_gb(self, value):
+        self._memory_gb = value
+
+    memory_gb = property(_get_memory_gb, _set_memory_gb)
 
     @property
     def interface(self):
+        self._own_interface()
         return self._interface
 
     @property
@@ -848,19 +1324,42 @@ class Node(WorkflowBase):
 
     @property
     def inputs(self):
+        self._own_interface()
         return self._interface.inputs
 
+    def _lazy_copy(self):
+        """Return a shallow copy of the node
+
+        The copy shares the interface of this node until it needs to modify
+        it (copy-on-write), which makes replicating nodes (e.g., during
+        expansion of iterables) cheap.
+        """
+        nodecopy = copy(self)
+        nodecopy._interface_shared = True
+        return nodecopy
+
+    def _own_interface(self):
+        """Replace a shared interface with a private copy
+        """
+        if self._interface_shared:
+            self._interface = deepcopy(self._interface)
+            self._interface_shared = False
+
     @property
     def outputs(self):
         return self._interface._outputs()
 
+    def _check_inputs(self, parameter):
+        # do not copy a shared interface just to look at it
+        return hasattr(self._interface.inputs, parameter)
+
     def set_input(self, parameter, val):
         """ Set interface input value or nodewrapper attribute
 
         Priority goes to interface.
         """
-        logger.debug('setting nodelevel input %s = %s' % (parameter, str(val)))
-        setattr(self.inputs, parameter, deepcopy(val))
+        logger.debug('setting nodelevel input %s = %s', parameter, val)
+        setattr(self.inputs, parameter, _copy_value(val))
 
     def get_output(self, parameter):
         val = None
@@ -886,36 +1385,40 @@ class Node(WorkflowBase):
                 logger.warn('Unable to write a particular type to the json '\
                                 'file')
             else:
-                logger.critical('Unable to open the file in write mode: %s'% \
-                                    hashfile)
+                logger.critical('Unable to open the file in write mode: %s',
+                                hashfile)
 
 
     def run(self, updatehash=None, force_execute=False):
         """Executes an interface within a directory.
         """
+        setup_logging()
+        self._own_interface()
         # check to see if output directory and hash exist
-        logger.info("Node: %s"%self._id)
+        logger.info("Node: %s", self._id)
         outdir = self._output_directory()
         outdir = make_output_dir(outdir)
-        logger.info("in dir: %s"%outdir)
+        logger.info("in dir: %s", outdir)
         # Get a dictionary with hashed filenames and a hashvalue
         # of the dictionary itself.
         hashed_inputs, hashvalue = self._get_hashval()
+        self._hashvalue = hashvalue
         hashfile = os.path.join(outdir, '_0x%s.json' % hashvalue)
         if updatehash:
             #if isinstance(self, MapNode):
             #    self._run_interface(updatehash=True)
-            logger.debug("Updating hash: %s" % hashvalue)
+            logger.debug("Updating hash: %s", hashvalue)
             self._save_hashfile(hashfile, hashed_inputs)
         if force_execute or (not updatehash and (self.overwrite or not os.path.exists(hashfile))):
-            logger.debug("Node hash: %s"%hashvalue)
+            logger.debug("Node hash: %s", hashvalue)
             hashfile_unfinished = os.path.join(outdir, '_0x%s_unfinished.json' % hashvalue)
             if os.path.exists(outdir) and not (os.path.exists(hashfile_unfinished) and self._interface.can_resume):
-                logger.debug("Removing old %s and its contents"%outdir)
+                logger.debug("Removing old %s and its contents", outdir)
                 rmtree(outdir)
                 outdir = make_output_dir(outdir)
             else:
-                logger.debug("%s found and can_resume is True - resuming execution" % hashfile_unfinished)
+                logger.debug("%s found and can_resume is True - resuming execution",
+                             hashfile_unfinished)
             self._save_hashfile(hashfile_unfinished, hashed_inputs)
             self._run_interface(execute=True, cwd=outdir)
             if isinstance(self._result.runtime, list):
@@ -947,15 +1450,34 @@ class Node(WorkflowBase):
         self._result = self._run_command(execute, cwd)
         os.chdir(old_cwd)
 
-    def _run_command(self, execute, cwd, copyfiles=True):
+    def _get_cached_result(self):
+        """Predict whether `run` would execute the interface
+
+        Returns True if a previous result would be reused, and that
+        result. The result is None if the node would execute or if its
+        outputs cannot be determined without running it. Nothing is
+        written to disk.
+        """
+        outdir = self._output_directory()
+        _, hashvalue = self._get_hashval()
+        hashfile = os.path.join(outdir, '_0x%s.json' % hashvalue)
+        if self.overwrite or not os.path.exists(hashfile):
+            return False, None
+        resultsfile = os.path.join(outdir, 'result_%s.pklz' % self._id)
+        return True, self._load_results(resultsfile, hashvalue)
+
+    def _run_command(self, execute, cwd, copyfiles=True, hashvalue=None):
+        if hashvalue is None:
+            # hash of the inputs before they point to the copied files
+            _, hashvalue = self._get_hashval()
         if execute and copyfiles:
             self._originputs = deepcopy(self._interface.inputs)
         if copyfiles:
             self._copyfiles_to_wd(cwd,execute)
-        resultsfile = os.path.join(cwd, 'result_%s.npz' % self._id)
+        resultsfile = os.path.join(cwd, 'result_%s.pklz' % self._id)
         if issubclass(self._interface.__class__, CommandLine):
             cmd = self._interface.cmdline
-            logger.info('cmd: %s'%cmd)
+            logger.info('cmd: %s', cmd)
         if execute:
             if issubclass(self._interface.__class__, CommandLine):
                 cmdfile = os.path.join(cwd,'command.txt')
@@ -966,35 +1488,112 @@ class Node(WorkflowBase):
             try:
                 result = self._interface.run()
             except:
-                runtime = Bunch(returncode = 1, environ = deepcopy(os.environ.data), hostname = gethostname())
+                runtime = _make_runtime(returncode=1)
                 result = InterfaceResult(interface=None,
                                          runtime=runtime,
                                          outputs=None)
                 self._result = result
                 raise
             if result.runtime.returncode:
-                logger.error('STDERR:' + result.runtime.stderr)
-                logger.error('STDOUT:' + result.runtime.stdout)
+                logger.error('STDERR:%s', result.runtime.stderr)
+                logger.error('STDOUT:%s', result.runtime.stdout)
                 self._result = result
                 raise RuntimeError(result.runtime.stderr)
             else:
-                # to remove problem with thread unsafeness of savez
-                outdict = {'result_%s' % self._id : result}
-                np.savez(resultsfile, **outdict)
+                save_resultfile(resultsfile, result, hashvalue)
+                self._record_runtime(result)
         else:
             # Likewise, cwd could go in here
             logger.debug("Collecting precomputed outputs:")
+            result = self._load_results(resultsfile, hashvalue)
+            if result is not None:
+                return result
             try:
                 aggouts = self._interface.aggregate_outputs()
-                runtime = Bunch(returncode = 0, environ = deepcopy(os.environ.data), hostname = gethostname())
+                runtime = _make_runtime(returncode=0)
                 result = InterfaceResult(interface=None,
                                          runtime=runtime,
                                          outputs=aggouts)
             except FileNotFoundError:
                 logger.debug("Some of the outputs were not found: rerunning node.")
-                result = self._run_command(execute=True, cwd=cwd, copyfiles=False)
+                result = self._run_command(execute=True, cwd=cwd,
+                                           copyfiles=False,
+                                           hashvalue=hashvalue)
         return result
 
+    def _record_runtime(self, result):
+        """Add the run to the runtime history (if it is enabled)
+        """
+        history = get_runtime_history()
+        if history is None:
+            return
+        output_bytes = None
+        if result.outputs is not None:
+            output_bytes = sum([os.path.getsize(afile) for afile in \
+                                    _existing_files(result.outputs.get())])
+        history.record(interface_name(self._interface),
+                       input_signature(self._interface.inputs),
+                       result.runtime.hostname,
+                       result.runtime.duration,
+                       getattr(result.runtime, 'peak_rss', None),
+                       output_bytes)
+
+    def _estimate_memory(self, history):
+        """Estimate `memory_gb` from the peak memory use of previous runs
+        with similar inputs
+
+        The estimate is only used while `memory_gb` is not set explicitly.
+        """
+        if self._memory_gb is not None or isinstance(self, MapNode):
+            return
+        estimate = history.estimate(interface_name(self._interface),
+                                    input_signature(self._interface.inputs),
+                                    gethostname())
+        if estimate is not None and estimate['peak_rss'] is not None:
+            self._memory_estimate = estimate['peak_rss'] / 1024.
+
+    def _get_input_values(self):
+        """Return the defined input values of the interface
+        """
+        return dict([(key, val) for key, val in \
+                         self._interface.inputs.get().items() \
+                         if isdefined(val)])
+
+    def _get_fingerprint(self):
+        """Return a digest of the interface and its input values
+
+        Unlike the hash of the node, input files are identified by their
+        path, so the digest is computed without accessing them.
+        """
+        return fingerprint(interface_name(self._interface),
+                           self._get_input_values())
+
+    def _restore_outputs(self, values):
+        """Return the outputs of the interface set to stored values
+        """
+        outputs = self._interface._outputs()
+        if outputs is not None:
+            outputs.trait_set(trait_change_notify=False, **values)
+        return outputs
+
+    def _load_results(self, resultsfile, hashvalue):
+        """Return the stored result of a previous run or None
+        """
+        data = load_resultfile(resultsfile, hashvalue)
+        if data is None:
+            return None
+        try:
+            outputs = self._restore_outputs(data['outputs'])
+        except Exception, e:
+            logger.debug('Could not restore outputs from %s: %s',
+                         resultsfile, e)
+            return None
+        logger.debug('Loaded outputs from %s', resultsfile)
+        runtime = _make_runtime(returncode=0)
+        runtime.duration = data['runtime'].get('duration')
+        return InterfaceResult(interface=None, runtime=runtime,
+                               outputs=outputs)
+
     def _copyfiles_to_wd(self, outdir, execute):
         """ copy files over and change the inputs"""
         if hasattr(self._interface,'_get_filecopy_info'):
@@ -1029,7 +1628,8 @@ class MapNode(Node):
     
     """
 
-    def __init__(self, interface, iterfield=None, **kwargs):
+    def __init__(self, interface, iterfield=None, max_parallel=None,
+                 **kwargs):
         """
 
         Parameters
@@ -1041,8 +1641,13 @@ class MapNode(Node):
         set node.iterfield = ['infile'].  If this list has more than 1 item
         then the inputs are selected in order simultaneously from each of these
         fields and each field will need to have the same number of members.
+        max_parallel : int
+        number of items that are processed concurrently (in separate
+        processes). Defaults to the `mapnode_max_parallel` option of the
+        `execution` section of the config file.
         """
         super(MapNode, self).__init__(interface, **kwargs)
+        self.max_parallel = max_parallel
         self.iterfield  = iterfield
         if self.iterfield is None:
             raise Exception("Iterfield must be provided")
@@ -1052,6 +1657,15 @@ class MapNode(Node):
                                                    fields=self.iterfield)
         self._inputs.on_trait_change(self._set_mapnode_input)
 
+    def _own_interface(self):
+        """Replace a shared interface and input specification with private
+        copies
+        """
+        if self._interface_shared:
+            super(MapNode, self)._own_interface()
+            self._inputs = deepcopy(self._inputs)
+            self._inputs.on_trait_change(self._set_mapnode_input)
+
     def _create_dynamic_traits(self, basetraits, fields=None, nitems=None):
         """Convert specific fields of a trait to accept multiple inputs
         """
@@ -1060,7 +1674,7 @@ class MapNode(Node):
             fields = basetraits.copyable_trait_names()
         for name, spec in basetraits.items():
             if name in fields and ((nitems is None) or (nitems > 1)):
-                logger.debug('adding multipath trait: %s'%name)
+                logger.debug('adding multipath trait: %s', name)
                 output.add_trait(name, InputMultiPath(spec.trait_type))
             else:
                 output.add_trait(name, traits.Trait(spec))
@@ -1073,11 +1687,11 @@ class MapNode(Node):
 
         Priority goes to interface.
         """
-        logger.debug('setting nodelevel input %s = %s' % (parameter, str(val)))
-        self._set_mapnode_input(self.inputs, parameter, deepcopy(val))
+        logger.debug('setting nodelevel input %s = %s', parameter, val)
+        self._set_mapnode_input(self.inputs, parameter, _copy_value(val))
 
     def _set_mapnode_input(self, object, name, newvalue):
-        logger.debug('setting mapnode input: %s -> %s' %(name, str(newvalue)))
+        logger.debug('setting mapnode input: %s -> %s', name, newvalue)
         if name in self.iterfield:
             setattr(self._inputs, name, newvalue)
         else:
@@ -1090,64 +1704,217 @@ class MapNode(Node):
         for name in self.iterfield:
             hashinputs.remove_trait(name)
             hashinputs.add_trait(name, InputMultiPath(self._interface.inputs.traits()[name].trait_type))
-            logger.debug('setting hashinput %s-> %s'%(name,getattr(self._inputs, name)))
+            logger.debug('setting hashinput %s-> %s', name,
+                         getattr(self._inputs, name))
             setattr(hashinputs, name, getattr(self._inputs, name))
         return hashinputs.hashval
 
     @property
     def inputs(self):
+        self._own_interface()
         return self._inputs
 
     @property
     def outputs(self):
         return Bunch(self._interface._outputs().get())
 
+    def _get_input_values(self):
+        values = super(MapNode, self)._get_input_values()
+        for name in self.iterfield:
+            values[name] = getattr(self._inputs, name)
+        return values
+
+    def _restore_outputs(self, values):
+        outputs = self.outputs
+        for key, val in values.items():
+            setattr(outputs, key, val)
+        return outputs
+
+    def _make_nodes(self, cwd=None):
+        """Return a node for each item of the iterfield inputs
+
+        The nodes run in the ``mapflow`` subdirectory of the output
+        directory of the MapNode.
+        """
+        if cwd is None:
+            cwd = self._output_directory()
+        fieldvals = dict([(field, filename_to_list(getattr(self.inputs,
+                                                           field)))
+                          for field in self.iterfield])
+        spec = self._interface.inputs
+        # traits added to the spec instance (e.g., by IdentityInterface)
+        classtraits = spec.__class__.class_trait_names()
+        addedtraits = [name for name in spec.copyable_trait_names()
+                       if name not in classtraits]
+        # inputs shared by all items; containers are copied by trait
+        # validation when they are assigned to the item specs
+        values = dict([(name, val) for name, val in spec.get().items()
+                       if isdefined(val) and name not in self.iterfield])
+        # the other attributes of the interface (e.g., the MatlabCommand
+        # of SPM interfaces), copied for each item
+        state = dict([(key, val) for key, val in \
+                          self._interface.__dict__.items() if key != 'inputs'])
+        nodes = []
+        for i in range(len(fieldvals[self.iterfield[0]])):
+            interface = self._item_interface(state)
+            for name in addedtraits:
+                if interface.inputs.trait(name) is None:
+                    interface.inputs.add_trait(name, spec.trait(name))
+                    interface.inputs.trait_set(trait_change_notify=False,
+                                               **{name: Undefined})
+            interface.inputs.set(**values)
+            node = Node(interface, name='_' + self.name + str(i))
+            for field in self.iterfield:
+                logger.debug('setting input %d %s %s', i, field,
+                             fieldvals[field][i])
+                setattr(node.inputs, field, fieldvals[field][i])
+            node._hierarchy = 'mapflow'
+            node.base_dir = os.path.join(cwd, 'mapflow')
+            node.config = self.config
+            nodes.append(node)
+        return nodes
+
+    def _item_interface(self, state):
+        """Return a new interface for an item of the MapNode
+
+        Creating the interface registers the listeners that interfaces
+        add to their inputs (e.g., for the output type of FSL). Interfaces
+        whose constructor needs arguments are deep-copied instead. The
+        inputs are left for the caller to set.
+        """
+        try:
+            interface = self._interface.__class__()
+        except Exception:
+            inputs = self._interface.inputs
+            # the memo leaves out the inputs
+            interface = deepcopy(self._interface, {id(inputs): None})
+            interface.inputs = inputs.__class__()
+            return interface
+        interface.__dict__.update(deepcopy(state))
+        return interface
+
+    def _run_nodes(self, nodes):
+        """Run the item nodes and return their results in order
+
+        Each result is a dict with the fields `result` and `traceback`
+        (see :func:`nipype.pipeline.plugins.base.run_node`). Nodes change
+        the working directory while running, so concurrent items are run
+        in separate processes. Inside a daemonic process (e.g., a worker
+        of the multiproc plugin) no processes can be started and the items
+        are run in series.
+
+        With the `stop_on_first_crash` option, the first item that fails
+        raises an exception and the remaining items are not run.
+        """
+        max_parallel = self.max_parallel
+        if max_parallel is None:
+            max_parallel = config.getint('execution', 'mapnode_max_parallel')
+        stop = config.getboolean('execution', 'stop_on_first_crash')
+        if max_parallel > 1 and len(nodes) > 1:
+            try:
+                from multiprocessing import Pool, current_process
+            except ImportError:
+                pass
+            else:
+                if not current_process().daemon:
+                    listener = QueueListener()
+                    listener.start()
+                    pool = Pool(processes=min(max_parallel, len(nodes)),
+                                initializer=init_worker_logging,
+                                initargs=(listener.queue,))
+                    results = [None] * len(nodes)
+                    crashed = None
+                    try:
+                        for i, res in pool.imap_unordered(_run_item,
+                                                          enumerate(nodes)):
+                            results[i] = res
+                            if stop and res['traceback']:
+                                crashed = i
+                                break
+                    finally:
+                        if crashed is None:
+                            pool.close()
+                        else:
+                            pool.terminate()
+                        pool.join()
+                        if crashed is None:
+                            listener.stop()
+                        else:
+                            # a terminated worker may have left a partial
+                            # record on the queue
+                            listener.stop(timeout=1)
+                    if crashed is not None:
+                        raise Exception('iternode %s:%d did not run\n%s' % \
+                                            (nodes[crashed]._id, crashed,
+                                             ''.join(results[crashed]\
+                                                         ['traceback'])))
+                    return results
+                logger.debug('Running %s in series from a daemonic '
+                             'process', self._id)
+        results = []
+        for node in nodes:
+            if stop:
+                results.append(dict(result=node.run(), traceback=None))
+            else:
+                results.append(run_node(node))
+        return results
+
     def _run_interface(self, execute=True, cwd=None):
         old_cwd = os.getcwd()
         if not cwd:
             cwd = self._output_directory()
         os.chdir(cwd)
-
-        nitems = len(filename_to_list(getattr(self.inputs, self.iterfield[0])))
-        newnodes = []
-        nodenames = []
-        for i in range(nitems):
-            nodenames.insert(i, '_' + self.name+str(i))
-            newnodes.insert(i, Node(deepcopy(self._interface), name=nodenames[i]))
-            newnodes[i]._interface.inputs.set(**deepcopy(self._interface.inputs.get()))
-            for field in self.iterfield:
-                fieldvals = filename_to_list(getattr(self.inputs, field))
-                logger.debug('setting input %d %s %s'%(i, field,
-                                                      fieldvals[i])) 
-                setattr(newnodes[i].inputs, field,
-                        fieldvals[i])
-        workflowname = 'mapflow'
-        iterflow = Workflow(name=workflowname)
-        iterflow.base_dir = cwd
-        iterflow.config = self.config
-        iterflow.add_nodes(newnodes)
-        iterflow.run(inseries=True)
-        self._result = InterfaceResult(interface=[], runtime=[],
-                                       outputs=self.outputs)
-        for i in range(nitems):
-            node = iterflow.get_exec_node('.'.join((workflowname,
-                                                    nodenames[i])))
-            runtime = Bunch(returncode = 0, environ = deepcopy(os.environ.data), hostname = gethostname())
-            self._result.runtime.insert(i, runtime)
-            if node.result and hasattr(node.result, 'runtime'):
-                self._result.runtime[i] = node.result.runtime
-                if node.result.runtime.returncode != 0:
-                    raise Exception('iternode %s:%d did not run'%(node._id, i))
-                self._result.interface.insert(i, node.result.interface)
+        try:
+            nodes = self._make_nodes(cwd)
+            if nodes and not os.path.exists(nodes[0].base_dir):
+                os.makedirs(nodes[0].base_dir)
+            results = self._run_nodes(nodes)
+            self._result = InterfaceResult(interface=[], runtime=[],
+                                           outputs=self.outputs)
+            failed = []
+            for i, res in enumerate(results):
+                result = res['result']
+                runtime = _make_runtime(returncode=0)
+                if result and hasattr(result, 'runtime'):
+                    runtime = result.runtime
+                    self._result.interface.insert(i, result.interface)
+                self._result.runtime.insert(i, runtime)
+                if res['traceback'] or runtime.returncode != 0:
+                    failed.append('iternode %s:%d did not run\n%s' % \
+                                      (nodes[i]._id, i,
+                                       ''.join(res['traceback'] or [])))
+        finally:
+            os.chdir(old_cwd)
+        if failed:
+            raise Exception('\n'.join(failed))
+        self._collect_outputs(self._result.outputs,
+                              [res['result'] for res in results])
+
+    def _collect_outputs(self, outputs, results):
+        """Set each output to the list of the outputs of the items
+        """
+        itemoutputs = [result.outputs.get() for result in results]
         for key, _ in self.outputs.items():
-            values = []
-            for i in range(nitems):
-                node = iterflow.get_exec_node('.'.join((workflowname,
-                                                        nodenames[i])))
-                values.insert(i, node.result.outputs.get()[key])
+            values = [itemoutput[key] for itemoutput in itemoutputs]
             if any([val != Undefined for val in values]):
                 #logger.debug('setting key %s with values %s' %(key, str(values)))
-                setattr(self._result.outputs, key, values)
+                setattr(outputs, key, values)
             #else:
             #    logger.debug('no values for key %s' %key)
-        os.chdir(old_cwd)
+
+    def _get_cached_result(self):
+        skip, result = super(MapNode, self)._get_cached_result()
+        if not skip or result is not None:
+            return skip, result
+        # the outputs are gathered from the results of the items
+        results = []
+        for node in self._make_nodes(self._output_directory()):
+            _, itemresult = node._get_cached_result()
+            if itemresult is None or itemresult.outputs is None:
+                return skip, None
+            results.append(itemresult)
+        result = InterfaceResult(interface=[],
+                                 runtime=[res.runtime for res in results],
+                                 outputs=self.outputs)
+        self._collect_outputs(result.outputs, results)
+        return skip, result
@@ -0,0 +1,157 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Execution journal of workflows
+
+A workflow that runs with the `use_journal` option of the `execution`
+section of the config file appends a line to ``journal.jsonl`` in its
+directory whenever a node finishes or crashes. Each line is a JSON
+object with the fields
+
+    node : the name of the node (as in crash files)
+    status : 'done' or 'crashed'
+    fingerprint : digest of the interface and of its input values
+    hash : hash of the inputs of the node, if it was computed
+    outputs : the values of the outputs (done) or None
+    outputdir : the output directory of the node
+    crashfile : the crash file (crashed) or None
+    start, end : timestamps of the run
+    host, pid : where the workflow ran
+
+When the workflow runs again, nodes whose last entry is 'done' and whose
+input values have the same fingerprint take their outputs from the
+journal. Unlike the hash of a node, the fingerprint identifies input
+files by their path only, so completed nodes are skipped without reading
+their inputs.
+
+Lines are appended with a single write to a file opened in append mode
+while holding an exclusive lock, so several processes can share a
+journal. Incomplete lines (e.g., of a killed process) are ignored; the
+next entry starts on a new line.
+"""
+
+import logging
+import os
+from socket import gethostname
+from time import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from nipype.utils.filemanip import json, md5
+
+logger = logging.getLogger('workflow')
+
+
+def fingerprint(name, inputs):
+    """Return a digest of an interface name and a dict of input values
+    """
+    return md5(repr((name, sorted(inputs.items())))).hexdigest()
+
+def _from_json(value):
+    """Convert the unicode strings of decoded JSON to str
+    """
+    if isinstance(value, unicode):
+        try:
+            return str(value)
+        except UnicodeEncodeError:
+            return value
+    if isinstance(value, list):
+        return [_from_json(val) for val in value]
+    if isinstance(value, dict):
+        return dict([(_from_json(key), _from_json(val)) \
+                         for key, val in value.items()])
+    return value
+
+
+class ExecutionJournal(object):
+    """An append-only journal of the nodes run by a workflow
+
+    Parameters
+    ----------
+    filename : str
+        path of the journal
+
+    Examples
+    --------
+    >>> from nipype.pipeline.journal import ExecutionJournal
+    >>> journal = ExecutionJournal('/tmp/pipe/journal.jsonl') # doctest: +SKIP
+    >>> done = journal.completed() # doctest: +SKIP
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def append(self, entry):
+        """Append an entry (a dict) to the journal
+        """
+        line = json.dumps(entry, sort_keys=True) + '\n'
+        dirname = os.path.dirname(os.path.abspath(self.filename))
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        fd = os.open(self.filename, os.O_RDWR | os.O_APPEND | os.O_CREAT,
+                     0644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            size = os.fstat(fd).st_size
+            if size:
+                # terminate a line cut short by a killed writer
+                os.lseek(fd, size - 1, os.SEEK_SET)
+                if os.read(fd, 1) != '\n':
+                    line = '\n' + line
+            os.write(fd, line)
+        finally:
+            # closing the file releases the lock
+            os.close(fd)
+
+    def record(self, node, status, fingerprint, hashvalue=None, outputs=None,
+               outputdir=None, crashfile=None, start=None, end=None):
+        """Append the outcome of running a node
+
+        Outputs that cannot be represented in JSON are not stored, so the
+        node runs again when the workflow is resumed.
+        """
+        entry = dict(node=node, status=status, fingerprint=fingerprint,
+                     hash=hashvalue, outputs=outputs, outputdir=outputdir,
+                     crashfile=crashfile, start=start, end=end or time(),
+                     host=gethostname(), pid=os.getpid())
+        try:
+            self.append(entry)
+        except (TypeError, ValueError):
+            logger.debug('outputs of %s cannot be journaled', node)
+            entry['outputs'] = None
+            self.append(entry)
+
+    def entries(self):
+        """Return the entries of the journal in the order they were written
+        """
+        if not os.path.exists(self.filename):
+            return []
+        fp = open(self.filename)
+        try:
+            lines = fp.readlines()
+        finally:
+            fp.close()
+        entries = []
+        for line in lines:
+            try:
+                entries.append(_from_json(json.loads(line)))
+            except ValueError:
+                logger.debug('skipping incomplete journal entry: %s', line)
+        return entries
+
+    def completed(self):
+        """Return the last entry of each node that completed
+
+        Returns a dict mapping node names to entries. Nodes that crashed
+        after completing are left out.
+        """
+        completed = {}
+        for entry in self.entries():
+            if entry.get('status') == 'done':
+                completed[entry['node']] = entry
+            else:
+                completed.pop(entry.get('node'), None)
+        return completed
@@ -0,0 +1,31 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Execution plugins for running workflows in parallel
+
+ipython - distributes nodes to the engines of an IPython cluster
+multiproc - runs nodes on a local pool of processes
+batch - submits nodes as jobs to a batch queueing system (SGE, PBS, SLURM)
+
+The plugin used by :meth:`nipype.pipeline.engine.Workflow.run` is
+selected with the `plugin` option of the `execution` section of the
+config file.
+"""
+
+from nipype.pipeline.plugins.base import PluginBase, run_node
+from nipype.pipeline.plugins.batch import BatchPlugin
+from nipype.pipeline.plugins.ipython import IPythonPlugin
+from nipype.pipeline.plugins.multiproc import MultiProcPlugin
+
+plugins = dict(ipython=IPythonPlugin,
+               multiproc=MultiProcPlugin,
+               batch=BatchPlugin)
+
+def get_plugin(name, plugin_args=None):
+    """Instantiate the execution plugin registered under `name`
+    """
+    if name not in plugins:
+        raise ValueError("Unknown execution plugin: %s (available: %s)" % \
+                             (name, ', '.join(sorted(plugins.keys()))))
+    return plugins[name](plugin_args=plugin_args)
+
+__docformat__ = 'restructuredtext'
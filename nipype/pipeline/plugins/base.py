@@ -0,0 +1,103 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Common functionality for workflow execution plugins
+
+An execution plugin is responsible for running a single node of an
+execution graph somewhere (a local process, an IPython engine, ...)
+and for handing the result back to the workflow. Dependency
+bookkeeping, input propagation and crash reporting remain the
+responsibility of :class:`nipype.pipeline.engine.Workflow`.
+"""
+
+from Queue import Queue, Empty
+import sys
+from traceback import format_exception
+
+
+class PluginBase(object):
+    """Base class for execution plugins
+
+    Plugins report finished tasks by calling `_task_done` (from any
+    thread). The workflow blocks in `wait_for_results` until at least one
+    task has finished, so that dependent nodes can be dispatched as soon
+    as their parents complete.
+
+    Parameters
+    ----------
+
+    plugin_args : dict
+        plugin specific options (e.g., ``n_procs`` for the multiproc plugin)
+    """
+
+    # number of seconds between checks on tasks that cannot report their
+    # own completion (see `_check_tasks`)
+    poll_interval = 1
+
+    def __init__(self, plugin_args=None):
+        if plugin_args is None:
+            plugin_args = {}
+        self.plugin_args = plugin_args
+        self._finished = Queue()
+
+    def can_run(self, node):
+        """Returns False if the node should not be submitted yet (e.g.,
+        because the resources it needs are in use by running tasks)
+        """
+        return True
+
+    def submit_job(self, node):
+        """Submits a node for execution and returns a task id
+        """
+        raise NotImplementedError
+
+    def wait_for_results(self):
+        """Blocks until at least one task has finished
+
+        Returns a list of (taskid, result) tuples, where result is a dict
+        with the fields `result` and `traceback`.
+        """
+        results = []
+        while not results:
+            try:
+                # a timeout keeps the wait interruptible
+                results.append(self._finished.get(True, self.poll_interval))
+            except Empty:
+                self._check_tasks()
+        while True:
+            try:
+                results.append(self._finished.get_nowait())
+            except Empty:
+                break
+        return results
+
+    def shutdown(self):
+        """Releases any resources held by the plugin
+        """
+        pass
+
+    def _task_done(self, taskid, result):
+        """Marks a task as finished. Safe to call from any thread.
+        """
+        self._finished.put((taskid, result))
+
+    def _check_tasks(self):
+        """Called periodically while waiting for results
+        """
+        pass
+
+
+def run_node(node, updatehash=None):
+    """Executes a node and traps any exception
+
+    Returns a dict containing the `result` of the node and the formatted
+    `traceback` if execution failed (None otherwise). This is the
+    function that runs on the remote/child side of a plugin.
+    """
+    result = dict(result=None, traceback=None)
+    try:
+        result['result'] = node.run(updatehash=updatehash)
+    except:
+        etype, eval, etr = sys.exc_info()
+        result['traceback'] = format_exception(etype, eval, etr)
+        result['result'] = node.result
+    return result
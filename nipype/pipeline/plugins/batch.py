@@ -0,0 +1,383 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Parallel workflow execution via a batch queueing system
+
+Each ready node is pickled to a file next to a small job script, which
+is submitted with the submit command of the cluster (qsub, sbatch, ...).
+The job runs the node with :func:`run_job` and writes the outcome to a
+result file, whose appearance tells the plugin that the node has
+finished. The cluster therefore needs a file system shared with the
+submitting machine, but no other service.
+
+Jobs that end without writing their result files (e.g., because they
+were killed by the scheduler) are found with the status command of the
+scheduler or a timeout, and their nodes are reported as crashed.
+"""
+
+import cPickle
+import gzip
+import logging
+import os
+import re
+import subprocess
+import sys
+from tempfile import mkdtemp
+from time import time
+from traceback import format_exception
+
+import nipype
+from nipype.pipeline.plugins.base import PluginBase, run_node
+
+logger = logging.getLogger('workflow')
+
+# submit command, option requesting an array job of n tasks, the
+# environment variable holding the (1-based) index of an array task and
+# the command that prints the status of a job while the scheduler knows it
+schedulers = dict(sge=dict(submit_cmd='qsub -cwd -o %(job_dir)s -e %(job_dir)s',
+                           array_opt='-t 1-%d',
+                           task_var='SGE_TASK_ID',
+                           status_cmd='qstat -j %(job)s'),
+                  pbs=dict(submit_cmd='qsub -o %(job_dir)s -e %(job_dir)s',
+                           array_opt='-t 1-%d',
+                           task_var='PBS_ARRAYID',
+                           status_cmd='qstat %(job)s'),
+                  slurm=dict(submit_cmd='sbatch -o %(job_dir)s/slurm-%%j.out',
+                             array_opt='--array=1-%d',
+                             task_var='SLURM_ARRAY_TASK_ID',
+                             status_cmd='squeue -h -j %(job)s'))
+
+# the job id in the output of the submit command
+_job_id = re.compile(r'(\d+)')
+
+
+class BatchPlugin(PluginBase):
+    """Execute nodes as jobs of a batch queueing system
+
+    Parameters
+    ----------
+
+    plugin_args : dict
+        scheduler : ``sge`` (default), ``pbs`` or ``slurm``. Determines
+        the defaults of `submit_cmd`, `array_opt`, `task_var` and
+        `status_cmd`.
+
+        submit_cmd : command the job script is appended to for submission.
+        ``%(job_dir)s`` is replaced by `job_dir`.
+
+        job_dir : directory for node, job script, result and log files.
+        Must be visible from the execution hosts. Defaults to a new
+        ``nipype_batch_*`` directory in the current directory.
+
+        script_header : lines added to the top of every job script (e.g.,
+        scheduler directives or environment setup)
+
+        python : python executable on the execution hosts (defaults to
+        the one running the workflow)
+
+        batch_size : number of nodes run one after another by a single
+        job (default 1). Larger batches reduce the scheduling overhead of
+        short nodes.
+
+        array : if True, all jobs ready at the same time are submitted as
+        tasks of a single array job, using `array_opt` and `task_var`
+
+        max_jobs : maximum number of submitted jobs (an array job counts
+        once) that have not finished yet. Further jobs are held back.
+
+        poll_interval : initial number of seconds between checks for
+        result files (default 1). While no job finishes, the interval
+        grows by a factor of `poll_backoff` (default 1.5) up to
+        `poll_max` (default 60) seconds.
+
+        status_cmd : command that prints the status of a job and fails
+        or prints nothing once the job has ended. ``%(job)s`` is replaced
+        by the job id in the output of the submit command. None disables
+        status checks.
+
+        status_interval : number of seconds between status checks of the
+        unfinished jobs (default 60). A job whose status is not found
+        twice in a row without having written its result files is
+        reported as crashed.
+
+        timeout : number of seconds after which the unfinished nodes of
+        a job are reported as crashed (default None, no timeout)
+
+    Jobs are run with the `PYTHONPATH` of the workflow, extended by the
+    directory nipype was imported from.
+    """
+
+    def __init__(self, plugin_args=None):
+        super(BatchPlugin, self).__init__(plugin_args=plugin_args)
+        scheduler = self.plugin_args.get('scheduler', 'sge')
+        if scheduler not in schedulers:
+            raise ValueError("Unknown scheduler: %s (available: %s)" % \
+                                 (scheduler, ', '.join(sorted(schedulers))))
+        options = dict(schedulers[scheduler])
+        options.update([(key, self.plugin_args[key])
+                        for key in ['submit_cmd', 'array_opt', 'task_var',
+                                    'status_cmd']
+                        if key in self.plugin_args])
+        self.submit_cmd = options['submit_cmd']
+        self.array_opt = options['array_opt']
+        self.task_var = options['task_var']
+        self.status_cmd = options['status_cmd']
+        self.status_interval = self.plugin_args.get('status_interval', 60)
+        self.timeout = self.plugin_args.get('timeout', None)
+        self.job_dir = self.plugin_args.get('job_dir', None)
+        self.script_header = self.plugin_args.get('script_header', '')
+        self.python = self.plugin_args.get('python', sys.executable)
+        self.batch_size = self.plugin_args.get('batch_size', 1)
+        self.array = self.plugin_args.get('array', False)
+        self.max_jobs = self.plugin_args.get('max_jobs', None)
+        self.poll_min = self.plugin_args.get('poll_interval', 1)
+        self.poll_max = self.plugin_args.get('poll_max', 60)
+        self.poll_backoff = self.plugin_args.get('poll_backoff', 1.5)
+        self.poll_interval = self.poll_min
+        self._taskid = 0
+        self._jobid = 0
+        # submitted nodes not yet handed to the scheduler
+        self._buffer = []
+        # jobs (lists of groups of task ids) held back by max_jobs
+        self._queued = []
+        # job id -> task ids of the unfinished tasks of a submitted job
+        self._jobs = {}
+        # task id -> job id
+        self._taskjob = {}
+        # job id -> (scheduler job id or None, submission time)
+        self._submitted = {}
+        # jobs whose status was not found by the last status check
+        self._missing = set()
+        self._last_status = time()
+
+    def submit_job(self, node):
+        if self.job_dir is None:
+            self.job_dir = mkdtemp(prefix='nipype_batch_', dir=os.getcwd())
+        elif not os.path.exists(self.job_dir):
+            os.makedirs(self.job_dir)
+        self._taskid += 1
+        taskid = self._taskid
+        fp = gzip.open(self._nodefile(taskid), 'wb')
+        try:
+            cPickle.dump(node, fp, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            fp.close()
+        self._buffer.append(taskid)
+        return taskid
+
+    def wait_for_results(self):
+        self._flush()
+        return super(BatchPlugin, self).wait_for_results()
+
+    def _nodefile(self, taskid):
+        return os.path.join(self.job_dir, 'node_%d.pklz' % taskid)
+
+    def _resultfile(self, taskid):
+        return os.path.join(self.job_dir, 'result_%d.pklz' % taskid)
+
+    def _flush(self):
+        """Group the buffered tasks into jobs and submit as many as allowed
+        """
+        groups = [self._buffer[i:i + self.batch_size]
+                  for i in range(0, len(self._buffer), self.batch_size)]
+        self._buffer = []
+        if self.array:
+            jobs = [groups]
+        else:
+            jobs = [[group] for group in groups]
+        self._queued.extend([job for job in jobs if job])
+        while self._queued and \
+                (not self.max_jobs or len(self._jobs) < self.max_jobs):
+            self._submit(self._queued.pop(0))
+
+    def _submit(self, groups):
+        """Write the job script for a list of task groups and submit it
+        """
+        self._jobid += 1
+        jobid = self._jobid
+        jobfile = os.path.join(self.job_dir, 'job_%d.pklz' % jobid)
+        fp = gzip.open(jobfile, 'wb')
+        try:
+            cPickle.dump([[(self._nodefile(taskid), self._resultfile(taskid))
+                           for taskid in group] for group in groups], fp,
+                         cPickle.HIGHEST_PROTOCOL)
+        finally:
+            fp.close()
+        cmd = "%s -c 'from nipype.pipeline.plugins.batch import run_job; " \
+            "run_job()' %s" % (self.python, jobfile)
+        submit_cmd = self.submit_cmd % dict(job_dir=self.job_dir)
+        if len(groups) > 1:
+            cmd += ' %s' % self.task_var
+            submit_cmd += ' ' + self.array_opt % len(groups)
+        scriptfile = os.path.join(self.job_dir, 'job_%d.sh' % jobid)
+        fp = open(scriptfile, 'wt')
+        fp.writelines(['#!/bin/sh\n', self.script_header, '\n',
+                       "PYTHONPATH='%s'${PYTHONPATH:+:$PYTHONPATH}\n" % \
+                           _python_path(),
+                       'export PYTHONPATH\n',
+                       'cd %s\n' % os.getcwd(), cmd, '\n'])
+        fp.close()
+        taskids = [taskid for group in groups for taskid in group]
+        logger.debug('Submitting job %d (tasks %s)', jobid, taskids)
+        proc = subprocess.Popen('%s %s' % (submit_cmd, scriptfile),
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                shell=True,
+                                cwd=self.job_dir)
+        stdout, stderr = proc.communicate()
+        if proc.returncode:
+            msg = 'Submission of %s failed:\n%s' % (scriptfile, stderr)
+            for taskid in taskids:
+                self._task_done(taskid, dict(result=None, traceback=[msg]))
+            return
+        self._jobs[jobid] = set(taskids)
+        for taskid in taskids:
+            self._taskjob[taskid] = jobid
+        schedid = _job_id.search(stdout)
+        if schedid is not None:
+            schedid = schedid.group(1)
+        self._submitted[jobid] = (schedid, time())
+
+    def _check_tasks(self):
+        """Collect the result files of finished tasks
+        """
+        finished = False
+        for taskid, jobid in self._taskjob.items():
+            resultfile = self._resultfile(taskid)
+            if not os.path.exists(resultfile):
+                continue
+            try:
+                fp = gzip.open(resultfile, 'rb')
+                try:
+                    result = cPickle.load(fp)
+                finally:
+                    fp.close()
+            except:
+                etype, eval, etr = sys.exc_info()
+                result = dict(result=None,
+                              traceback=format_exception(etype, eval, etr))
+            os.remove(resultfile)
+            del self._taskjob[taskid]
+            self._jobs[jobid].remove(taskid)
+            if not self._jobs[jobid]:
+                self._remove_job(jobid)
+            self._task_done(taskid, result)
+            finished = True
+        if self._check_jobs():
+            finished = True
+        if finished:
+            self.poll_interval = self.poll_min
+            # slots of finished jobs may be used by held back ones
+            self._flush()
+        else:
+            self.poll_interval = min(self.poll_interval * self.poll_backoff,
+                                     self.poll_max)
+
+    def _check_jobs(self):
+        """Report the tasks of jobs that timed out or ended without
+        writing their result files
+
+        Returns True if any task was reported.
+        """
+        now = time()
+        check_status = self.status_cmd and \
+            now - self._last_status >= self.status_interval
+        if check_status:
+            self._last_status = now
+        lost = []
+        for jobid, (schedid, submitted) in self._submitted.items():
+            if self.timeout is not None and now - submitted > self.timeout:
+                lost.append((jobid, 'did not finish within %s seconds' % \
+                                 self.timeout))
+            elif check_status and schedid is not None:
+                if self._job_exists(schedid):
+                    self._missing.discard(jobid)
+                elif jobid in self._missing:
+                    lost.append((jobid, 'ended without writing the results '
+                                 'of its nodes'))
+                else:
+                    # the result files may not be visible yet
+                    self._missing.add(jobid)
+        for jobid, reason in lost:
+            schedid = self._submitted[jobid][0]
+            msg = 'Job %d (scheduler id %s) %s. See the job script and ' \
+                'log files in %s\n' % (jobid, schedid, reason, self.job_dir)
+            logger.error(msg)
+            for taskid in self._jobs[jobid]:
+                del self._taskjob[taskid]
+                self._task_done(taskid, dict(result=None, traceback=[msg]))
+            self._remove_job(jobid)
+        return bool(lost)
+
+    def _job_exists(self, schedid):
+        """Return True if the scheduler still knows the job
+        """
+        proc = subprocess.Popen(self.status_cmd % dict(job=schedid),
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                shell=True)
+        stdout, _ = proc.communicate()
+        return proc.returncode == 0 and bool(stdout.strip())
+
+    def _remove_job(self, jobid):
+        del self._jobs[jobid]
+        del self._submitted[jobid]
+        self._missing.discard(jobid)
+
+
+def _python_path():
+    """Return the PYTHONPATH of jobs: the directory nipype was imported
+    from followed by the PYTHONPATH of this process
+    """
+    paths = [os.path.dirname(os.path.dirname(os.path.abspath(
+                    nipype.__file__)))]
+    if os.environ.get('PYTHONPATH'):
+        paths.append(os.environ['PYTHONPATH'])
+    return ':'.join(paths)
+
+def run_job(args=None):
+    """Run the nodes of a job created by :class:`BatchPlugin`
+
+    This is the entry point of the job scripts. `args` (defaults to
+    sys.argv[1:]) contains the job file and, for array jobs, the name of
+    the environment variable holding the index of the array task.
+    """
+    if args is None:
+        args = sys.argv[1:]
+    fp = gzip.open(args[0], 'rb')
+    try:
+        groups = cPickle.load(fp)
+    finally:
+        fp.close()
+    group = groups[0]
+    if len(args) > 1:
+        group = groups[int(os.environ[args[1]]) - 1]
+    for nodefile, resultfile in group:
+        try:
+            fp = gzip.open(nodefile, 'rb')
+            try:
+                node = cPickle.load(fp)
+            finally:
+                fp.close()
+            result = run_node(node)
+        except:
+            etype, eval, etr = sys.exc_info()
+            result = dict(result=None,
+                          traceback=format_exception(etype, eval, etr))
+        tmpfile = '%s.%d.tmp' % (resultfile, os.getpid())
+        fp = gzip.open(tmpfile, 'wb')
+        try:
+            try:
+                cPickle.dump(result, fp, cPickle.HIGHEST_PROTOCOL)
+            except:
+                # e.g., unpicklable outputs
+                etype, eval, etr = sys.exc_info()
+                fp.close()
+                fp = gzip.open(tmpfile, 'wb')
+                cPickle.dump(dict(result=None,
+                                  traceback=format_exception(etype, eval,
+                                                             etr)),
+                             fp, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            fp.close()
+        os.rename(tmpfile, resultfile)
+        os.remove(nodefile)
@@ -0,0 +1,118 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Parallel workflow execution via IPython's TaskClient interface
+"""
+
+import sys
+from threading import Event, Lock, Thread
+from traceback import format_exception
+
+from nipype.pipeline.plugins.base import PluginBase
+
+# the IPython client module or the error raised when importing it
+_ipyclient = None
+# TaskClient connected to the controller
+_taskclient = None
+_client_lock = Lock()
+
+def get_client():
+    """Return the IPython client module and a TaskClient
+
+    IPython is imported only once per process: if it is missing, later
+    calls raise the same ImportError without searching for it again. A
+    connection to the controller is kept once it has been made. Failed
+    connections are retried by the next call, so a cluster started
+    after a workflow fell back to serial execution is used by the next
+    run.
+    """
+    global _ipyclient, _taskclient
+    _client_lock.acquire()
+    try:
+        if _ipyclient is None:
+            try:
+                name = 'IPython.kernel.client'
+                __import__(name)
+                _ipyclient = sys.modules[name]
+            except ImportError:
+                _ipyclient = ImportError("Ipython kernel not found. Parallel "
+                                         "execution will be unavailable")
+        if isinstance(_ipyclient, Exception):
+            raise _ipyclient
+        if _taskclient is None:
+            try:
+                _taskclient = _ipyclient.TaskClient()
+            except Exception, e:
+                if isinstance(e, ValueError):
+                    raise ImportError("Ipython kernel not installed")
+                raise RuntimeError("No clients found: %s" % str(e))
+        return _ipyclient, _taskclient
+    finally:
+        _client_lock.release()
+
+
+class IPythonPlugin(PluginBase):
+    """Execute nodes on the engines of a running IPython cluster
+
+    The cluster has to be started separately (e.g., ``ipcluster local -n
+    8``). Raises an exception during initialization if IPython is not
+    installed or no controller could be contacted (see `get_client`).
+
+    The TaskClient does not provide completion callbacks, so a monitor
+    thread checks on the submitted tasks every `poll_interval` seconds
+    and reports finished ones to the workflow.
+    """
+
+    poll_interval = 0.1
+
+    def __init__(self, plugin_args=None):
+        super(IPythonPlugin, self).__init__(plugin_args=plugin_args)
+        self.ipyclient, self.taskclient = get_client()
+        self._pending = []
+        self._lock = Lock()
+        self._stop = Event()
+        self._monitor = Thread(target=self._monitor_tasks)
+        self._monitor.setDaemon(True)
+        self._monitor.start()
+
+    def submit_job(self, node):
+        cmdstr = """import sys
+from traceback import format_exception
+traceback=None
+try:
+    result = task.run()
+except:
+    etype, eval, etr = sys.exc_info()
+    traceback = format_exception(etype,eval,etr)
+    result = task.result
+"""
+        task = self.ipyclient.StringTask(cmdstr,
+                                         push = dict(task=node),
+                                         pull = ['result','traceback'])
+        taskid = self.taskclient.run(task, block = False)
+        self._lock.acquire()
+        self._pending.append(taskid)
+        self._lock.release()
+        return taskid
+
+    def shutdown(self):
+        self._stop.set()
+        self._monitor.join()
+
+    def _monitor_tasks(self):
+        while not self._stop.isSet():
+            self._lock.acquire()
+            pending = self._pending[:]
+            self._lock.release()
+            for taskid in pending:
+                try:
+                    res = self.taskclient.get_task_result(taskid, block=False)
+                except:
+                    etype, eval, etr = sys.exc_info()
+                    res = dict(result=None,
+                               traceback=format_exception(etype, eval, etr))
+                if res:
+                    self._lock.acquire()
+                    self._pending.remove(taskid)
+                    self._lock.release()
+                    self._task_done(taskid, res)
+            self._stop.wait(self.poll_interval)
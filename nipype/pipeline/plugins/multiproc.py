@@ -0,0 +1,132 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Parallel workflow execution via a local pool of processes
+
+Makes use of the multiprocessing module (python >= 2.6) to run the
+ready nodes of an execution graph on the cores of a single machine
+without requiring an IPython cluster.
+"""
+
+from ConfigParser import NoOptionError
+import os
+import sys
+from traceback import format_exception
+
+from nipype.pipeline.plugins.base import PluginBase, run_node
+from nipype.utils.config import config
+from nipype.utils.logs import QueueListener, init_worker_logging
+
+
+class MultiProcPlugin(PluginBase):
+    """Execute nodes on a local pool of worker processes
+
+    Parameters
+    ----------
+
+    plugin_args : dict
+        n_procs : number of worker processes. Defaults to the
+        `n_procs` option of the `execution` section of the config file
+        and, if that is not set, to the number of cores of the machine.
+
+        memory_gb : memory (in GB) available to the workers. Defaults to
+        the physical memory of the machine.
+
+    Nodes are only submitted while the processors (see `Node.n_procs`)
+    and memory (see `Node.memory_gb`) they need are available. A node
+    that needs more than the machine provides runs on its own.
+    """
+
+    def __init__(self, plugin_args=None):
+        super(MultiProcPlugin, self).__init__(plugin_args=plugin_args)
+        try:
+            from multiprocessing import Pool, cpu_count
+        except ImportError:
+            raise ImportError("multiprocessing module not found. Local "
+                              "parallel execution requires python >= 2.6")
+        n_procs = self.plugin_args.get('n_procs', None)
+        if n_procs is None:
+            try:
+                n_procs = config.getint('execution', 'n_procs')
+            except NoOptionError:
+                n_procs = cpu_count()
+        self.n_procs = n_procs
+        self.memory_gb = self.plugin_args.get('memory_gb', None)
+        if self.memory_gb is None:
+            self.memory_gb = _physical_memory_gb()
+        # the workers pass their log records to this process
+        self._listener = QueueListener()
+        self._listener.start()
+        self.pool = Pool(processes=self.n_procs,
+                         initializer=init_worker_logging,
+                         initargs=(self._listener.queue,))
+        self._taskresult = {}
+        self._taskid = 0
+        # task id -> (processors, memory) reserved by the running task
+        self._reserved = {}
+
+    def can_run(self, node):
+        if not self._reserved:
+            return True
+        procs = sum([res[0] for res in self._reserved.values()])
+        memory = sum([res[1] for res in self._reserved.values()])
+        return procs + node.n_procs <= self.n_procs and \
+            (self.memory_gb is None or \
+                 memory + node.memory_gb <= self.memory_gb)
+
+    def submit_job(self, node):
+        self._taskid += 1
+        taskid = self._taskid
+        self._reserved[taskid] = (node.n_procs, node.memory_gb)
+        callback = lambda result: self._job_finished_cb(taskid, result)
+        self._taskresult[taskid] = self.pool.apply_async(run_node, (node,),
+                                                         callback=callback)
+        return taskid
+
+    def wait_for_results(self):
+        results = super(MultiProcPlugin, self).wait_for_results()
+        for taskid, _ in results:
+            self._reserved.pop(taskid, None)
+        return results
+
+    def _job_finished_cb(self, taskid, result):
+        """Runs in the result handler thread of the pool
+        """
+        self._taskresult.pop(taskid, None)
+        self._task_done(taskid, result)
+
+    def shutdown(self):
+        self.pool.close()
+        self.pool.join()
+        self._listener.stop()
+
+    def _check_tasks(self):
+        """Report tasks that died without triggering their callback
+        (e.g., because their result could not be pickled)
+        """
+        for taskid, asyncresult in self._taskresult.items():
+            if not asyncresult.ready():
+                continue
+            # the callback may have removed the task since the snapshot
+            if self._taskresult.pop(taskid, None) is None:
+                continue
+            if not asyncresult.successful():
+                try:
+                    asyncresult.get()
+                except:
+                    etype, eval, etr = sys.exc_info()
+                    self._task_done(taskid,
+                                    dict(result=None,
+                                         traceback=format_exception(etype,
+                                                                    eval,
+                                                                    etr)))
+
+
+def _physical_memory_gb():
+    """Returns the physical memory of the machine in GB or None if it
+    cannot be determined
+    """
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * \
+            os.sysconf('SC_PHYS_PAGES') / 1024. ** 3
+    except (AttributeError, ValueError, OSError):
+        return None
@@ -0,0 +1,5 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+from nipype.testing import skip_if_no_package
+skip_if_no_package('networkx', '1.0')
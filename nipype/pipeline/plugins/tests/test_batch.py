@@ -0,0 +1,169 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Tests for the batch execution plugin
+
+The tests replace qsub by a fake scheduler that starts each submitted
+job script (or each task of an array job) as a background process
+without the PYTHONPATH of the tests, so the job scripts have to set it.
+The id of a job is the process id of its (first) task.
+"""
+import os
+import sys
+from tempfile import mkdtemp
+from shutil import rmtree
+
+from nipype.testing import assert_equal, assert_true, parametric
+import nipype.interfaces.base as nib
+import nipype.pipeline.engine as pe
+from nipype.pipeline.plugins import BatchPlugin
+from nipype.pipeline.crash import load_crashfile
+
+fake_qsub = """import os, subprocess, sys
+args = sys.argv[1:]
+ntasks = 0
+if '-t' in args:
+    ntasks = int(args[args.index('-t') + 1].split('-')[1])
+script = args[-1]
+open(os.path.join(os.path.dirname(script), 'submitted'), 'a').write('%d\\n' % max(ntasks, 1))
+env = dict(os.environ)
+env.pop('PYTHONPATH', None)
+pids = []
+for task in range(1, ntasks + 1):
+    env['SGE_TASK_ID'] = str(task)
+    pids.append(subprocess.Popen(['sh', script], env=env).pid)
+if not ntasks:
+    pids.append(subprocess.Popen(['sh', script], env=env).pid)
+print 'Your job %d has been submitted' % pids[0]
+"""
+
+# prints the process id of a job while it runs
+fake_qstat = 'kill -0 %(job)s 2>/dev/null && echo %(job)s'
+
+
+class InputSpec(nib.TraitedSpec):
+    input1 = nib.traits.Int(desc='a random int')
+    input2 = nib.traits.List(nib.traits.Int, desc='upstream outputs')
+
+class OutputSpec(nib.TraitedSpec):
+    output1 = nib.traits.List(nib.traits.Int, desc='outputs')
+
+class TestInterface(nib.BaseInterface):
+    input_spec = InputSpec
+    output_spec = OutputSpec
+
+    def _run_interface(self, runtime):
+        if self.inputs.input1 < 0:
+            raise RuntimeError('negative input')
+        runtime.returncode = 0
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs['output1'] = [1, self.inputs.input1]
+        return outputs
+
+def _run_fanout(temp_dir, inputs, **plugin_args):
+    """Run a workflow with one root node and a child per input"""
+    fakefile = os.path.join(temp_dir, 'fake_qsub.py')
+    open(fakefile, 'wt').write(fake_qsub)
+    job_dir = os.path.join(temp_dir, 'jobs')
+    plugin_args.update(submit_cmd='%s %s' % (sys.executable, fakefile),
+                       job_dir=job_dir, poll_interval=0.05, poll_max=0.2)
+    pipe = pe.Workflow(name='pipe')
+    pipe.base_dir = temp_dir
+    root = pe.Node(interface=TestInterface(), name='root')
+    root.inputs.input1 = 0
+    for i, value in enumerate(inputs):
+        child = pe.Node(interface=TestInterface(), name='child%d' % i)
+        child.inputs.input1 = value
+        pipe.connect([(root, child, [('output1', 'input2')])])
+    pipe.run(plugin='batch', plugin_args=plugin_args)
+    submitted = [int(line) for line in
+                 open(os.path.join(job_dir, 'submitted')).readlines()]
+    return pipe, submitted
+
+@parametric
+def test_run_batch():
+    cur_dir = os.getcwd()
+    temp_dir = mkdtemp(prefix='test_batch_')
+    os.chdir(temp_dir)
+    pipe, submitted = _run_fanout(temp_dir, [1, 2, 3, 4, 5])
+    for i in range(5):
+        node = pipe.get_exec_node('pipe.child%d' % i)
+        yield assert_equal(node.get_output('output1'), [1, i + 1])
+    # one job per node
+    yield assert_equal(submitted, [1] * 6)
+    os.chdir(cur_dir)
+    rmtree(temp_dir)
+
+@parametric
+def test_run_batch_arrays():
+    cur_dir = os.getcwd()
+    temp_dir = mkdtemp(prefix='test_batch_')
+    os.chdir(temp_dir)
+    pipe, submitted = _run_fanout(temp_dir, [1, 2, 3, 4, 5], batch_size=2,
+                                  array=True, max_jobs=1)
+    for i in range(5):
+        node = pipe.get_exec_node('pipe.child%d' % i)
+        yield assert_equal(node.get_output('output1'), [1, i + 1])
+    # the root node and one array job with three batches of children
+    yield assert_equal(submitted, [1, 3])
+    os.chdir(cur_dir)
+    rmtree(temp_dir)
+
+@parametric
+def test_batch_crash():
+    cur_dir = os.getcwd()
+    temp_dir = mkdtemp(prefix='test_batch_')
+    os.chdir(temp_dir)
+    pipe, submitted = _run_fanout(temp_dir, [1, -1], max_jobs=1)
+    yield assert_equal(pipe.get_exec_node('pipe.child0').get_output('output1'),
+                       [1, 1])
+    yield assert_equal(pipe.get_exec_node('pipe.child1').result.outputs,
+                       None)
+    crashfiles = [f for f in os.listdir(temp_dir) if f.startswith('crash')]
+    yield assert_equal(len(crashfiles), 1)
+    os.chdir(cur_dir)
+    rmtree(temp_dir)
+
+@parametric
+def test_poll_backoff():
+    plugin = BatchPlugin(dict(poll_interval=1, poll_max=3, poll_backoff=2))
+    yield assert_equal(plugin.poll_interval, 1)
+    plugin._check_tasks()
+    yield assert_equal(plugin.poll_interval, 2)
+    plugin._check_tasks()
+    plugin._check_tasks()
+    yield assert_equal(plugin.poll_interval, 3)
+
+@parametric
+def test_batch_lost_jobs():
+    cur_dir = os.getcwd()
+    temp_dir = mkdtemp(prefix='test_batch_')
+    os.chdir(temp_dir)
+    # jobs that end before running their nodes are found by their status
+    pipe, submitted = _run_fanout(temp_dir, [1], script_header='exit 1',
+                                  status_cmd=fake_qstat, status_interval=0.1)
+    yield assert_equal(pipe.get_exec_node('pipe.root').result, None)
+    yield assert_equal(submitted, [1])
+    crashfiles = [f for f in os.listdir(temp_dir) if f.startswith('crash')]
+    yield assert_equal(len(crashfiles), 1)
+    record = load_crashfile(os.path.join(temp_dir, crashfiles[0]))
+    yield assert_true('ended without writing' in record['exception'])
+    os.chdir(cur_dir)
+    rmtree(temp_dir)
+
+@parametric
+def test_batch_timeout():
+    cur_dir = os.getcwd()
+    temp_dir = mkdtemp(prefix='test_batch_')
+    os.chdir(temp_dir)
+    pipe, submitted = _run_fanout(temp_dir, [1], script_header='exit 1',
+                                  status_cmd=None, timeout=0.2)
+    yield assert_equal(pipe.get_exec_node('pipe.root').result, None)
+    crashfiles = [f for f in os.listdir(temp_dir) if f.startswith('crash')]
+    record = load_crashfile(os.path.join(temp_dir, crashfiles[0]))
+    yield assert_true('did not finish within 0.2 seconds' in
+                      record['exception'])
+    os.chdir(cur_dir)
+    rmtree(temp_dir)
@@ -0,0 +1,134 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Tests for the multiproc execution plugin
+"""
+import os
+from tempfile import mkdtemp
+from shutil import rmtree
+
+from nipype.testing import (assert_equal, assert_true, assert_false,
+                            assert_raises, parametric)
+import nipype.interfaces.base as nib
+import nipype.pipeline.engine as pe
+from nipype.pipeline.plugins import get_plugin, MultiProcPlugin
+
+class InputSpec(nib.TraitedSpec):
+    input1 = nib.traits.Int(desc='a random int')
+    input2 = nib.traits.Int(desc='a random int')
+
+class OutputSpec(nib.TraitedSpec):
+    output1 = nib.traits.List(nib.traits.Int, desc='outputs')
+
+class TestInterface(nib.BaseInterface):
+    input_spec = InputSpec
+    output_spec = OutputSpec
+
+    def _run_interface(self, runtime):
+        runtime.returncode = 0
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs['output1'] = [1, self.inputs.input1]
+        return outputs
+
+@parametric
+def test_get_plugin():
+    yield assert_raises(ValueError, get_plugin, 'foo')
+    plugin = get_plugin('multiproc', dict(n_procs=2))
+    yield assert_equal(plugin.__class__, MultiProcPlugin)
+    yield assert_equal(plugin.n_procs, 2)
+    plugin.shutdown()
+
+@parametric
+def test_can_run():
+    plugin = MultiProcPlugin(dict(n_procs=4, memory_gb=4))
+    small = pe.Node(interface=TestInterface(), name='small', memory_gb=1)
+    big = pe.Node(interface=TestInterface(), name='big', n_procs=2,
+                  memory_gb=3)
+    huge = pe.Node(interface=TestInterface(), name='huge', memory_gb=10)
+    # a node that does not fit the machine runs on its own
+    yield assert_true(plugin.can_run(huge))
+    plugin._reserved[1] = (small.n_procs, small.memory_gb)
+    yield assert_true(plugin.can_run(big))
+    yield assert_false(plugin.can_run(huge))
+    plugin._reserved[2] = (big.n_procs, big.memory_gb)
+    yield assert_false(plugin.can_run(small))
+    del plugin._reserved[2]
+    plugin._reserved[3] = (4, 0)
+    yield assert_false(plugin.can_run(small))
+    plugin.shutdown()
+
+@parametric
+def test_run_multiproc():
+    cur_dir = os.getcwd()
+    temp_dir = mkdtemp(prefix='test_multiproc_')
+    os.chdir(temp_dir)
+
+    pipe = pe.Workflow(name='pipe')
+    mod1 = pe.Node(interface=TestInterface(),name='mod1')
+    mod2 = pe.MapNode(interface=TestInterface(),
+                      iterfield=['input1'],
+                      name='mod2')
+    pipe.connect([(mod1,mod2,[('output1','input1')])])
+    pipe.base_dir = os.getcwd()
+    mod1.inputs.input1 = 1
+    pipe.run(plugin='multiproc', plugin_args=dict(n_procs=2))
+    node = pipe.get_exec_node('pipe.mod1')
+    result = node.get_output('output1')
+    yield assert_equal(result, [1, 1])
+    node = pipe.get_exec_node('pipe.mod2')
+    result = node.get_output('output1')
+    yield assert_equal(result, [[1, 1], [1, 1]])
+    os.chdir(cur_dir)
+    rmtree(temp_dir)
+
+class CrashInterface(TestInterface):
+    def _run_interface(self, runtime):
+        raise RuntimeError('crashing on purpose')
+
+@parametric
+def test_crash_multiproc():
+    cur_dir = os.getcwd()
+    temp_dir = mkdtemp(prefix='test_multiproc_')
+    os.chdir(temp_dir)
+
+    pipe = pe.Workflow(name='pipe')
+    mod1 = pe.Node(interface=CrashInterface(),name='mod1')
+    mod2 = pe.Node(interface=TestInterface(),name='mod2')
+    mod3 = pe.Node(interface=TestInterface(),name='mod3')
+    pipe.connect([(mod1,mod2,[('output1','input1')])])
+    pipe.add_nodes([mod3])
+    pipe.base_dir = os.getcwd()
+    mod1.inputs.input1 = 1
+    mod3.inputs.input1 = 3
+    pipe.run(plugin='multiproc', plugin_args=dict(n_procs=2))
+    yield assert_equal(pipe.get_exec_node('pipe.mod2').result, None)
+    node = pipe.get_exec_node('pipe.mod3')
+    yield assert_equal(node.get_output('output1'), [1, 3])
+    crashfiles = [f for f in os.listdir(temp_dir) if f.startswith('crash')]
+    yield assert_equal(len(crashfiles), 1)
+    os.chdir(cur_dir)
+    rmtree(temp_dir)
+
+class FinishingResult(object):
+    """A task whose callback runs while the plugin checks on it"""
+    def __init__(self, plugin, taskid):
+        self.plugin = plugin
+        self.taskid = taskid
+
+    def ready(self):
+        self.plugin._job_finished_cb(self.taskid,
+                                     dict(result=None, traceback=None))
+        return True
+
+@parametric
+def test_check_finishing_tasks():
+    plugin = MultiProcPlugin(dict(n_procs=1))
+    plugin._taskresult[1] = FinishingResult(plugin, 1)
+    plugin._check_tasks()
+    yield assert_equal(plugin._taskresult, {})
+    # the task is reported once, by its callback
+    yield assert_equal(plugin.wait_for_results(),
+                       [(1, dict(result=None, traceback=None))])
+    plugin.shutdown()
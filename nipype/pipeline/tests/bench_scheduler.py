@@ -0,0 +1,47 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Benchmarks for the workflow scheduler
+
+Run with ``nipype.bench()`` or ``nosetests --match bench``.
+"""
+import os
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import time
+
+import nipype.pipeline.engine as pe
+from nipype.pipeline.tests.test_engine import TestInterface
+
+def _chain_workflow(nnodes):
+    """A workflow in which each node depends on its predecessor
+    """
+    pipe = pe.Workflow(name='chain')
+    nodes = [pe.Node(interface=TestInterface(), name='mod%d' % i) \
+                 for i in range(nnodes)]
+    nodes[0].inputs.input1 = 1
+    for src, dst in zip(nodes[:-1], nodes[1:]):
+        pipe.connect(src, ('output1', lambda x: x[-1]), dst, 'input1')
+    return pipe
+
+def bench_scheduling_overhead():
+    """Per node wall clock time of a chain of trivial nodes
+
+    Every node of a chain has to wait for its parent, so the time per node
+    is dominated by the latency between a node finishing and its child
+    being dispatched.
+    """
+    cur_dir = os.getcwd()
+    temp_dir = mkdtemp(prefix='bench_scheduler_')
+    os.chdir(temp_dir)
+    print
+    print 'Scheduling overhead (multiproc plugin, 2 processes)'
+    print '%8s %10s %14s' % ('nodes', 'total (s)', 'per node (ms)')
+    for nnodes in [10, 50, 100]:
+        pipe = _chain_workflow(nnodes)
+        pipe.base_dir = os.path.join(temp_dir, str(nnodes))
+        t0 = time()
+        pipe.run(plugin='multiproc', plugin_args=dict(n_procs=2))
+        total = time() - t0
+        print '%8d %10.3f %14.1f' % (nnodes, total, 1000. * total / nnodes)
+    os.chdir(cur_dir)
+    rmtree(temp_dir)
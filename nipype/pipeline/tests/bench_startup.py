@@ -0,0 +1,34 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Benchmarks for the startup time of worker processes
+
+Run with ``nipype.bench()`` or ``nosetests --match bench``.
+"""
+from nipype.testing import assert_false
+from nipype.pipeline.tests.test_engine import (_import_in_subprocess,
+                                               lazy_modules)
+
+def bench_import_time():
+    """Time to import the engine and the interface packages in a new
+    interpreter
+
+    Each module is imported after the modules of the rows above it, so
+    the added time of a row is the cost of that module. The imports
+    must not load the optional backends of the interfaces.
+    """
+    modules = ['numpy', 'networkx', 'enthought.traits.api', 'nipype',
+               'nipype.interfaces.base', 'nipype.pipeline.engine',
+               'nipype.interfaces.fsl', 'nipype.interfaces.spm',
+               'nipype.interfaces.freesurfer']
+    print
+    print 'Import time in a new interpreter'
+    print '%30s %10s %10s' % ('module', 'total (s)', 'added (s)')
+    previous = 0.
+    for i, module in enumerate(modules):
+        # the fastest of a few runs is the least disturbed by other work
+        runs = [_import_in_subprocess(modules[:i + 1]) for _ in range(3)]
+        total, loaded = min(runs)
+        print '%30s %10.3f %10.3f' % (module, total, total - previous)
+        previous = total
+    for module in lazy_modules:
+        assert_false(module in loaded, '%s was imported' % module)
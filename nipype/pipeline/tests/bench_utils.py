@@ -0,0 +1,154 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Benchmarks for the graph utilities of the pipeline engine
+
+Run with ``nipype.bench()`` or ``nosetests --match bench``.
+"""
+from copy import deepcopy
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+import nipype.interfaces.base as nib
+from nipype.interfaces.traits import start_stat_cache, stop_stat_cache
+import nipype.pipeline.engine as pe
+from nipype.pipeline.tests.test_engine import TestInterface
+
+def _iterable_workflow(nnodes, nsubjects, nparams):
+    """A chain of nodes whose first node iterates over subjects and whose
+    second node iterates over a parameter
+    """
+    pipe = pe.Workflow(name='pipe')
+    nodes = [pe.Node(interface=TestInterface(), name='mod%d' % i) \
+                 for i in range(nnodes)]
+    nodes[0].iterables = ('input1', range(nsubjects))
+    nodes[1].iterables = ('input2', range(nparams))
+    for src, dst in zip(nodes[:-1], nodes[1:]):
+        pipe.connect(src, 'output1', dst, 'input1')
+    return pipe
+
+def bench_generate_expanded_graph():
+    """Time to expand the iterables of a 40 node workflow
+    """
+    print
+    print 'Expansion of iterables (40 node chain)'
+    print '%10s %10s %10s' % ('combos', 'nodes', 'time (s)')
+    for nsubjects, nparams in [(10, 3), (50, 3), (200, 3)]:
+        pipe = _iterable_workflow(40, nsubjects, nparams)
+        pipe._create_flat_graph()
+        flatgraph = deepcopy(pipe._flatgraph)
+        t0 = time()
+        execgraph = pe._generate_expanded_graph(flatgraph)
+        total = time() - t0
+        print '%10d %10d %10.3f' % (nsubjects * nparams,
+                                    len(execgraph.nodes()), total)
+
+def _nested_workflow(nworkflows, nnodes):
+    """A chain of `nworkflows` subworkflows, each a chain of `nnodes` nodes
+    """
+    pipe = pe.Workflow(name='pipe')
+    subs = []
+    for i in range(nworkflows):
+        sub = pe.Workflow(name='sub%d' % i)
+        nodes = [pe.Node(interface=TestInterface(), name='mod%d' % j) \
+                     for j in range(nnodes)]
+        for src, dst in zip(nodes[:-1], nodes[1:]):
+            sub.connect(src, 'output1', dst, 'input1')
+        subs.append(sub)
+    for src, dst in zip(subs[:-1], subs[1:]):
+        pipe.connect(src, 'mod%d.output1' % (nnodes - 1), dst, 'mod0.input2')
+    return pipe
+
+def bench_create_flat_graph():
+    """Time to flatten a workflow of 15 subworkflows
+    """
+    print
+    print 'Flattening 15 subworkflows'
+    print '%10s %12s %12s %12s' % ('nodes', 'deepcopy (s)', 'flatten (s)',
+                                   'cached (s)')
+    for nnodes in [10, 50, 100]:
+        pipe = _nested_workflow(15, nnodes)
+        t0 = time()
+        workflowcopy = deepcopy(pipe)
+        workflowcopy._generate_execgraph()
+        deepcopied = time() - t0
+        t0 = time()
+        pipe._create_flat_graph()
+        pipe._copy_flat_graph()
+        flattened = time() - t0
+        t0 = time()
+        pipe._create_flat_graph()
+        pipe._copy_flat_graph()
+        cached = time() - t0
+        print '%10d %12.3f %12.3f %12.3f' % (15 * nnodes, deepcopied,
+                                             flattened, cached)
+
+def bench_connect():
+    """Time to build a chain of nodes with one `connect` call per edge
+    """
+    print
+    print 'Building a chain with connect'
+    print '%10s %12s %12s' % ('nodes', 'connect (s)', 'get_node (s)')
+    for nnodes in [500, 1000, 2000]:
+        nodes = [pe.Node(interface=TestInterface(), name='mod%d' % i) \
+                     for i in range(nnodes)]
+        pipe = pe.Workflow(name='pipe')
+        t0 = time()
+        for src, dst in zip(nodes[:-1], nodes[1:]):
+            pipe.connect(src, 'output1', dst, 'input1')
+        connected = time() - t0
+        t0 = time()
+        for i in range(nnodes):
+            pipe.get_node('mod%d' % i)
+        looked_up = time() - t0
+        print '%10d %12.3f %12.3f' % (nnodes, connected, looked_up)
+
+
+class FileInputSpec(nib.TraitedSpec):
+    in_file = nib.File(exists=True)
+
+class FileOutputSpec(nib.TraitedSpec):
+    out_files = nib.traits.List(nib.File(exists=True))
+
+class FileInterface(nib.BaseInterface):
+    input_spec = FileInputSpec
+    output_spec = FileOutputSpec
+
+def bench_set_node_input():
+    """Time to pass a list of files from a node to 4 MapNodes
+    """
+    print
+    print 'Propagating a list of files to 4 MapNodes'
+    print '%10s %12s %12s' % ('files', 'deepcopy (s)', 'current (s)')
+    tmpdir = mkdtemp()
+    pipe = pe.Workflow(name='pipe')
+    for nfiles in [100, 1000, 5000]:
+        files = []
+        for i in range(nfiles):
+            files.append(os.path.join(tmpdir, 'file%d.nii' % i))
+            open(files[-1], 'w').close()
+        source = pe.Node(interface=FileInterface(), name='source')
+        outputs = FileInterface()._outputs()
+        outputs.out_files = files
+        source._result = nib.InterfaceResult(interface=None, runtime=None,
+                                             outputs=outputs)
+        children = [pe.MapNode(interface=FileInterface(),
+                               name='child%d' % i, iterfield=['in_file']) \
+                        for i in range(4)]
+        # the former propagation: a copy for the edge and one for the node
+        t0 = time()
+        for child in children:
+            val = source.get_output('out_files')[:]
+            setattr(child.inputs, 'in_file', deepcopy(deepcopy(val)))
+        copied = time() - t0
+        t0 = time()
+        start_stat_cache()
+        try:
+            for child in children:
+                pipe._set_node_input(child, 'in_file', source, 'out_files')
+        finally:
+            stop_stat_cache()
+        current = time() - t0
+        print '%10d %12.3f %12.3f' % (nfiles, copied, current)
+    rmtree(tmpdir)
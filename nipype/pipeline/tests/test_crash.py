@@ -0,0 +1,79 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+import os
+from glob import glob
+from tempfile import mkdtemp
+from shutil import rmtree
+
+from nipype.testing import (assert_equal, assert_not_equal, assert_true,
+                            parametric)
+import nipype.interfaces.base as nib
+import nipype.pipeline.engine as pe
+from nipype.pipeline.crash import (crash_signature, load_crashfile, summarize,
+                                   crash_interface)
+from nipype.pipeline.tests.test_engine import TestInterface
+
+def _traceback(message, line=10):
+    return ['Traceback (most recent call last):\n',
+            '  File "/a/b.py", line %d, in run\n' % line,
+            '    raise RuntimeError(%r)\n' % message,
+            'RuntimeError: %s\n' % message]
+
+class LicenseInterface(TestInterface):
+    def _run_interface(self, runtime):
+        if self.inputs.input1 > 0:
+            raise RuntimeError('no license for subject %d' % \
+                                   self.inputs.input1)
+        return super(LicenseInterface, self)._run_interface(runtime)
+
+@parametric
+def test_crash_signature():
+    signature = crash_signature(_traceback('subject 1 failed'))
+    yield assert_equal(crash_signature(_traceback('subject 2 failed')),
+                       signature)
+    yield assert_not_equal(crash_signature(_traceback('subject 1 failed',
+                                                      line=11)),
+                           signature)
+
+@parametric
+def test_crash_records():
+    cur_dir = os.getcwd()
+    temp_dir = mkdtemp(prefix='test_crash_')
+    os.chdir(temp_dir)
+    pipe = pe.Workflow(name='pipe')
+    mod1 = pe.Node(interface=TestInterface(), name='mod1')
+    mod2 = pe.Node(interface=LicenseInterface(), name='mod2')
+    mod1.iterables = ('input1', [1, 2, 3])
+    pipe.connect([(mod1, mod2, [(('output1', max), 'input1')])])
+    pipe.base_dir = temp_dir
+    pipe.run(inseries=True)
+    crashfiles = sorted(glob(os.path.join(temp_dir, 'crash-*.pklz')))
+    yield assert_equal(len(crashfiles), 3)
+    records = [load_crashfile(crashfile) for crashfile in crashfiles]
+    # the same cause is only stored once
+    withtraceback = [record for record in records if record['traceback']]
+    yield assert_equal(len(withtraceback), 1)
+    yield assert_equal(len(set([record['signature'] for record in records])),
+                       1)
+    record = records[0]
+    yield assert_equal(record['interface'],
+                       'nipype.pipeline.tests.test_crash.LicenseInterface')
+    yield assert_equal(len(record['upstream']), 1)
+    yield assert_equal(record['edges'], [(record['upstream'][0],
+                                          record['node'])])
+    interface = crash_interface(record)
+    yield assert_equal(interface.inputs.input1, record['inputs']['input1'])
+    groups = summarize(crashfiles)
+    yield assert_equal(len(groups), 1)
+    yield assert_equal(groups[0]['count'], 3)
+    yield assert_equal(groups[0]['traceback'], withtraceback[0]['traceback'])
+    # a later run stores the traceback in its own crash directory
+    pipe.config = dict(crashdump_dir=os.path.join(temp_dir, 'crashes'))
+    pipe.run(inseries=True)
+    crashfiles = glob(os.path.join(temp_dir, 'crashes', 'crash-*.pklz'))
+    groups = summarize(crashfiles)
+    yield assert_equal(groups[0]['count'], 3)
+    yield assert_true(groups[0]['traceback'] is not None)
+    yield assert_true(groups[0]['crashfile'] in crashfiles)
+    os.chdir(cur_dir)
+    rmtree(temp_dir)
@@ -4,6 +4,12 @@
 """
 import os
 from copy import deepcopy
+import cPickle
+import gzip
+import heapq
+from socket import gethostname
+import subprocess
+import sys
 from tempfile import mkdtemp
 from shutil import rmtree
 from nose import with_setup
@@ -13,8 +19,14 @@ import networkx as nx
 from nipype.testing import (assert_raises, assert_equal, assert_true,
                             assert_false, skipif, parametric)
 import nipype.interfaces.base as nib
-from nipype.utils.filemanip import cleandir
+from nipype.utils.filemanip import cleandir, load_json
 import nipype.pipeline.engine as pe
+from nipype.pipeline.journal import ExecutionJournal
+from nipype.pipeline.plugins import ipython
+from nipype.pipeline.utils import load_resultfile
+from nipype.utils.config import config
+from nipype.utils.runtimedb import (get_runtime_history, interface_name,
+                                    input_signature)
 
 class InputSpec(nib.TraitedSpec):
     input1 = nib.traits.Int(desc='a random int')
@@ -79,7 +91,188 @@ def test_generate_dependency_list():
     yield assert_equal(len(pipe.procs), 2)
     yield assert_false(pipe.proc_done[1])
     yield assert_false(pipe.proc_pending[1])
-    yield assert_equal(pipe.depidx[0,1], 1)
+    jobid1 = pipe.procidx[pipe.get_exec_node('pipe.mod1')]
+    jobid2 = pipe.procidx[pipe.get_exec_node('pipe.mod2')]
+    yield assert_equal(pipe.indegree[jobid1], 0)
+    yield assert_equal(pipe.indegree[jobid2], 1)
+    yield assert_equal(pipe.priority[jobid1], 2)
+    yield assert_equal(pipe.priority[jobid2], 1)
+    yield assert_equal(pipe.readytorun, [(-2, jobid1)])
+
+@parametric
+def test_priority_order():
+    pipe = pe.Workflow(name='pipe')
+    mod1 = pe.Node(interface=TestInterface(),name='mod1')
+    mod2 = pe.Node(interface=TestInterface(),name='mod2')
+    mod3 = pe.Node(interface=TestInterface(),name='mod3')
+    single = pe.Node(interface=TestInterface(),name='single')
+    pipe.connect([(mod1,mod2,[('output1','input1')]),
+                  (mod2,mod3,[('output1','input1')])])
+    pipe.add_nodes([single])
+    pipe._create_flat_graph()
+    pipe._execgraph = pe._generate_expanded_graph(deepcopy(pipe._flatgraph))
+    pipe._generate_dependency_list()
+    # the start of the long chain is dispatched first
+    jobid = heapq.heappop(pipe.readytorun)[1]
+    yield assert_equal(pipe.procs[jobid].name, 'mod1')
+    jobid = heapq.heappop(pipe.readytorun)[1]
+    yield assert_equal(pipe.procs[jobid].name, 'single')
+
+@parametric
+def test_historical_priority():
+    cur_dir = os.getcwd()
+    temp_dir = mkdtemp(prefix='test_engine_')
+    os.chdir(temp_dir)
+
+    pipe = pe.Workflow(name='pipe')
+    mod1 = pe.Node(interface=TestInterface(),name='mod1')
+    mod2 = pe.MapNode(interface=TestInterface(),iterfield=['input1'],
+                      name='mod2')
+    single = pe.Node(interface=TestInterface(),name='single')
+    pipe.connect([(mod1,mod2,[('output1','input1')])])
+    pipe.add_nodes([single])
+    pipe.base_dir = os.getcwd()
+    mod1.inputs.input1 = 1
+    single.inputs.input1 = 1
+    pipe.run(plugin='linear')
+    # pretend that the single node took long the last time
+    resultfile = os.path.join(temp_dir, 'pipe', 'single',
+                              'result_single.pklz')
+    result = load_resultfile(resultfile)
+    result['runtime']['duration'] = 100.
+    fp = gzip.open(resultfile, 'wb')
+    cPickle.dump(result, fp)
+    fp.close()
+    pipe._generate_dependency_list()
+    jobid = heapq.heappop(pipe.readytorun)[1]
+    yield assert_equal(pipe.procs[jobid].name, 'single')
+    yield assert_equal(pipe.priority[jobid], 100.)
+    os.chdir(cur_dir)
+    rmtree(temp_dir)
+
+@parametric
+def test_runtime_history():
+    cur_dir = os.getcwd()
+    temp_dir = mkdtemp(prefix='test_engine_')
+    os.chdir(temp_dir)
+    config.set('execution', 'use_runtime_history', 'true')
+    config.set('execution', 'hash_cache_dir', temp_dir)
+    try:
+        mod1 = pe.Node(interface=TestInterface(),name='mod1')
+        mod1.base_dir = temp_dir
+        mod1.inputs.input1 = 1
+        mod1.run()
+        history = get_runtime_history()
+        name = interface_name(mod1.interface)
+        estimate = history.estimate(name)
+        yield assert_equal(estimate['count'], 1)
+        yield assert_equal(estimate['duration'],
+                           mod1.result.runtime.duration)
+        # memory needs are estimated from runs with similar inputs
+        history.record(name, input_signature(mod1.inputs), gethostname(),
+                       1., 2048.)
+        mod2 = pe.Node(interface=TestInterface(),name='mod2')
+        mod2.inputs.input1 = 1
+        mod2._estimate_memory(history)
+        yield assert_equal(mod2.memory_gb, 2.)
+        # an explicit setting overrides the estimate
+        mod2.memory_gb = 3
+        yield assert_equal(mod2.memory_gb, 3)
+        mod2.memory_gb = None
+        yield assert_equal(mod2.memory_gb, 2.)
+        mod3 = pe.Node(interface=TestInterface(),name='mod3', memory_gb=1)
+        mod3.inputs.input1 = 1
+        mod3._estimate_memory(history)
+        yield assert_equal(mod3.memory_gb, 1)
+    finally:
+        config.set('execution', 'use_runtime_history', 'false')
+        config.set('execution', 'hash_cache_dir', '~/.nipype')
+    os.chdir(cur_dir)
+    rmtree(temp_dir)
+
+@parametric
+def test_resource_profile():
+    cur_dir = os.getcwd()
+    temp_dir = mkdtemp(prefix='test_engine_')
+    os.chdir(temp_dir)
+    config.set('execution', 'profile_runtime', 'true')
+    config.set('execution', 'profile_interval', '0.05')
+    try:
+        pipe = pe.Workflow(name='pipe')
+        mod1 = pe.Node(interface=nib.CommandLine(command='sleep 0.2'),
+                       name='mod1')
+        mod2 = pe.Node(interface=TestInterface(),name='mod2')
+        mod2.inputs.input1 = 1
+        pipe.add_nodes([mod1, mod2])
+        pipe.base_dir = temp_dir
+        pipe.run(plugin='linear')
+        runtime = pipe.get_exec_node('pipe.mod1').result.runtime
+        yield assert_true(runtime.cpu_user is not None)
+        profile = load_json(os.path.join(temp_dir, 'pipe',
+                                         'resource_profile.json'))
+        yield assert_equal(sorted(profile['nodes']),
+                           ['pipe.mod1', 'pipe.mod2'])
+        yield assert_equal(profile['nodes']['pipe.mod1']['cpu_user'],
+                           runtime.cpu_user)
+        yield assert_equal(profile['nodes']['pipe.mod2']['cpu_user'], None)
+        yield assert_true(profile['total']['duration'] >= 0.2)
+    finally:
+        config.set('execution', 'profile_runtime', 'false')
+        config.set('execution', 'profile_interval', '1')
+    os.chdir(cur_dir)
+    rmtree(temp_dir)
+
+@parametric
+def test_plan():
+    cur_dir = os.getcwd()
+    temp_dir = mkdtemp(prefix='test_engine_')
+    os.chdir(temp_dir)
+
+    pipe = pe.Workflow(name='pipe')
+    mod1 = pe.Node(interface=TestInterface(),name='mod1')
+    mod2 = pe.MapNode(interface=TestInterface(),iterfield=['input1'],
+                      name='mod2')
+    mod3 = pe.Node(interface=TestInterface(),name='mod3')
+    pipe.connect([(mod1,mod2,[('output1','input1')])])
+    pipe.add_nodes([mod3])
+    pipe.base_dir = os.getcwd()
+    mod1.inputs.input1 = 1
+    mod3.inputs.input1 = 3
+    plan = pipe.plan()
+    yield assert_equal([item['status'] for item in plan], ['run'] * 3)
+    # nothing was executed
+    yield assert_equal(os.listdir(temp_dir), [])
+    pipe.run(plugin='linear')
+    execgraph = pipe._execgraph
+    results = [node.result for node in execgraph.nodes()]
+    plan = dict([(item['node'], item) for item in pipe.plan()])
+    # the graph and results of the run are kept
+    yield assert_true(pipe._execgraph is execgraph)
+    yield assert_equal([node.result for node in execgraph.nodes()], results)
+    yield assert_equal(plan['pipe.mod1']['status'], 'skip')
+    yield assert_equal(plan['pipe.mod2']['status'], 'skip')
+    yield assert_equal(plan['pipe.mod3']['status'], 'skip')
+    mod1.inputs.input1 = 2
+    plan = dict([(item['node'], item) for item in pipe.plan()])
+    yield assert_equal(plan['pipe.mod1']['status'], 'run')
+    yield assert_equal(plan['pipe.mod2']['status'], 'run')
+    yield assert_equal(plan['pipe.mod3']['status'], 'skip')
+    # estimated from the previous run
+    yield assert_true(plan['pipe.mod1']['duration'] >= 0)
+    os.chdir(cur_dir)
+    rmtree(temp_dir)
+
+@parametric
+def test_node_resources():
+    mod1 = pe.Node(interface=TestInterface(),name='mod1')
+    yield assert_equal(mod1.n_procs, 1)
+    yield assert_equal(mod1.memory_gb, TestInterface.memory_gb)
+    mod2 = pe.Node(interface=TestInterface(),name='mod2', n_procs=4,
+                   memory_gb=8)
+    yield assert_equal(mod2.n_procs, 4)
+    yield assert_equal(mod2.memory_gb, 8)
+    mod1.memory_gb = 2
+    yield assert_equal(mod1.memory_gb, 2)
 
 @parametric
 def test_run_in_series():
@@ -105,6 +298,237 @@ def test_run_in_series():
     os.chdir(cur_dir)
     rmtree(temp_dir)
 
+class CountingInterface(TestInterface):
+    nlisted = 0
+
+    def _list_outputs(self):
+        CountingInterface.nlisted += 1
+        return super(CountingInterface, self)._list_outputs()
+
+@parametric
+def test_node_loads_results():
+    cur_dir = os.getcwd()
+    temp_dir = mkdtemp(prefix='test_engine_')
+    os.chdir(temp_dir)
+    node = pe.Node(CountingInterface(), name='count')
+    node.base_dir = temp_dir
+    node.inputs.input1 = 2
+    node.run()
+    yield assert_equal(CountingInterface.nlisted, 1)
+    yield assert_true(os.path.exists(os.path.join(temp_dir, 'count',
+                                                  'result_count.pklz')))
+    result = node.run()
+    # outputs are read from the result file instead of being collected
+    yield assert_equal(CountingInterface.nlisted, 1)
+    yield assert_equal(result.outputs.output1, [1, 2])
+    yield assert_equal(result.runtime.returncode, 0)
+    os.unlink(os.path.join(temp_dir, 'count', 'result_count.pklz'))
+    result = node.run()
+    yield assert_equal(CountingInterface.nlisted, 2)
+    yield assert_equal(result.outputs.output1, [1, 2])
+    os.chdir(cur_dir)
+    rmtree(temp_dir)
+
+@parametric
+def test_copy_value():
+    files = ['a.nii', 'b.nii']
+    yield assert_true(pe._copy_value('a.nii') is 'a.nii')
+    yield assert_true(pe._copy_value(tuple(files)) == tuple(files))
+    copied = pe._copy_value(files)
+    yield assert_equal(copied, files)
+    yield assert_false(copied is files)
+    nested = [files, {'a': files}]
+    copied = pe._copy_value(nested)
+    yield assert_equal(copied, nested)
+    yield assert_false(copied[0] is files)
+    yield assert_false(copied[1]['a'] is files)
+    mod1 = pe.Node(interface=TestInterface(),name='mod1')
+    mod1._result = nib.InterfaceResult(interface=None, runtime=None,
+                                       outputs=TestInterface()._outputs())
+    mod1._result.outputs.output1 = [1, 2]
+    mod2 = pe.MapNode(interface=TestInterface(),name='mod2',
+                      iterfield=['input1'])
+    pipe = pe.Workflow(name='pipe')
+    pipe._set_node_input(mod2, 'input1', mod1, 'output1')
+    yield assert_equal(mod2.inputs.input1, [1, 2])
+    # the inputs do not share the outputs of the upstream node
+    mod1._result.outputs.output1.append(3)
+    yield assert_equal(mod2.inputs.input1, [1, 2])
+
+@parametric
+def test_journal_resume():
+    cur_dir = os.getcwd()
+    temp_dir = mkdtemp(prefix='test_engine_')
+    os.chdir(temp_dir)
+    config.set('execution', 'use_journal', 'true')
+    try:
+        pipe = pe.Workflow(name='pipe')
+        mod1 = pe.Node(interface=TestInterface(),name='mod1')
+        mod2 = pe.MapNode(interface=TestInterface(),
+                          iterfield=['input1'],
+                          name='mod2')
+        pipe.connect([(mod1,mod2,[('output1','input1')])])
+        pipe.base_dir = temp_dir
+        mod1.inputs.input1 = 1
+        pipe.run(inseries=True)
+        journal = ExecutionJournal(os.path.join(temp_dir, 'pipe',
+                                                'journal.jsonl'))
+        entries = journal.entries()
+        yield assert_equal([entry['node'] for entry in entries],
+                           ['pipe.mod1', 'pipe.mod2'])
+        yield assert_equal(entries[0]['outputs'], {'output1': [1, 1]})
+        yield assert_equal(entries[0]['hash'], pipe.get_exec_node('pipe.mod1')._hashvalue)
+        # completed nodes are not run again, even without their outputs
+        rmtree(os.path.join(temp_dir, 'pipe', 'mod1'))
+        rmtree(os.path.join(temp_dir, 'pipe', 'mod2'))
+        pipe.run(inseries=True)
+        yield assert_false(os.path.exists(os.path.join(temp_dir, 'pipe',
+                                                       'mod1')))
+        yield assert_equal(pipe.get_exec_node('pipe.mod2').get_output('output1'),
+                           [[1, 1], [1, 1]])
+        # nodes with other inputs run again
+        mod1.inputs.input1 = 2
+        pipe.run(plugin='multiproc', plugin_args={'n_procs': 2})
+        yield assert_true(os.path.exists(os.path.join(temp_dir, 'pipe',
+                                                      'mod1')))
+        yield assert_equal(pipe.get_exec_node('pipe.mod2').get_output('output1'),
+                           [[1, 1], [1, 2]])
+        yield assert_equal(len(journal.entries()), 4)
+        pipe.run(plugin='multiproc', plugin_args={'n_procs': 2})
+        yield assert_equal(len(journal.entries()), 4)
+        yield assert_equal(pipe.get_exec_node('pipe.mod2').get_output('output1'),
+                           [[1, 1], [1, 2]])
+    finally:
+        config.set('execution', 'use_journal', 'false')
+    os.chdir(cur_dir)
+    rmtree(temp_dir)
+
+@parametric
+def test_mapnode_parallel():
+    cur_dir = os.getcwd()
+    temp_dir = mkdtemp(prefix='test_engine_')
+    os.chdir(temp_dir)
+
+    mod1 = pe.MapNode(interface=TestInterface(),
+                      iterfield=['input1'],
+                      name='mod1', max_parallel=3)
+    mod1.base_dir = temp_dir
+    mod1.inputs.input1 = range(5)
+    result = mod1.run()
+    yield assert_equal(result.outputs.output1,
+                       [[1, i] for i in range(5)])
+    yield assert_equal(len(result.runtime), 5)
+    yield assert_true(os.path.isdir(os.path.join(temp_dir, 'mod1', 'mapflow',
+                                                 '_mod14')))
+    yield assert_equal(os.getcwd(), temp_dir)
+    os.chdir(cur_dir)
+    rmtree(temp_dir)
+
+@parametric
+def test_mapnode_item_inputs():
+    cur_dir = os.getcwd()
+    temp_dir = mkdtemp(prefix='test_engine_')
+    os.chdir(temp_dir)
+
+    mod1 = pe.MapNode(interface=TestInterface(),
+                      iterfield=['input1'],
+                      name='mod1')
+    mod1.inputs.input1 = [1, 2]
+    mod1.inputs.input2 = 3
+    nodes = mod1._make_nodes(temp_dir)
+    yield assert_equal([node.inputs.input1 for node in nodes], [1, 2])
+    yield assert_equal([node.inputs.input2 for node in nodes], [3, 3])
+    nodes[0].inputs.input2 = 4
+    yield assert_equal(mod1.inputs.input2, 3)
+    yield assert_equal(nodes[1].inputs.input2, 3)
+    # traits added to the input spec of an instance are carried over
+    from nipype.interfaces.utility import IdentityInterface
+    ident = pe.MapNode(interface=IdentityInterface(fields=['a', 'b']),
+                       iterfield=['a'], name='ident')
+    ident.base_dir = temp_dir
+    ident.inputs.a = ['x', 'y']
+    ident.inputs.b = 'z'
+    result = ident.run()
+    yield assert_equal(result.outputs.a, ['x', 'y'])
+    yield assert_equal(result.outputs.b, ['z', 'z'])
+    os.chdir(cur_dir)
+    rmtree(temp_dir)
+
+class ListenerInterface(TestInterface):
+    """Keeps an attribute in sync with an input, like the output type
+    of FSL interfaces"""
+    def __init__(self, **inputs):
+        super(ListenerInterface, self).__init__(**inputs)
+        self.inputs.on_trait_change(self._input2_update, 'input2')
+        self.state = dict(input2=None)
+
+    def _input2_update(self):
+        self.state['input2'] = self.inputs.input2
+
+@parametric
+def test_mapnode_item_listeners():
+    mod1 = pe.MapNode(interface=ListenerInterface(),
+                      iterfield=['input1'],
+                      name='mod1')
+    mod1.inputs.input1 = [1, 2]
+    mod1.inputs.input2 = 3
+    temp_dir = mkdtemp(prefix='test_engine_')
+    nodes = mod1._make_nodes(temp_dir)
+    interfaces = [node._interface for node in nodes]
+    yield assert_equal([iface.state['input2'] for iface in interfaces],
+                       [3, 3])
+    # each item has its own listener and state
+    nodes[0].inputs.input2 = 4
+    yield assert_equal([iface.state['input2'] for iface in interfaces],
+                       [4, 3])
+    yield assert_equal(mod1._interface.state['input2'], 3)
+    rmtree(temp_dir)
+
+class FailingInterface(TestInterface):
+    def _run_interface(self, runtime):
+        if self.inputs.input1 == 2:
+            raise RuntimeError('item failed')
+        return super(FailingInterface, self)._run_interface(runtime)
+
+@parametric
+def test_mapnode_crash():
+    cur_dir = os.getcwd()
+    temp_dir = mkdtemp(prefix='test_engine_')
+    os.chdir(temp_dir)
+
+    for max_parallel in [1, 2]:
+        mod1 = pe.MapNode(interface=FailingInterface(),
+                          iterfield=['input1'],
+                          name='mod%d' % max_parallel,
+                          max_parallel=max_parallel)
+        mod1.base_dir = temp_dir
+        mod1.inputs.input1 = range(4)
+        yield assert_raises(Exception, mod1.run)
+        # all other items were run
+        yield assert_equal(len(mod1.result.runtime), 4)
+        yield assert_equal(mod1.result.runtime[2].returncode, 1)
+        yield assert_equal(mod1.result.runtime[3].returncode, 0)
+        yield assert_equal(os.getcwd(), temp_dir)
+    config.set('execution', 'stop_on_first_crash', 'true')
+    try:
+        for max_parallel in [1, 2]:
+            mod1 = pe.MapNode(interface=FailingInterface(),
+                              iterfield=['input1'],
+                              name='stop%d' % max_parallel,
+                              max_parallel=max_parallel)
+            mod1.base_dir = temp_dir
+            mod1.inputs.input1 = range(4)
+            yield assert_raises(Exception, mod1.run)
+            # the working directory is restored
+            yield assert_equal(os.getcwd(), temp_dir)
+        # the items after the failed one are not run
+        yield assert_false(os.path.exists(os.path.join(temp_dir, 'stop1',
+                                                       'mapflow', '_stop13')))
+    finally:
+        config.set('execution', 'stop_on_first_crash', 'false')
+    os.chdir(cur_dir)
+    rmtree(temp_dir)
+
 # Test graph expansion.  The following set tests the building blocks
 # of the graph expansion routine.
 # XXX - SG I'll create a graphical version of these tests and actually
@@ -222,3 +646,159 @@ def test8():
                            len(pipe._execgraph.out_edges(node))) \
                           for node in pipe._execgraph.nodes()])
     yield assert_true(edgenum[0]>0)
+
+@parametric
+def test_expansion_copy_on_write():
+    pipe = pe.Workflow(name='pipe')
+    mod1 = pe.Node(interface=TestInterface(),name='mod1')
+    mod2 = pe.Node(interface=TestInterface(),name='mod2')
+    mod1.iterables = dict(input1=lambda:[1,2])
+    pipe.connect([(mod1,mod2,[('output1','input2')])])
+    pipe._create_flat_graph()
+    pipe._execgraph = pe._generate_expanded_graph(deepcopy(pipe._flatgraph))
+    mod1copies = [node for node in pipe._execgraph.nodes() \
+                      if node.name == 'mod1']
+    mod2copies = [node for node in pipe._execgraph.nodes() \
+                      if node.name == 'mod2']
+    yield assert_equal(sorted([node.inputs.input1 for node in mod1copies]),
+                       [1, 2])
+    # untouched copies share their interface
+    yield assert_true(mod2copies[0]._interface is mod2copies[1]._interface)
+    mod2copies[0].set_input('input1', 3)
+    yield assert_false(mod2copies[0]._interface is mod2copies[1]._interface)
+    yield assert_equal(mod2copies[0].inputs.input1, 3)
+    yield assert_false(nib.isdefined(mod2copies[1].inputs.input1))
+
+@parametric
+def test_flat_graph_cache():
+    sub = pe.Workflow(name='sub')
+    mod1 = pe.Node(interface=TestInterface(),name='mod1')
+    mod2 = pe.Node(interface=TestInterface(),name='mod2')
+    sub.connect([(mod1,mod2,[('output1','input2')])])
+    pipe = pe.Workflow(name='pipe')
+    mod3 = pe.Node(interface=TestInterface(),name='mod3')
+    pipe.connect([(sub,mod3,[('mod2.output1','input2')])])
+    pipe._create_flat_graph()
+    flatgraph = pipe._flatgraph
+    yield assert_equal(sorted([str(node) for node in flatgraph.nodes()]),
+                       ['pipe.mod3', 'pipe.sub.mod1', 'pipe.sub.mod2'])
+    # the flat graph refers to the interfaces of the workflow nodes
+    flatmod1 = [node for node in flatgraph.nodes() if node.name == 'mod1'][0]
+    yield assert_true(flatmod1._interface is mod1._interface)
+    yield assert_equal(str(mod1), 'sub.mod1')
+    pipe._create_flat_graph()
+    yield assert_true(pipe._flatgraph is flatgraph)
+    # changes of the nodes are seen without flattening again
+    mod1.iterables = ('input1', [1, 2])
+    execgraph = pe._generate_expanded_graph(pipe._copy_flat_graph())
+    yield assert_equal(len(execgraph.nodes()), 6)
+    yield assert_equal(len(flatgraph.nodes()), 3)
+    # changes of a subworkflow invalidate the flat graph
+    mod4 = pe.Node(interface=TestInterface(),name='mod4')
+    sub.add_nodes([mod4])
+    pipe._create_flat_graph()
+    yield assert_false(pipe._flatgraph is flatgraph)
+    yield assert_equal(len(pipe._flatgraph.nodes()), 4)
+
+@parametric
+def test_node_lookup():
+    sub = pe.Workflow(name='sub')
+    mod1 = pe.Node(interface=TestInterface(),name='mod1')
+    mod2 = pe.Node(interface=TestInterface(),name='mod2')
+    sub.connect([(mod1,mod2,[('output1','input2')])])
+    pipe = pe.Workflow(name='pipe')
+    mod3 = pe.Node(interface=TestInterface(),name='mod3')
+    pipe.connect([(sub,mod3,[('mod2.output1','input2')])])
+    yield assert_true(pipe.get_node('sub') is sub)
+    yield assert_true(pipe.get_node('sub.mod1') is mod1)
+    yield assert_true(pipe.get_node('mod3') is mod3)
+    yield assert_equal(pipe.get_node('od3'), None)
+    yield assert_equal(pipe.get_node('sub.mod3'), None)
+    dup = pe.Node(interface=TestInterface(),name='mod1')
+    yield assert_raises(Exception, sub.add_nodes, [dup])
+    yield assert_true(pipe._check_inputs('sub.mod1.input1'))
+    yield assert_false(pipe._check_inputs('sub.mod2.input2'))
+    yield assert_false(pipe._check_outputs('sub.mod4.output1'))
+    pipe._create_flat_graph()
+    pipe._execgraph = pe._generate_expanded_graph(pipe._copy_flat_graph())
+    node = pipe.get_exec_node('pipe.sub.mod2')
+    yield assert_true(node in pipe._execgraph)
+    yield assert_equal(node.name, 'mod2')
+    # the index follows a regenerated execution graph
+    mod1.iterables = ('input1', [1, 2])
+    pipe._execgraph = pe._generate_expanded_graph(pipe._copy_flat_graph())
+    node = pipe.get_exec_node('pipe.mod30')
+    yield assert_true(node in pipe._execgraph)
+
+# optional backends that must not be imported until they are used
+lazy_modules = ['IPython', 'scipy', 'nipype.externals.pynifti', 'pygraphviz',
+                'matplotlib']
+
+def _import_in_subprocess(modules):
+    """Import modules in a new interpreter
+
+    Returns the time the imports took and the names of all loaded modules.
+    """
+    script = 'import sys, time\n' \
+        't0 = time.time()\n' \
+        '%s\n' \
+        'print time.time() - t0\n' \
+        'print " ".join(sys.modules.keys())\n' % \
+        '\n'.join(['import %s' % module for module in modules])
+    proc = subprocess.Popen([sys.executable, '-c', script],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = proc.communicate()
+    if proc.returncode:
+        raise RuntimeError(stderr)
+    lines = stdout.splitlines()
+    return float(lines[-2]), lines[-1].split()
+
+@parametric
+def test_startup_imports():
+    _, loaded = _import_in_subprocess(['nipype.pipeline.engine',
+                                       'nipype.interfaces.fsl',
+                                       'nipype.interfaces.spm',
+                                       'nipype.interfaces.freesurfer',
+                                       'nipype.algorithms.modelgen',
+                                       'nipype.algorithms.rapidart'])
+    for module in lazy_modules:
+        yield assert_false(module in loaded)
+
+class FakeClientModule(object):
+    """An IPython client whose controller is started after the first
+    connection attempt"""
+    attempts = 0
+
+    def TaskClient(self):
+        self.attempts += 1
+        if self.attempts == 1:
+            raise Exception('connection refused')
+        return 'taskclient'
+
+@parametric
+def test_ipython_probe():
+    saved = ipython._ipyclient, ipython._taskclient
+    ipython._ipyclient = ipython._taskclient = None
+    ipymodule = sys.modules.get('IPython')
+    # an entry of None makes importing IPython fail
+    sys.modules['IPython'] = None
+    try:
+        yield assert_raises(ImportError, ipython.get_client)
+        error = ipython._ipyclient
+        # a missing IPython is not searched for again
+        sys.modules['IPython'] = ipymodule
+        yield assert_raises(ImportError, pe.get_plugin, 'ipython')
+        yield assert_true(ipython._ipyclient is error)
+        # failed connections are retried
+        module = FakeClientModule()
+        ipython._ipyclient = module
+        yield assert_raises(RuntimeError, ipython.get_client)
+        yield assert_equal(ipython.get_client(), (module, 'taskclient'))
+        yield assert_equal(ipython.get_client(), (module, 'taskclient'))
+        yield assert_equal(module.attempts, 2)
+    finally:
+        if ipymodule is None:
+            del sys.modules['IPython']
+        else:
+            sys.modules['IPython'] = ipymodule
+        ipython._ipyclient, ipython._taskclient = saved
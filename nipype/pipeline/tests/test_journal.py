@@ -0,0 +1,68 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+import os
+import subprocess
+import sys
+from tempfile import mkdtemp
+from shutil import rmtree
+
+from nipype.testing import assert_equal, parametric
+from nipype.pipeline.journal import ExecutionJournal
+
+# appends 100 entries to a journal
+script = """
+import sys
+from nipype.pipeline.journal import ExecutionJournal
+journal = ExecutionJournal(sys.argv[1])
+for i in range(100):
+    journal.record('pipe.mod%s_%d' % (sys.argv[2], i), 'done', 'f',
+                   outputs={'out_file': 'x' * 1000})
+"""
+
+@parametric
+def test_completed():
+    tmpdir = mkdtemp()
+    journal = ExecutionJournal(os.path.join(tmpdir, 'pipe', 'journal.jsonl'))
+    yield assert_equal(journal.completed(), {})
+    journal.record('pipe.mod1', 'done', 'f1', outputs={'out': 1},
+                   start=1., end=2.)
+    journal.record('pipe.mod2', 'done', 'f2', outputs={'out': 2})
+    journal.record('pipe.mod2', 'crashed', 'f2', crashfile='crash.npz')
+    journal.record('pipe.mod3', 'done', 'f3', outputs={'out': object()})
+    # an entry cut short by a killed process
+    fp = open(journal.filename, 'a')
+    fp.write('{"node": "pipe.mod4", "status": "do')
+    fp.close()
+    completed = journal.completed()
+    yield assert_equal(sorted(completed.keys()), ['pipe.mod1', 'pipe.mod3'])
+    yield assert_equal(completed['pipe.mod1']['outputs'], {'out': 1})
+    yield assert_equal(type(completed['pipe.mod1']['node']), str)
+    yield assert_equal(completed['pipe.mod3']['outputs'], None)
+    rmtree(tmpdir)
+
+@parametric
+def test_append_after_truncated_line():
+    tmpdir = mkdtemp()
+    journal = ExecutionJournal(os.path.join(tmpdir, 'journal.jsonl'))
+    journal.record('a', 'done', 'fa')
+    fp = open(journal.filename, 'a')
+    fp.write('{"node": "b", "status": "do')
+    fp.close()
+    journal.record('c', 'done', 'fc')
+    yield assert_equal([entry['node'] for entry in journal.entries()],
+                       ['a', 'c'])
+    rmtree(tmpdir)
+
+@parametric
+def test_concurrent_append():
+    tmpdir = mkdtemp()
+    filename = os.path.join(tmpdir, 'journal.jsonl')
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(sys.path)
+    procs = [subprocess.Popen([sys.executable, '-c', script, filename,
+                               str(i)], env=env) for i in range(4)]
+    yield assert_equal([proc.wait() for proc in procs], [0] * 4)
+    journal = ExecutionJournal(filename)
+    yield assert_equal(len(journal.entries()), 400)
+    yield assert_equal(len(journal.completed()), 400)
+    rmtree(tmpdir)
@@ -0,0 +1,57 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Tests for the pipeline utils module
+"""
+import os
+from tempfile import mkdtemp
+from shutil import rmtree
+
+from nipype.testing import assert_equal, assert_true, parametric
+import nipype.interfaces.base as nib
+from nipype.interfaces.base import Bunch, InterfaceResult, Undefined
+from nipype.utils.misc import isdefined
+import networkx as nx
+from nipype.pipeline.utils import (save_resultfile, load_resultfile,
+                                   critical_path_lengths)
+
+class OutputSpec(nib.TraitedSpec):
+    out_file = nib.File(desc='a file')
+    out_list = nib.traits.List(nib.traits.Int, desc='a list')
+    out_unset = nib.traits.Int(desc='not set')
+
+@parametric
+def test_resultfile():
+    tmpdir = mkdtemp()
+    out_file = os.path.join(tmpdir, 'out.txt')
+    open(out_file, 'wt').close()
+    outputs = OutputSpec()
+    outputs.out_file = out_file
+    outputs.out_list = [1, 2]
+    runtime = Bunch(returncode=0, duration=1.5, hostname='foo',
+                    environ={'PATH': '/bin'})
+    result = InterfaceResult(interface=None, runtime=runtime,
+                             outputs=outputs)
+    resultfile = os.path.join(tmpdir, 'result_foo.pklz')
+    save_resultfile(resultfile, result, 'abc')
+    yield assert_equal(sorted(os.listdir(tmpdir)),
+                       ['out.txt', 'result_foo.pklz'])
+    data = load_resultfile(resultfile, 'abc')
+    yield assert_equal(data['outputs']['out_file'], out_file)
+    yield assert_equal(data['outputs']['out_list'], [1, 2])
+    yield assert_true(not isdefined(data['outputs']['out_unset']))
+    yield assert_equal(data['runtime'],
+                       dict(returncode=0, duration=1.5, hostname='foo'))
+    yield assert_equal(load_resultfile(resultfile), data)
+    yield assert_equal(load_resultfile(resultfile, 'def'), None)
+    yield assert_equal(load_resultfile(resultfile + 'x'), None)
+    os.unlink(out_file)
+    yield assert_equal(load_resultfile(resultfile), None)
+    rmtree(tmpdir)
+
+@parametric
+def test_critical_path_lengths():
+    graph = nx.DiGraph()
+    graph.add_edges_from([('a', 'b'), ('b', 'c'), ('a', 'd'), ('e', 'd')])
+    weights = dict(a=1, b=2, c=3, d=10, e=1)
+    lengths = critical_path_lengths(graph, weights)
+    yield assert_equal(lengths, dict(a=11, b=5, c=3, d=10, e=11))
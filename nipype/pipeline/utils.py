@@ -5,7 +5,8 @@
 The `Pipeline` class provides core functionality for batch processing. 
 """
 
-from copy import deepcopy
+import cPickle
+import gzip
 import logging
 import os
 
@@ -14,6 +15,7 @@ package_check('networkx', '1.0')
 import networkx as nx
 
 from nipype.interfaces.base import CommandLine
+from nipype.utils.environ import save_environ
 from nipype.utils.filemanip import fname_presuffix
 
 logger = logging.getLogger('workflow')
@@ -47,16 +49,38 @@ def _create_pickleable_graph(graph, show_connectinfo=False):
     Ensures that edge info is pickleable.
     """
     logger.debug('creating pickleable graph')
-    pklgraph = deepcopy(graph)
-    for edge in pklgraph.edges():
-        data = pklgraph.get_edge_data(*edge)
-        pklgraph.remove_edge(*edge)
+    pklgraph = nx.DiGraph()
+    pklgraph.add_nodes_from(graph.nodes())
+    for u, v, data in graph.edges_iter(data=True):
         if show_connectinfo:
-            pklgraph.add_edge(edge[0], edge[1], l=str(data['connect']))
+            pklgraph.add_edge(u, v, l=str(data['connect']))
         else:
-            pklgraph.add_edge(edge[0], edge[1])
+            pklgraph.add_edge(u, v)
     return pklgraph
 
+def _copy_graph(graph, copies=None):
+    """Return a copy of a workflow graph
+
+    Parameters
+    ----------
+    graph : networkx DiGraph
+    copies : dict
+        node -> the node replacing it in the copy. Defaults to lazy
+        (copy-on-write) copies of all nodes.
+
+    The edge data (connection lists) are copied, so that the copy can be
+    expanded (see `_generate_expanded_graph`) without modifying `graph`.
+    """
+    if copies is None:
+        copies = dict([(node, node._lazy_copy()) for node in graph.nodes()])
+    graphcopy = nx.DiGraph()
+    graphcopy.add_nodes_from(copies.values())
+    for u, v, data in graph.edges_iter(data=True):
+        data = dict(data)
+        data['connect'] = list(data['connect'])
+        graphcopy.add_edge(copies[u], copies[v], data)
+    return graphcopy
+
 def _create_dot_graph(graph, show_connectinfo=False):
     """Create a graph that can be pickled.
 
@@ -192,30 +216,28 @@ def _merge_graphs(supergraph, nodes, subgraph, nodeid, iterables):
     """
     # Retrieve edge information connecting nodes of the subgraph to other
     # nodes of the supergraph.
-    supernodes = supergraph.nodes()
-    ids = [n._id for n in supernodes]
+    subnodes = subgraph.nodes()
+    subnodeset = set(subnodes)
+    subedges = subgraph.edges(data=True)
     edgeinfo = {}
-    for n in subgraph.nodes():
-        nidx = ids.index(n._id)
-        for edge in supergraph.in_edges_iter(supernodes[nidx]):
-                #make sure edge is not part of subgraph
-            if edge[0] not in subgraph.nodes():
-                if n._id not in edgeinfo.keys():
-                    edgeinfo[n._id] = []
-                edgeinfo[n._id].append((edge[0],
-                                       supergraph.get_edge_data(*edge)))
+    for n in subnodes:
+        for u, _, data in supergraph.in_edges_iter(n, data=True):
+            #make sure edge is not part of subgraph
+            if u not in subnodeset:
+                edgeinfo.setdefault(n, []).append((u, data))
+    iternode = [n for n in subnodes if n._id == nodeid][0]
     supergraph.remove_nodes_from(nodes)
-    # Add copies of the subgraph depending on the number of iterables
+    # Add copies of the subgraph depending on the number of iterables.
+    # The copies share their interfaces with the original nodes until
+    # they are modified.
     for i, params in enumerate(walk(iterables.items())):
-        Gc = deepcopy(subgraph)
-        ids = [n._id for n in Gc.nodes()]
-        nodeidx = ids.index(nodeid)
+        copies = dict([(n, n._lazy_copy()) for n in subnodes])
         paramstr = ''
         for key, val in sorted(params.items()):
             paramstr = '_'.join((paramstr, key,
                                  _get_valid_pathstr(str(val)))) #.replace(os.sep, '_')))
-            Gc.nodes()[nodeidx].set_input(key, val)
-        for n in Gc.nodes():
+            copies[iternode].set_input(key, val)
+        for n in copies.values():
             """
             update parameterization of the node to reflect the location of
             the output directory.  For example, if the iterables along a
@@ -229,13 +251,14 @@ def _merge_graphs(supergraph, nodes, subgraph, nodeid, iterables):
                 n.parameterization = paramlist + n.parameterization
             else:
                 n.parameterization = paramlist
-        supergraph.add_nodes_from(Gc.nodes())
-        supergraph.add_edges_from(Gc.edges(data=True))
-        for node in Gc.nodes():
-            if node._id in edgeinfo.keys():
-                for info in edgeinfo[node._id]:
-                    supergraph.add_edges_from([(info[0], node, info[1])])
-            node._id += str(i)
+        supergraph.add_nodes_from(copies.values())
+        supergraph.add_edges_from([(copies[u], copies[v], data) \
+                                       for u, v, data in subedges])
+        for n, info in edgeinfo.items():
+            supergraph.add_edges_from([(u, copies[n], data) \
+                                           for u, data in info])
+        for n in copies.values():
+            n._id += str(i)
     return supergraph
 
 def _generate_expanded_graph(graph_in):
@@ -247,7 +270,6 @@ def _generate_expanded_graph(graph_in):
     parameterized as (a=1,b=3), (a=1,b=4), (a=2,b=3) and (a=2,b=4). 
     """
     logger.debug("PE: expanding iterables")
-    moreiterables = True
     # convert list of tuples to dict fields
     for node in graph_in.nodes():
         if isinstance(node.iterables, tuple):
@@ -256,25 +278,47 @@ def _generate_expanded_graph(graph_in):
         if isinstance(node.iterables, list):
             node.iterables = dict(map(lambda(x):(x[0], lambda:x[1]),
                                       node.iterables))
-    while moreiterables:
-        nodes = nx.topological_sort(graph_in)
-        nodes.reverse()
-        inodes = [node for node in nodes if len(node.iterables.keys())>0]
-        if inodes:
-            node = inodes[0]
-            iterables = node.iterables.copy()
-            node.iterables = {}
-            node._id += 'I'
-            subnodes = nx.dfs_preorder(graph_in, node)
-            subgraph = graph_in.subgraph(subnodes)
-            graph_in = _merge_graphs(graph_in, subnodes,
-                                     subgraph, node._id,
-                                     iterables)
-        else:
-            moreiterables = False
+    # Expand the last node with iterables in topological order first. Its
+    # descendants have no iterables left, so the copies never contain
+    # iterables and the order of expansion can be determined once.
+    inodes = [node for node in nx.topological_sort(graph_in) \
+                  if len(node.iterables.keys())>0]
+    inodes.reverse()
+    for node in inodes:
+        iterables = node.iterables.copy()
+        node.iterables = {}
+        node._id += 'I'
+        subnodes = nx.dfs_preorder(graph_in, node)
+        subgraph = graph_in.subgraph(subnodes)
+        graph_in = _merge_graphs(graph_in, subnodes,
+                                 subgraph, node._id,
+                                 iterables)
     logger.debug("PE: expanding iterables ... done")
     return graph_in
 
+def critical_path_lengths(graph, weights):
+    """Return the length of the longest path from each node to the end of
+    a directed acyclic graph
+
+    Parameters
+    ----------
+    graph : networkx DiGraph
+    weights : dict
+        node -> weight (e.g., expected duration) of the node. The length
+        of a path is the sum of the weights of its nodes.
+
+    Returns
+    -------
+    lengths : dict
+        node -> length of the longest path starting at the node
+    """
+    lengths = {}
+    for node in reversed(nx.topological_sort(graph)):
+        lengths[node] = weights[node] + \
+            max([lengths[child] for child in graph.successors_iter(node)] + \
+                    [0])
+    return lengths
+
 def export_graph(graph_in, base_dir=None, show = False, use_execgraph=False,
                  show_connectinfo=False, dotfilename='graph.dot'):
     """ Displays the graph layout of the pipeline
@@ -297,9 +341,9 @@ def export_graph(graph_in, base_dir=None, show = False, use_execgraph=False,
     Indicates whether to show the edge data on the graph. This
     makes the graph rather cluttered. default [False]
     """
-    graph = deepcopy(graph_in)
+    graph = graph_in
     if use_execgraph:
-        graph = _generate_expanded_graph(graph)
+        graph = _generate_expanded_graph(_copy_graph(graph_in))
         logger.debug('using execgraph')
     else:
         logger.debug('using input graph')
@@ -311,7 +355,7 @@ def export_graph(graph_in, base_dir=None, show = False, use_execgraph=False,
                                suffix='_detailed.dot',
                                use_ext=False,
                                newpath=base_dir)
-    logger.info('Creating detailed dot file: %s'%outfname)
+    logger.info('Creating detailed dot file: %s', outfname)
     _write_detailed_dot(graph, outfname)
     cmd = 'dot -Tpng -O %s' % outfname
     res = CommandLine(cmd).run()
@@ -323,7 +367,7 @@ def export_graph(graph_in, base_dir=None, show = False, use_execgraph=False,
                                use_ext=False,
                                newpath=base_dir)
     nx.write_dot(pklgraph, outfname)
-    logger.info('Creating dot file: %s' % outfname)
+    logger.info('Creating dot file: %s', outfname)
     cmd = 'dot -Tpng -O %s' % outfname
     res = CommandLine(cmd).run()
     if res.runtime.returncode:
@@ -338,8 +382,8 @@ def _report_nodes_not_run(notrun):
     if notrun:
         logger.info("***********************************")
         for info in notrun:
-            logger.error("could not run node: %s" % info['node']._id)
-            logger.info("crashfile: %s" % info['crashfile'])
+            logger.error("could not run node: %s", info['node']._id)
+            logger.info("crashfile: %s", info['crashfile'])
             logger.debug("The following dependent nodes were not run")
             for subnode in info['dependents']:
                 logger.debug(subnode._id)
@@ -360,7 +404,108 @@ def make_output_dir(outdir):
         # case where mkdir failed because a missing parent
         # directory, something went wrong up-stream that caused an
         # invalid path to be passed in for `outdir`.
-        logger.debug("Creating %s" % outdir)
+        logger.debug("Creating %s", outdir)
         os.mkdir(outdir)
     return outdir
 
+
+
+# runtime fields describing the resource use of a run
+PROFILE_FIELDS = ['peak_rss', 'cpu_user', 'cpu_sys', 'read_bytes',
+                  'write_bytes', 'num_threads']
+
+# version of the format written by `save_resultfile`. Result files with a
+# different version are ignored.
+RESULTFILE_VERSION = 1
+
+def _existing_files(value, files=None):
+    """Return the paths of all existing files in a (nested) output value
+    """
+    if files is None:
+        files = []
+    if isinstance(value, dict):
+        for val in value.values():
+            _existing_files(val, files)
+    elif isinstance(value, (list, tuple)):
+        for val in value:
+            _existing_files(val, files)
+    elif isinstance(value, str) and os.path.isfile(value):
+        files.append(value)
+    return files
+
+def save_resultfile(filename, result, hashvalue=None):
+    """Store the outcome of running an interface
+
+    Only the plain values of the outputs and a few runtime fields
+    (returncode, duration, hostname, cmdline, the digest of the environment
+    and the resource use) are kept, together with the hash of the node
+    inputs.
+    The file is written to a temporary name first and moved into place,
+    so readers never see partial results.
+
+    Parameters
+    ----------
+    filename : str
+        path of the result file
+    result : InterfaceResult
+        the result returned by the interface
+    hashvalue : str
+        hash of the inputs the result was computed from
+    """
+    outputs = {}
+    if result.outputs is not None:
+        outputs = result.outputs.get()
+    runtime = {}
+    for key in ['returncode', 'duration', 'hostname', 'cmdline',
+                'environ_digest'] + PROFILE_FIELDS:
+        if hasattr(result.runtime, key):
+            runtime[key] = getattr(result.runtime, key)
+    if 'environ_digest' in runtime:
+        # the environment itself is stored once per distinct snapshot
+        save_environ(runtime['environ_digest'], result.runtime.environ)
+    data = dict(version=RESULTFILE_VERSION,
+                hashvalue=hashvalue,
+                outputs=outputs,
+                files=_existing_files(outputs),
+                runtime=runtime)
+    tmpfile = '%s.%d.tmp' % (filename, os.getpid())
+    fp = gzip.open(tmpfile, 'wb')
+    try:
+        cPickle.dump(data, fp, cPickle.HIGHEST_PROTOCOL)
+    finally:
+        fp.close()
+    os.rename(tmpfile, filename)
+
+def load_resultfile(filename, hashvalue=None, check_files=True):
+    """Load a result file written by `save_resultfile`
+
+    Returns a dict with the fields `outputs` and `runtime` or None if the
+    file does not exist or cannot be read, if it has a different version
+    or was computed from inputs with a different `hashvalue`, or if any of
+    the output files it refers to no longer exists (unless `check_files`
+    is False).
+    """
+    if not os.path.exists(filename):
+        return None
+    try:
+        fp = gzip.open(filename, 'rb')
+        try:
+            data = cPickle.load(fp)
+        finally:
+            fp.close()
+    except Exception, e:
+        logger.debug('Could not load result file %s: %s', filename, e)
+        return None
+    if not isinstance(data, dict) or \
+            data.get('version') != RESULTFILE_VERSION:
+        return None
+    if hashvalue is not None and data['hashvalue'] != hashvalue:
+        return None
+    if not check_files:
+        return data
+    for afile in data['files']:
+        if not os.path.exists(afile):
+            logger.debug('Output %s of result file %s is missing', afile,
+                         filename)
+            return None
+    return data
@@ -4,7 +4,8 @@
 Created on 20 Apr 2010
 
 logging options : INFO, DEBUG
-hash_method : content, timestamp
+hash_method : content, sampled, timestamp
+plugin : ipython, multiproc, batch, linear
 
 @author: Chris Filo Gorgolewski
 '''
@@ -16,12 +17,29 @@ default_cfg = StringIO("""
 workflow_level = INFO
 filemanip_level = INFO
 interface_level = INFO
+log_to_file = true
+log_directory =
+use_event_log = false
 
 [execution]
 stop_on_first_crash = false
 hash_method = content
+hash_digest = md5
+hash_threads = 4
 single_thread_matlab = true
 run_in_series = false
+plugin = ipython
+mapnode_max_parallel = 1
+use_hash_cache = false
+hash_cache_dir = ~/.nipype
+hash_cache_size = 100000
+use_runtime_history = false
+profile_runtime = false
+profile_interval = 1
+stream_output = false
+output_tail_lines = 100
+use_journal = false
+environ_whitelist =
 """)
 
 config = ConfigParser.ConfigParser()
@@ -0,0 +1,133 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Interned snapshots of the process environment
+
+The runtime of every interface records the environment it was run in.
+Copying os.environ for every run (and pickling the copy into every
+result) is expensive on machines with large environments, although the
+environment hardly ever changes during a workflow. Snapshots are
+therefore interned: identical environments share a single read-only
+dict (a `FrozenEnviron`), identified by its digest. Results store only
+the digest. If the `use_hash_cache` option is set, each distinct
+snapshot is also written once to the `environ` subdirectory of the
+`hash_cache_dir` (see :func:`save_environ`).
+
+If the `environ_whitelist` option of the `execution` section of the
+config file is set (e.g., ``FSLDIR, SUBJECTS_DIR, PATH``), only these
+variables are recorded.
+"""
+
+import logging
+import os
+
+from nipype.utils.config import config
+from nipype.utils.filemanip import md5, save_json, load_json
+
+logger = logging.getLogger('interface')
+
+# snapshot key -> (digest, environ)
+_snapshots = {}
+# maximum number of distinct snapshots kept in memory
+_max_snapshots = 100
+# digests of snapshots written to the store by this process
+_saved = set()
+
+
+class FrozenEnviron(dict):
+    """A dict that cannot be modified
+
+    Snapshots are shared between all runtimes, so changing one would
+    change the environment recorded for every other run. Copy it with
+    ``dict(environ)`` to get a modifiable dict.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('environment snapshots cannot be modified')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = \
+        update = _readonly
+
+    def __reduce__(self):
+        return (FrozenEnviron, (dict(self),))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def _get_whitelist():
+    whitelist = config.get('execution', 'environ_whitelist')
+    return [name.strip() for name in whitelist.split(',') if name.strip()]
+
+def environ_snapshot(update=None):
+    """Return the digest and an interned copy of the current environment
+
+    Parameters
+    ----------
+    update : dict
+        variables added to (or overriding) the environment, e.g., the
+        `environ` input of a command line interface. These are recorded
+        even if they are not in the whitelist.
+
+    Returns
+    -------
+    digest : str
+        md5 of the recorded variables
+    environ : FrozenEnviron
+        the recorded variables, shared between all callers
+    """
+    whitelist = _get_whitelist()
+    if whitelist:
+        items = [(name, os.environ[name]) for name in whitelist
+                 if name in os.environ]
+    else:
+        items = os.environ.items()
+    if update:
+        items = dict(items)
+        items.update(update)
+        items = items.items()
+    key = tuple(sorted(items))
+    snapshot = _snapshots.get(key)
+    if snapshot is None:
+        if len(_snapshots) >= _max_snapshots:
+            _snapshots.clear()
+        snapshot = (md5(repr(key)).hexdigest(), FrozenEnviron(key))
+        _snapshots[key] = snapshot
+    return snapshot
+
+def _get_store():
+    return os.path.join(os.path.expanduser(config.get('execution',
+                                                      'hash_cache_dir')),
+                        'environ')
+
+def save_environ(digest, environ):
+    """Write a snapshot to the environment store unless it is there already
+
+    Nothing is written unless the `use_hash_cache` option is set.
+    """
+    if digest in _saved or \
+            not config.getboolean('execution', 'use_hash_cache'):
+        return
+    store = _get_store()
+    filename = os.path.join(store, '%s.json' % digest)
+    try:
+        if not os.path.exists(filename):
+            if not os.path.exists(store):
+                os.makedirs(store)
+            tmpfile = '%s.%d.tmp' % (filename, os.getpid())
+            save_json(tmpfile, dict(environ))
+            os.rename(tmpfile, filename)
+        _saved.add(digest)
+    except (IOError, OSError), e:
+        logger.debug('Could not save environment %s: %s', digest, e)
+
+def load_environ(digest):
+    """Return the snapshot with the given digest from the environment store
+    or None if it is not available
+    """
+    filename = os.path.join(_get_store(), '%s.json' % digest)
+    if not os.path.exists(filename):
+        return None
+    return load_json(filename)
@@ -8,13 +8,16 @@ import re
 import shutil
 from glob import glob
 import logging
+import zlib
 from nipype.utils.misc import isdefined
 # The md5 module is deprecated in Python 2.6, but hashlib is only
 # available as an external package for versions of python before 2.6.
 # Both md5 algorithms appear to return the same result.
 try:
+    import hashlib
     from hashlib import md5
 except ImportError:
+    hashlib = None
     from md5 import md5
 
 try:
@@ -28,6 +31,8 @@ except ImportError:
 import numpy as np
 
 from nipype.utils.misc import is_container
+from nipype.utils.config import config
+from nipype.utils.hashcache import get_hash_cache
 
 fmlogger = logging.getLogger("filemanip")
 
@@ -140,20 +145,90 @@ def check_forhash(filename):
         return False, None
 
 
-def hash_infile(afile, chunk_len=8192):
-    """ Computes md5 hash of a file"""
-    md5hex = None
+# number of bytes read at a time when hashing the content of a file
+HASH_CHUNK_LEN = 1 << 20
+# size of each of the blocks hashed by the `sampled` hash method
+HASH_SAMPLE_LEN = 1 << 16
+
+
+class _Adler32(object):
+    """hashlib-like wrapper around zlib.adler32
+
+    A checksum rather than a cryptographic digest, but several times
+    faster than md5.
+    """
+    def __init__(self):
+        self.value = 1
+
+    def update(self, data):
+        self.value = zlib.adler32(data, self.value)
+
+    def hexdigest(self):
+        return '%08x' % (self.value & 0xffffffff)
+
+
+def _new_digest(digest):
+    """Return a new digest object for the algorithm named `digest`"""
+    if digest == 'md5':
+        return md5()
+    if digest == 'adler32':
+        return _Adler32()
+    if hashlib is None:
+        raise ValueError("Unknown digest: %s" % digest)
+    return hashlib.new(digest)
+
+
+def hash_infile(afile, chunk_len=HASH_CHUNK_LEN, digest='md5',
+                sample_len=None):
+    """ Computes hash of the content of a file
+
+    Parameters
+    ----------
+    afile : str
+        path of the file
+    chunk_len : int
+        number of bytes read at a time
+    digest : str
+        ``adler32`` or the name of any algorithm supported by hashlib
+    sample_len : int
+        if set, only the size of the file and three blocks of
+        `sample_len` bytes at its beginning, middle and end are hashed
+
+    If the persistent hash cache is enabled (see
+    :mod:`nipype.utils.hashcache`) and the stat metadata of the file have
+    not changed since its hash was stored, the stored hash is returned
+    without reading the file.
+    """
+    hexdigest = None
     if os.path.isfile(afile):
-        md5obj = md5()
-        fp = file(afile, 'rb')
-        while True:
-            data = fp.read(chunk_len)
-            if not data:
-                break
-            md5obj.update(data)
+        stat = os.stat(afile)
+        method = digest
+        if sample_len:
+            method = 'sampled-%s-%d' % (digest, sample_len)
+        cache = get_hash_cache()
+        if cache is not None:
+            hexdigest = cache.get(afile, stat, method=method)
+            if hexdigest:
+                return hexdigest
+        hashobj = _new_digest(digest)
+        fp = open(afile, 'rb')
+        if sample_len and stat.st_size > 3 * sample_len:
+            hashobj.update(str(stat.st_size))
+            for offset in (0, (stat.st_size - sample_len) // 2,
+                           stat.st_size - sample_len):
+                fp.seek(offset)
+                hashobj.update(fp.read(sample_len))
+        else:
+            while True:
+                data = fp.read(chunk_len)
+                if not data:
+                    break
+                hashobj.update(data)
         fp.close()
-        md5hex = md5obj.hexdigest()
-    return md5hex
+        hexdigest = hashobj.hexdigest()
+        if cache is not None:
+            cache.set(afile, hexdigest, stat, method=method)
+    return hexdigest
 
 def hash_timestamp(afile):
     """ Computes md5 hash of the timestamp of a file """
@@ -167,6 +242,86 @@ def hash_timestamp(afile):
         md5hex = md5obj.hexdigest()
     return md5hex
 
+def hash_file(afile, method=None, digest=None):
+    """ Computes the hash of a file with the given method
+
+    Parameters
+    ----------
+    afile : str
+        path of the file
+    method : str
+        ``content``, ``sampled`` or ``timestamp``. Defaults to the
+        `hash_method` option of the `execution` section of the config
+        file.
+    digest : str
+        digest algorithm of the content based methods. Defaults to the
+        `hash_digest` option.
+
+    Returns None if `afile` is not an existing file.
+    """
+    if method is None:
+        method = config.get('execution', 'hash_method')
+    method = method.lower()
+    if method == 'timestamp':
+        return hash_timestamp(afile)
+    if digest is None:
+        digest = config.get('execution', 'hash_digest')
+    digest = digest.lower()
+    if method == 'content':
+        return hash_infile(afile, digest=digest)
+    if method == 'sampled':
+        return hash_infile(afile, digest=digest, sample_len=HASH_SAMPLE_LEN)
+    raise Exception("Unknown hash method: %s" % method)
+
+_hash_pool = None
+
+def _get_hash_pool(n_threads):
+    """Return a pool of `n_threads` threads owned by this process"""
+    global _hash_pool
+    if _hash_pool is None or _hash_pool[0] != os.getpid() or \
+            _hash_pool[1] != n_threads:
+        from multiprocessing.pool import ThreadPool
+        _hash_pool = (os.getpid(), n_threads, ThreadPool(n_threads))
+    return _hash_pool[2]
+
+def hash_files(files, method=None, n_threads=None, digest=None):
+    """ Computes the hashes of a list of files concurrently
+
+    Reading files and computing digests release the GIL, so a pool of
+    threads hashes many files considerably faster than a loop.
+
+    Parameters
+    ----------
+    files : list
+        paths of the files
+    method : str
+        see :func:`hash_file`
+    n_threads : int
+        number of threads. Defaults to the `hash_threads` option of the
+        `execution` section of the config file.
+    digest : str
+        see :func:`hash_file`
+
+    Returns
+    -------
+    hashes : list
+        the hashes of `files` in the same order (None for paths that are
+        not existing files)
+    """
+    if method is None:
+        method = config.get('execution', 'hash_method')
+    if n_threads is None:
+        n_threads = config.getint('execution', 'hash_threads')
+    if n_threads > 1 and len(files) > 1 and method.lower() != 'timestamp':
+        try:
+            pool = _get_hash_pool(n_threads)
+        except ImportError:
+            pass
+        else:
+            return pool.map(lambda afile: hash_file(afile, method, digest),
+                            files)
+    return [hash_file(afile, method, digest) for afile in files]
+
 def copyfile(originalfile, newfile, copy=False):
     """Copy or symlink ``originalfile`` to ``newfile``.
 
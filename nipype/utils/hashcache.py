@@ -0,0 +1,218 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Persistent cache of file content hashes
+
+Computing the md5 of large input files every time the hash of a node is
+requested dominates the time it takes to re-run a workflow. The cache
+stores the digest of a file together with its stat metadata (inode,
+size and modification time) in an sqlite database. As long as the
+metadata of a file does not change, looking up its digest costs only a
+stat() call.
+
+The database is shared by all processes of a user and may be used from
+several threads (see :func:`nipype.utils.filemanip.hash_files`). sqlite
+serializes concurrent writers, and the number of entries is bounded: the
+size of the database is checked when it is opened and at regular
+intervals while entries are stored, and the least recently stored entries
+beyond `maxsize` are evicted.
+
+The cache is used by :func:`nipype.utils.filemanip.hash_infile` if the
+`use_hash_cache` option of the `execution` section of the config file
+is set.
+"""
+
+from collections import deque
+import logging
+import os
+from threading import Lock
+from time import time
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+from nipype.utils.config import config
+
+fmlogger = logging.getLogger("filemanip")
+
+
+class FileHashCache(object):
+    """An sqlite backed cache of file digests
+
+    Parameters
+    ----------
+    filename : str
+        path of the sqlite database
+    maxsize : int
+        maximum number of entries kept in the cache
+
+    Examples
+    --------
+    >>> from nipype.utils.hashcache import FileHashCache
+    >>> cache = FileHashCache('/tmp/hashcache.db') # doctest: +SKIP
+    >>> cache.get('functional.nii') # doctest: +SKIP
+    """
+
+    # check the size of the database at least every `_evict_interval`
+    # insertions
+    _evict_interval = 1000
+    # maximum number of entries kept in memory
+    _memcache_size = 10000
+
+    def __init__(self, filename, maxsize=100000):
+        self.filename = filename
+        self.maxsize = maxsize
+        self._conn = None
+        self._pid = None
+        self._ninserts = 0
+        self._lock = Lock()
+        # entries recently looked up or stored by this process, oldest
+        # first in `_memkeys`
+        self._memcache = {}
+        self._memkeys = deque()
+
+    def _connect(self):
+        # sqlite connections must not be shared across a fork
+        if self._conn is None or self._pid != os.getpid():
+            cachedir = os.path.dirname(os.path.abspath(self.filename))
+            if not os.path.exists(cachedir):
+                os.makedirs(cachedir)
+            self._conn = sqlite3.connect(self.filename, timeout=60,
+                                         isolation_level=None,
+                                         check_same_thread=False)
+            self._conn.execute('CREATE TABLE IF NOT EXISTS filehash ('
+                               'path TEXT, method TEXT, inode INTEGER, '
+                               'size INTEGER, mtime REAL, digest TEXT, '
+                               'stored REAL, PRIMARY KEY (path, method))')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS filehash_stored '
+                               'ON filehash (stored)')
+            self._pid = os.getpid()
+            # other processes may have filled the database
+            self._evict()
+        return self._conn
+
+    def _remember(self, key, digest):
+        if key not in self._memcache:
+            self._memkeys.append(key)
+            if len(self._memkeys) > min(self.maxsize, self._memcache_size):
+                del self._memcache[self._memkeys.popleft()]
+        self._memcache[key] = digest
+
+    def _key(self, afile, stat, method):
+        return (os.path.realpath(afile), method, stat.st_ino, stat.st_size,
+                stat.st_mtime)
+
+    def get(self, afile, stat=None, method='md5'):
+        """Return the stored digest of `afile` or None
+
+        A digest is returned only if the inode, size and modification
+        time of the file match the values it was stored with.
+        """
+        if stat is None:
+            stat = os.stat(afile)
+        key = self._key(afile, stat, method)
+        if key in self._memcache:
+            return self._memcache[key]
+        self._lock.acquire()
+        try:
+            try:
+                row = self._connect().execute('SELECT digest FROM filehash '
+                                              'WHERE path=? AND method=? AND '
+                                              'inode=? AND size=? AND '
+                                              'mtime=?', key).fetchone()
+            except sqlite3.Error, e:
+                fmlogger.debug('hash cache lookup failed: %s', e)
+                return None
+        finally:
+            self._lock.release()
+        if row is None:
+            return None
+        digest = str(row[0])
+        self._remember(key, digest)
+        return digest
+
+    def set(self, afile, digest, stat=None, method='md5'):
+        """Store the digest of `afile`
+
+        `stat` should be the result of os.stat taken *before* the file
+        was read to compute the digest.
+        """
+        if stat is None:
+            stat = os.stat(afile)
+        key = self._key(afile, stat, method)
+        self._remember(key, digest)
+        # small caches are checked more often, so they never grow much
+        # beyond `maxsize`
+        interval = max(1, min(self._evict_interval, self.maxsize // 10))
+        self._lock.acquire()
+        try:
+            try:
+                self._connect().execute('INSERT OR REPLACE INTO filehash '
+                                        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                        key + (digest, time()))
+                self._ninserts += 1
+                if self._ninserts % interval == 0:
+                    self._evict()
+            except sqlite3.Error, e:
+                fmlogger.debug('hash cache update failed: %s', e)
+        finally:
+            self._lock.release()
+
+    def evict(self):
+        """Remove the least recently stored entries beyond `maxsize`
+        """
+        self._lock.acquire()
+        try:
+            self._evict()
+        finally:
+            self._lock.release()
+
+    def _evict(self):
+        conn = self._connect()
+        count = conn.execute('SELECT COUNT(*) FROM filehash').fetchone()[0]
+        if count > self.maxsize:
+            conn.execute('DELETE FROM filehash WHERE rowid IN (SELECT rowid '
+                         'FROM filehash ORDER BY stored LIMIT ?)',
+                         (count - self.maxsize,))
+
+    def __len__(self):
+        self._lock.acquire()
+        try:
+            return self._connect().execute('SELECT COUNT(*) FROM '
+                                           'filehash').fetchone()[0]
+        finally:
+            self._lock.release()
+
+    def __getstate__(self):
+        # connections and locks cannot be pickled
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        state['_memcache'] = {}
+        state['_memkeys'] = deque()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+
+_hash_cache = None
+
+def get_hash_cache():
+    """Return the cache configured in the `execution` section of the config
+    file or None if caching is disabled
+    """
+    global _hash_cache
+    if sqlite3 is None or \
+            not config.getboolean('execution', 'use_hash_cache'):
+        return None
+    filename = os.path.join(os.path.expanduser(config.get('execution',
+                                                          'hash_cache_dir')),
+                            'hashcache.db')
+    if _hash_cache is None or _hash_cache.filename != filename:
+        _hash_cache = FileHashCache(filename,
+                                    maxsize=config.getint('execution',
+                                                          'hash_cache_size'))
+    return _hash_cache
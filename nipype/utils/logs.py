@@ -0,0 +1,235 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Logging of workflows and interfaces
+
+Importing nipype only sets the levels of the `workflow`, `filemanip` and
+`interface` loggers from the `logging` section of the config file. The
+log file (``pypeline.log``) and the event log are opened by
+`setup_logging` when the first workflow or node runs.
+
+Worker processes (e.g., of the multiproc plugin) do not write to the log
+files themselves. Their records are put on a queue without waiting and
+are handled by a `QueueListener` thread of the process that started the
+workers::
+
+    listener = QueueListener()
+    listener.start()
+    pool = Pool(processes=4, initializer=init_worker_logging,
+                initargs=(listener.queue,))
+    ...
+    listener.stop()
+
+The event log (``events.jsonl``, see the `use_event_log` option) has one
+JSON object per line with the fields `event`, `time`, `host` and `pid`
+and the fields passed to `log_event`.
+"""
+
+import logging
+import logging.handlers
+import os
+from socket import gethostname
+from threading import Lock, Thread
+from Queue import Full
+
+from nipype.utils.config import config
+from nipype.utils.filemanip import json
+
+LOG_FILENAME = 'pypeline.log'
+EVENT_FILENAME = 'events.jsonl'
+# records of worker processes that may wait for the listener
+QUEUE_SIZE = 10000
+
+LOGGER_NAMES = ('workflow', 'filemanip', 'interface', 'events')
+
+logging.basicConfig()
+for _name in LOGGER_NAMES[:3]:
+    logging.getLogger(_name).setLevel(
+        logging.getLevelName(config.get('logging', '%s_level' % _name)))
+
+event_logger = logging.getLogger('events')
+event_logger.setLevel(logging.INFO)
+event_logger.propagate = False
+
+_lock = Lock()
+_file_handler = None
+_event_handler = None
+_worker = False
+
+
+def _log_directory():
+    directory = config.get('logging', 'log_directory')
+    if directory:
+        directory = os.path.abspath(os.path.expanduser(directory))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        return directory
+    return os.getcwd()
+
+def setup_logging():
+    """Open the log file and the event log as set in the config file
+
+    Only the first call has an effect. Worker processes set up by
+    `init_worker_logging` do not open any files.
+    """
+    global _file_handler
+    if _worker or _file_handler is not None:
+        return
+    _lock.acquire()
+    try:
+        if _file_handler is not None:
+            return
+        if not config.getboolean('logging', 'log_to_file'):
+            # marks the setup as done
+            _file_handler = True
+        else:
+            filename = os.path.join(_log_directory(), LOG_FILENAME)
+            _file_handler = logging.handlers.RotatingFileHandler(filename,
+                                                            maxBytes=256000,
+                                                            backupCount=4)
+            formatter = logging.Formatter(fmt='%(asctime)s,%(msecs)d '
+                                          '%(name)-2s %(levelname)-2s:\n\t '
+                                          '%(message)s',
+                                          datefmt='%y%m%d-%H:%M:%S')
+            _file_handler.setFormatter(formatter)
+            for name in LOGGER_NAMES[:3]:
+                logging.getLogger(name).addHandler(_file_handler)
+    finally:
+        _lock.release()
+    if config.getboolean('logging', 'use_event_log'):
+        start_event_log(os.path.join(_log_directory(), EVENT_FILENAME))
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record as a JSON object on a single line
+
+    The message is stored as `event` and the dict in the `fields`
+    attribute of the record (see `log_event`) is added.
+    """
+
+    def __init__(self):
+        logging.Formatter.__init__(self)
+        self.host = gethostname()
+
+    def format(self, record):
+        entry = dict(event=record.getMessage(), time=record.created,
+                     host=self.host, pid=record.process)
+        entry.update(getattr(record, 'fields', {}))
+        try:
+            return json.dumps(entry, sort_keys=True)
+        except (TypeError, ValueError):
+            entry.update([(key, repr(val)) for key, val in \
+                              getattr(record, 'fields', {}).items()])
+            return json.dumps(entry, sort_keys=True)
+
+def start_event_log(filename):
+    """Append the events passed to `log_event` to `filename`
+    """
+    global _event_handler
+    stop_event_log()
+    _event_handler = logging.FileHandler(filename)
+    _event_handler.setFormatter(JSONFormatter())
+    event_logger.addHandler(_event_handler)
+
+def stop_event_log():
+    """Close the event log
+    """
+    global _event_handler
+    if _event_handler is not None:
+        event_logger.removeHandler(_event_handler)
+        _event_handler.close()
+        _event_handler = None
+
+def log_event(event, **fields):
+    """Write an event with the given fields to the event log
+
+    Does nothing unless the event log is open (or, in a worker process,
+    the process that started the worker has one).
+    """
+    if _event_handler is None and not _worker:
+        return
+    event_logger.info(event, extra=dict(fields=fields))
+
+
+class QueueHandler(logging.Handler):
+    """Puts records on a queue for another process to handle
+
+    Records are dropped when the queue is full, so logging never blocks
+    the process. Messages are formatted and tracebacks are converted to
+    text before the record is put on the queue.
+    """
+
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.dropped = 0
+
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Full:
+            self.dropped += 1
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+
+class QueueListener(Thread):
+    """Handles the records put on a queue by `QueueHandler`
+
+    Each record is passed to the logger it was logged with, so it is
+    written by the handlers of this process.
+    """
+
+    def __init__(self, queue=None):
+        Thread.__init__(self)
+        self.setDaemon(True)
+        if queue is None:
+            from multiprocessing import Queue
+            queue = Queue(QUEUE_SIZE)
+        self.queue = queue
+
+    def run(self):
+        while True:
+            try:
+                record = self.queue.get()
+            except (EOFError, IOError):
+                break
+            if record is None:
+                break
+            logging.getLogger(record.name).handle(record)
+
+    def stop(self, timeout=None):
+        """Handle the remaining records and stop the thread
+
+        Waits at most `timeout` seconds (if given) for the thread.
+        """
+        self.queue.put(None)
+        self.join(timeout)
+
+def init_worker_logging(queue):
+    """Send the records of the nipype loggers of a worker process to
+    `queue`
+
+    Meant as the initializer of a pool of processes whose parent runs a
+    `QueueListener` on `queue`.
+    """
+    global _worker
+    _worker = True
+    handler = QueueHandler(queue)
+    for name in LOGGER_NAMES:
+        logger = logging.getLogger(name)
+        for hdlr in logger.handlers[:]:
+            logger.removeHandler(hdlr)
+        logger.addHandler(handler)
+        # the listener passes the records on to the parent loggers
+        logger.propagate = False
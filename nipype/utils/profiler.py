@@ -0,0 +1,174 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Resource use of command line interfaces
+
+A :class:`ResourceMonitor` samples the process tree started by a command
+(the shell and all its descendants) at a fixed interval and records the
+peak resident memory, the bytes read and written and the peak number of
+threads. Samples are read from the /proc file system, so these values
+are only available on Linux. CPU times are taken from the resource usage
+of terminated children, which is exact for any platform with getrusage.
+
+Profiling is enabled by the `profile_runtime` option of the `execution`
+section of the config file; `profile_interval` sets the number of
+seconds between samples.
+"""
+
+import logging
+import os
+from threading import Thread, Event
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger('interface')
+
+_pagesize = 4096
+if hasattr(os, 'sysconf'):
+    try:
+        _pagesize = os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError):
+        pass
+
+
+def _read_stat(pid):
+    """Return (ppid, number of threads, rss in bytes) of a process
+    """
+    fp = open('/proc/%d/stat' % pid)
+    try:
+        stat = fp.read()
+    finally:
+        fp.close()
+    # the command name may contain spaces
+    fields = stat[stat.rfind(')') + 2:].split()
+    return int(fields[1]), int(fields[17]), int(fields[21]) * _pagesize
+
+def _read_io(pid):
+    """Return (read bytes, written bytes) of a process or None
+    """
+    try:
+        fp = open('/proc/%d/io' % pid)
+        try:
+            lines = fp.readlines()
+        finally:
+            fp.close()
+    except (IOError, OSError):
+        return None
+    values = dict([line.split(':') for line in lines if ':' in line])
+    return int(values['rchar']), int(values['wchar'])
+
+def _process_tree(root):
+    """Return the stats of `root` and of all its descendants
+
+    Returns a dict pid -> (number of threads, rss in bytes)
+    """
+    stats = {}
+    children = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            ppid, threads, rss = _read_stat(int(name))
+        except (IOError, OSError, IndexError, ValueError):
+            # the process terminated in the meantime
+            continue
+        stats[int(name)] = (threads, rss)
+        children.setdefault(ppid, []).append(int(name))
+    tree = {}
+    stack = [root]
+    while stack:
+        pid = stack.pop()
+        if pid in stats:
+            tree[pid] = stats[pid]
+        stack.extend(children.get(pid, []))
+    return tree
+
+def _children_times():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime, usage.ru_stime
+
+
+class ResourceMonitor(Thread):
+    """Samples the resource use of a process and its descendants
+
+    Parameters
+    ----------
+    pid : int
+        process to monitor
+    interval : float
+        seconds between samples
+
+    Examples
+    --------
+    >>> proc = subprocess.Popen(cmdline, shell=True) # doctest: +SKIP
+    >>> monitor = ResourceMonitor(proc.pid, interval=0.5) # doctest: +SKIP
+    >>> monitor.start() # doctest: +SKIP
+    >>> proc.wait() # doctest: +SKIP
+    >>> profile = monitor.stop() # doctest: +SKIP
+    """
+
+    def __init__(self, pid, interval=1.):
+        Thread.__init__(self)
+        self.setDaemon(True)
+        self.pid = pid
+        self.interval = interval
+        self._stop_event = Event()
+        self._times = _children_times()
+        self.peak_rss = None
+        self.num_threads = None
+        # pid -> (read bytes, written bytes) of the last sample
+        self._io = {}
+        self.nsamples = 0
+
+    def run(self):
+        while True:
+            self.sample()
+            self._stop_event.wait(self.interval)
+            if self._stop_event.isSet():
+                break
+
+    def sample(self):
+        """Record the current resource use of the process tree
+        """
+        if not os.path.isdir('/proc'):
+            return
+        tree = _process_tree(self.pid)
+        if not tree:
+            return
+        self.nsamples += 1
+        rss = sum([stat[1] for stat in tree.values()]) / 1024. ** 2
+        threads = sum([stat[0] for stat in tree.values()])
+        self.peak_rss = max(self.peak_rss, rss)
+        self.num_threads = max(self.num_threads, threads)
+        for pid in tree:
+            io = _read_io(pid)
+            if io is not None:
+                self._io[pid] = io
+
+    def stop(self):
+        """Stop sampling and return the resource use
+
+        Must be called after the monitored process has terminated and
+        been waited for, so that its CPU times have been accounted.
+        Returns a dict with the fields `cpu_user` and `cpu_sys`
+        (seconds), `peak_rss` (MB), `read_bytes`, `write_bytes` and
+        `num_threads`. Values that could not be measured are None.
+        """
+        self._stop_event.set()
+        if self.isAlive():
+            self.join()
+        profile = dict(cpu_user=None, cpu_sys=None, peak_rss=self.peak_rss,
+                       read_bytes=None, write_bytes=None,
+                       num_threads=self.num_threads)
+        times = _children_times()
+        if times is not None and self._times is not None:
+            profile['cpu_user'] = times[0] - self._times[0]
+            profile['cpu_sys'] = times[1] - self._times[1]
+        if self._io:
+            profile['read_bytes'] = sum([io[0] for io in self._io.values()])
+            profile['write_bytes'] = sum([io[1] for io in self._io.values()])
+        return profile
@@ -0,0 +1,260 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""History of interface runtimes
+
+Every node that runs an interface adds a record to an sqlite database:
+the interface class, a normalized signature of its inputs, the host, the
+duration, the peak memory use and the total size of the output files.
+The workflow scheduler uses the history to estimate the duration (see
+`Workflow._get_priorities`) and memory needs of nodes before they run,
+and the records can be summarized from the command line::
+
+    python -m nipype.utils.runtimedb [--limit N] [--host HOST] [database]
+
+The history is kept if the `use_runtime_history` option of the
+`execution` section of the config file is set. The database is stored
+as ``runtime.db`` in the `hash_cache_dir`.
+"""
+
+import logging
+import math
+import os
+import sys
+from optparse import OptionParser
+from threading import Lock
+from time import time
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+from nipype.utils.config import config
+from nipype.utils.filemanip import md5
+from nipype.utils.misc import isdefined
+
+logger = logging.getLogger('workflow')
+
+
+def _normalize(value):
+    """Replace existing files by the order of magnitude of their size
+    """
+    if isinstance(value, dict):
+        return sorted([(key, _normalize(val)) for key, val in value.items()
+                       if isdefined(val)])
+    if isinstance(value, (list, tuple)):
+        return [_normalize(val) for val in value]
+    if isinstance(value, str) and os.path.isfile(value):
+        size = os.path.getsize(value)
+        return 'file:%d' % int(math.log(max(size, 1), 2))
+    return value
+
+def input_signature(inputs):
+    """Return a signature of the defined inputs of an interface
+
+    Input files are represented by the order of magnitude of their size
+    rather than their path, so that runs of an interface with the same
+    parameters on comparable data (e.g., of different subjects) share a
+    signature.
+    """
+    return md5(repr(_normalize(inputs.get()))).hexdigest()
+
+def interface_name(interface):
+    """Return the fully qualified class name of an interface
+    """
+    klass = interface.__class__
+    return '%s.%s' % (klass.__module__, klass.__name__)
+
+def peak_rss():
+    """Return the peak resident set size (in MB) of this process and of its
+    terminated children
+
+    Both values are high-water marks over the lifetime of the process.
+    Returns None if they are not available on this platform.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    if sys.platform == 'darwin':
+        # bytes rather than kilobytes
+        return rss / 1024. ** 2
+    return rss / 1024.
+
+
+class RuntimeHistory(object):
+    """An sqlite backed history of interface runtimes
+
+    Parameters
+    ----------
+    filename : str
+        path of the sqlite database
+
+    Examples
+    --------
+    >>> from nipype.utils.runtimedb import RuntimeHistory
+    >>> history = RuntimeHistory('/tmp/runtime.db') # doctest: +SKIP
+    >>> history.estimate('nipype.interfaces.fsl.preprocess.BET') # doctest: +SKIP
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._conn = None
+        self._pid = None
+        self._lock = Lock()
+
+    def _connect(self):
+        # sqlite connections must not be shared across a fork
+        if self._conn is None or self._pid != os.getpid():
+            dbdir = os.path.dirname(os.path.abspath(self.filename))
+            if not os.path.exists(dbdir):
+                os.makedirs(dbdir)
+            self._conn = sqlite3.connect(self.filename, timeout=60,
+                                         isolation_level=None,
+                                         check_same_thread=False)
+            self._conn.execute('CREATE TABLE IF NOT EXISTS runtime ('
+                               'interface TEXT, signature TEXT, host TEXT, '
+                               'duration REAL, peak_rss REAL, '
+                               'output_bytes INTEGER, stored REAL)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS runtime_interface '
+                               'ON runtime (interface, signature)')
+            self._pid = os.getpid()
+        return self._conn
+
+    def _execute(self, sql, args=()):
+        self._lock.acquire()
+        try:
+            try:
+                return self._connect().execute(sql, args).fetchall()
+            except sqlite3.Error, e:
+                logger.debug('runtime history query failed: %s' % str(e))
+                return []
+        finally:
+            self._lock.release()
+
+    def record(self, interface, signature, host, duration, peak_rss=None,
+               output_bytes=None):
+        """Add a run of an interface to the history
+
+        Parameters
+        ----------
+        interface : str
+            class name of the interface (see :func:`interface_name`)
+        signature : str
+            signature of the inputs (see :func:`input_signature`)
+        host : str
+        duration : float
+            seconds
+        peak_rss : float
+            peak memory use in MB
+        output_bytes : int
+            total size of the output files
+        """
+        self._execute('INSERT INTO runtime VALUES (?, ?, ?, ?, ?, ?, ?)',
+                      (interface, signature, host, duration, peak_rss,
+                       output_bytes, time()))
+
+    def estimate(self, interface, signature=None, host=None):
+        """Return the mean duration (s) and peak memory use (MB) of previous
+        runs of an interface
+
+        Runs with the same input `signature` (and on the same `host`) are
+        preferred; if there are none, all runs of the interface are used.
+        Returns a dict with the fields `count`, `duration` and `peak_rss`,
+        or None if the interface has never run.
+        """
+        queries = []
+        if signature is not None:
+            if host is not None:
+                queries.append(('interface=? AND signature=? AND host=?',
+                                (interface, signature, host)))
+            queries.append(('interface=? AND signature=?',
+                            (interface, signature)))
+        queries.append(('interface=?', (interface,)))
+        for where, args in queries:
+            rows = self._execute('SELECT COUNT(*), AVG(duration), '
+                                 'MAX(peak_rss) FROM runtime WHERE ' + where,
+                                 args)
+            if rows and rows[0][0]:
+                return dict(count=rows[0][0], duration=rows[0][1],
+                            peak_rss=rows[0][2])
+        return None
+
+    def slowest(self, limit=10, host=None):
+        """Return the interfaces with the largest total duration
+
+        Returns a list of (interface, runs, total duration, mean duration,
+        max peak_rss, mean output_bytes) tuples.
+        """
+        where = ''
+        args = ()
+        if host is not None:
+            where = 'WHERE host=? '
+            args = (host,)
+        return self._execute('SELECT interface, COUNT(*), SUM(duration), '
+                             'AVG(duration), MAX(peak_rss), '
+                             'AVG(output_bytes) FROM runtime ' + where + \
+                                 'GROUP BY interface ORDER BY SUM(duration) '
+                             'DESC LIMIT ?', args + (limit,))
+
+    def __getstate__(self):
+        # connections and locks cannot be pickled
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+
+def _get_filename():
+    return os.path.join(os.path.expanduser(config.get('execution',
+                                                      'hash_cache_dir')),
+                        'runtime.db')
+
+_history = None
+
+def get_runtime_history():
+    """Return the history configured in the `execution` section of the
+    config file or None if it is disabled
+    """
+    global _history
+    if sqlite3 is None or \
+            not config.getboolean('execution', 'use_runtime_history'):
+        return None
+    filename = _get_filename()
+    if _history is None or _history.filename != filename:
+        _history = RuntimeHistory(filename)
+    return _history
+
+def main(args=None):
+    """Print the interfaces that took the most time
+    """
+    parser = OptionParser(usage='%prog [options] [database]')
+    parser.add_option('-n', '--limit', type='int', default=10,
+                      help='number of interfaces to report')
+    parser.add_option('--host', help='only report runs on this host')
+    options, args = parser.parse_args(args)
+    filename = _get_filename()
+    if args:
+        filename = args[0]
+    if not os.path.exists(filename):
+        parser.error('%s does not exist' % filename)
+    rows = RuntimeHistory(filename).slowest(options.limit, options.host)
+    print '%-50s %6s %10s %10s %10s %10s' % ('interface', 'runs', 'total(s)',
+                                            'mean(s)', 'peak(MB)',
+                                            'output(MB)')
+    for interface, count, total, mean, rss, outbytes in rows:
+        if rss is None:
+            rss = float('nan')
+        if outbytes is None:
+            outbytes = float('nan')
+        print '%-50s %6d %10.1f %10.1f %10.1f %10.1f' % \
+            (interface[-50:], count, total, mean, rss, outbytes / 1024. ** 2)
+
+if __name__ == '__main__':
+    main()
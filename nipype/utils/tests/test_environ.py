@@ -0,0 +1,57 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+import os
+from tempfile import mkdtemp
+from shutil import rmtree
+
+import cPickle
+from copy import deepcopy
+
+from nipype.testing import assert_equal, assert_true, assert_raises, parametric
+from nipype.utils.config import config
+from nipype.utils.environ import environ_snapshot, save_environ, load_environ
+
+@parametric
+def test_environ_snapshot():
+    digest, env = environ_snapshot()
+    yield assert_equal(env, dict(os.environ))
+    # identical environments share a snapshot
+    digest2, env2 = environ_snapshot()
+    yield assert_true(env2 is env)
+    yield assert_equal(digest2, digest)
+    digest3, env3 = environ_snapshot({'NIPYPE_TEST': 'foo'})
+    yield assert_true(digest3 != digest)
+    yield assert_equal(env3['NIPYPE_TEST'], 'foo')
+    config.set('execution', 'environ_whitelist', 'PATH, NOT_SET_ANYWHERE')
+    try:
+        digest4, env4 = environ_snapshot({'NIPYPE_TEST': 'foo'})
+    finally:
+        config.set('execution', 'environ_whitelist', '')
+    yield assert_equal(env4, {'PATH': os.environ['PATH'],
+                              'NIPYPE_TEST': 'foo'})
+    # shared snapshots cannot be modified
+    yield assert_raises(TypeError, env.__setitem__, 'NIPYPE_TEST', 'bar')
+    yield assert_raises(TypeError, env.update, NIPYPE_TEST='bar')
+    yield assert_raises(TypeError, env.pop, 'PATH')
+    yield assert_equal(cPickle.loads(cPickle.dumps(env, 2)), env)
+    yield assert_true(deepcopy(env) is env)
+
+@parametric
+def test_environ_store():
+    tmpdir = mkdtemp()
+    config.set('execution', 'hash_cache_dir', tmpdir)
+    try:
+        digest, env = environ_snapshot({'NIPYPE_STORE_TEST': 'foo'})
+        yield assert_equal(load_environ(digest), None)
+        # nothing is written unless the hash cache is used
+        save_environ(digest, env)
+        yield assert_equal(os.listdir(tmpdir), [])
+        config.set('execution', 'use_hash_cache', 'true')
+        save_environ(digest, env)
+        yield assert_equal(os.listdir(os.path.join(tmpdir, 'environ')),
+                           ['%s.json' % digest])
+        yield assert_equal(load_environ(digest), env)
+    finally:
+        config.set('execution', 'hash_cache_dir', '~/.nipype')
+        config.set('execution', 'use_hash_cache', 'false')
+    rmtree(tmpdir)
@@ -9,7 +9,9 @@ from nipype.utils.filemanip import (save_json, load_json, loadflat,
                                     hash_rename, check_forhash,
                                     copyfile, copyfiles,
                                     filename_to_list, list_to_filename,
-                                    cleandir, split_filename)
+                                    cleandir, split_filename,
+                                    hash_infile, hash_file, hash_files,
+                                    hash_timestamp, md5)
 
 import numpy as np
 
@@ -59,6 +61,38 @@ def test_check_forhash():
     yield assert_false, result
     yield assert_equal, hash, None
 
+@parametric
+def test_hash_files():
+    tmpdir = mkdtemp()
+    small = os.path.join(tmpdir, 'small.txt')
+    fp = open(small, 'wb')
+    fp.write('foo')
+    fp.close()
+    large = os.path.join(tmpdir, 'large.img')
+    data = np.random.bytes(1 << 18)
+    fp = open(large, 'wb')
+    fp.write(data)
+    fp.close()
+    yield assert_equal(hash_infile(small), md5('foo').hexdigest())
+    yield assert_equal(hash_infile(large, chunk_len=1000),
+                       md5(data).hexdigest())
+    yield assert_equal(hash_infile(small, digest='sha1'),
+                       '0beec7b5ea3f0fdbc95d0dd47f3c5bc275da8a33')
+    yield assert_equal(hash_infile(small, digest='adler32'), '02820145')
+    # small files are hashed completely in sampled mode
+    yield assert_equal(hash_file(small, 'sampled'), md5('foo').hexdigest())
+    sampled = hash_file(large, 'sampled')
+    yield assert_false(sampled == md5(data).hexdigest())
+    yield assert_equal(hash_file(large, 'timestamp'), hash_timestamp(large))
+    files = [small, large, os.path.join(tmpdir, 'missing.nii')] * 3
+    for n_threads in [1, 3]:
+        hashes = hash_files(files, method='content', n_threads=n_threads)
+        yield assert_equal(hashes, [md5('foo').hexdigest(),
+                                    md5(data).hexdigest(), None] * 3)
+    os.unlink(small)
+    os.unlink(large)
+    os.rmdir(tmpdir)
+
 def _temp_analyze_files():
     """Generate temporary analyze file pair."""
     fd, orig_img = mkstemp(suffix = '.img')
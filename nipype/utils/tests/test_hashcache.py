@@ -0,0 +1,94 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+import os
+from tempfile import mkdtemp
+from shutil import rmtree
+
+from nipype.testing import assert_equal, assert_true, parametric
+from nipype.utils.config import config
+from nipype.utils.filemanip import hash_infile
+from nipype.utils.hashcache import FileHashCache, get_hash_cache
+
+def _write(fname, data):
+    fp = open(fname, 'wb')
+    fp.write(data)
+    fp.close()
+
+@parametric
+def test_get_set():
+    tmpdir = mkdtemp()
+    fname = os.path.join(tmpdir, 'foo.txt')
+    _write(fname, 'foo')
+    cache = FileHashCache(os.path.join(tmpdir, 'cache.db'))
+    yield assert_equal(cache.get(fname), None)
+    cache.set(fname, 'abc')
+    yield assert_equal(cache.get(fname), 'abc')
+    # a new instance (e.g., another process) sees the stored entry
+    other = FileHashCache(cache.filename)
+    yield assert_equal(other.get(fname), 'abc')
+    yield assert_equal(other.get(fname, method='sha1'), None)
+    # modified files are not served from the cache
+    _write(fname, 'foobar')
+    yield assert_equal(other.get(fname), None)
+    rmtree(tmpdir)
+
+@parametric
+def test_evict():
+    tmpdir = mkdtemp()
+    cache = FileHashCache(os.path.join(tmpdir, 'cache.db'), maxsize=5)
+    cache._evict_interval = 4
+    for i in range(10):
+        fname = os.path.join(tmpdir, 'file%d.txt' % i)
+        _write(fname, str(i))
+        cache.set(fname, str(i))
+    yield assert_true(len(cache) <= 7)
+    cache.evict()
+    yield assert_equal(len(cache), 5)
+    yield assert_equal(FileHashCache(cache.filename).get(fname), '9')
+    rmtree(tmpdir)
+
+@parametric
+def test_evict_instances():
+    tmpdir = mkdtemp()
+    filename = os.path.join(tmpdir, 'cache.db')
+    fnames = []
+    for i in range(50):
+        fnames.append(os.path.join(tmpdir, 'file%d.txt' % i))
+        _write(fnames[-1], str(i))
+    # short lived instances (e.g., processes) keep the cache bounded too
+    for method in ('md5', 'sha1', 'sha256'):
+        cache = FileHashCache(filename, maxsize=10)
+        for fname in fnames:
+            cache.set(fname, 'abc', method=method)
+        yield assert_true(len(cache) <= 10)
+        yield assert_true(len(cache._memcache) <= 10)
+        yield assert_equal(len(cache._memkeys), len(cache._memcache))
+    yield assert_equal(cache.get(fnames[-1], method='sha256'), 'abc')
+    # the size is checked when the database is opened
+    cache = FileHashCache(filename, maxsize=5)
+    yield assert_equal(len(cache), 5)
+    rmtree(tmpdir)
+
+@parametric
+def test_hash_infile_cached():
+    tmpdir = mkdtemp()
+    fname = os.path.join(tmpdir, 'foo.txt')
+    _write(fname, 'foo')
+    config.set('execution', 'use_hash_cache', 'true')
+    config.set('execution', 'hash_cache_dir', tmpdir)
+    try:
+        cache = get_hash_cache()
+        yield assert_equal(cache.filename,
+                           os.path.join(tmpdir, 'hashcache.db'))
+        md5hex = hash_infile(fname)
+        yield assert_equal(md5hex, 'acbd18db4cc2f85cedef654fccc4a4d8')
+        yield assert_equal(cache.get(fname), md5hex)
+        # an entry that matches the stat metadata is trusted
+        cache.set(fname, 'cached')
+        yield assert_equal(hash_infile(fname), 'cached')
+    finally:
+        config.set('execution', 'use_hash_cache', 'false')
+        config.set('execution', 'hash_cache_dir', '~/.nipype')
+    yield assert_equal(get_hash_cache(), None)
+    yield assert_equal(hash_infile(fname), md5hex)
+    rmtree(tmpdir)
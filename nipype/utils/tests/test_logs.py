@@ -0,0 +1,105 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+import logging
+import os
+from Queue import Queue
+from tempfile import mkdtemp
+from shutil import rmtree
+
+from nipype.testing import assert_equal, assert_true, parametric
+from nipype.utils.config import config
+from nipype.utils.filemanip import json
+import nipype.utils.logs as logs
+from nipype.utils.logs import (QueueHandler, QueueListener,
+                               init_worker_logging, start_event_log,
+                               stop_event_log, log_event)
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+def _log_in_worker(value):
+    logging.getLogger('workflow').warning('worker %d', value)
+    return value
+
+@parametric
+def test_queue_listener():
+    from multiprocessing import Pool
+    handler = ListHandler()
+    logger = logging.getLogger('workflow')
+    logger.addHandler(handler)
+    listener = QueueListener()
+    listener.start()
+    pool = Pool(processes=2, initializer=init_worker_logging,
+                initargs=(listener.queue,))
+    try:
+        results = pool.map(_log_in_worker, range(4), 1)
+    finally:
+        pool.close()
+        pool.join()
+        listener.stop()
+        logger.removeHandler(handler)
+    yield assert_equal(results, range(4))
+    yield assert_equal(sorted(handler.messages),
+                       ['worker %d' % i for i in range(4)])
+    yield assert_equal(listener.isAlive(), False)
+
+@parametric
+def test_queue_handler():
+    handler = QueueHandler(Queue(1))
+    record = logging.LogRecord('workflow', logging.INFO, __file__, 0,
+                               'value: %s', ([1, 2],), None)
+    handler.emit(record)
+    # a full queue drops records instead of blocking
+    handler.emit(record)
+    queued = handler.queue.get_nowait()
+    yield assert_equal(queued.getMessage(), 'value: [1, 2]')
+    yield assert_equal(queued.args, None)
+    yield assert_equal(handler.dropped, 1)
+
+@parametric
+def test_event_log():
+    tmpdir = mkdtemp()
+    filename = os.path.join(tmpdir, 'events.jsonl')
+    start_event_log(filename)
+    try:
+        log_event('node_done', node='pipe.mod1', duration=1.5)
+        log_event('node_crashed', node='pipe.mod2', value=object())
+    finally:
+        stop_event_log()
+    log_event('node_done', node='pipe.mod3')
+    lines = open(filename).readlines()
+    events = [json.loads(line) for line in lines]
+    yield assert_equal(len(events), 2)
+    yield assert_equal(events[0]['event'], 'node_done')
+    yield assert_equal(events[0]['node'], 'pipe.mod1')
+    yield assert_equal(events[0]['duration'], 1.5)
+    yield assert_equal(events[0]['pid'], os.getpid())
+    yield assert_true('time' in events[0] and 'host' in events[0])
+    yield assert_true(events[1]['value'].startswith('<object'))
+    rmtree(tmpdir)
+
+@parametric
+def test_setup_without_file():
+    tmpdir = mkdtemp()
+    handler = logs._file_handler
+    logs._file_handler = None
+    config.set('logging', 'log_to_file', 'false')
+    config.set('logging', 'log_directory', tmpdir)
+    try:
+        logs.setup_logging()
+        yield assert_true(logs._file_handler is not None)
+        # later calls do nothing
+        config.set('logging', 'log_to_file', 'true')
+        logs.setup_logging()
+    finally:
+        logs._file_handler = handler
+        config.set('logging', 'log_to_file', 'true')
+        config.set('logging', 'log_directory', '')
+    yield assert_equal(os.listdir(tmpdir), [])
+    rmtree(tmpdir)
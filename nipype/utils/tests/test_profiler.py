@@ -0,0 +1,41 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+import os
+import subprocess
+import sys
+from tempfile import mkdtemp
+from shutil import rmtree
+
+from nipype.testing import assert_equal, assert_true, parametric, SkipTest
+from nipype.utils.profiler import ResourceMonitor
+
+# allocates ~100MB, writes 1MB to a file and burns some CPU
+script = """
+import sys, time
+data = ' ' * (100 * 1024 ** 2)
+fp = open(sys.argv[1], 'wb')
+fp.write(' ' * 1024 ** 2)
+fp.close()
+t = time.time()
+while time.time() - t < 0.5:
+    pass
+"""
+
+@parametric
+def test_monitor():
+    if not os.path.isdir('/proc'):
+        raise SkipTest
+    tmpdir = mkdtemp()
+    outfile = os.path.join(tmpdir, 'out.txt')
+    proc = subprocess.Popen([sys.executable, '-c', script, outfile])
+    monitor = ResourceMonitor(proc.pid, interval=0.05)
+    monitor.start()
+    proc.wait()
+    profile = monitor.stop()
+    yield assert_true(monitor.nsamples > 0)
+    yield assert_true(profile['peak_rss'] > 90)
+    yield assert_true(profile['write_bytes'] >= 1024 ** 2)
+    yield assert_true(profile['num_threads'] >= 1)
+    yield assert_true(profile['cpu_user'] + profile['cpu_sys'] > 0.3)
+    yield assert_equal(monitor.isAlive(), False)
+    rmtree(tmpdir)
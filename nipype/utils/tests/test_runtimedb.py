@@ -0,0 +1,64 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+import os
+from tempfile import mkdtemp
+from shutil import rmtree
+
+from nipype.testing import assert_equal, assert_not_equal, parametric
+import nipype.interfaces.base as nib
+from nipype.utils.runtimedb import (RuntimeHistory, input_signature,
+                                    interface_name)
+
+class InputSpec(nib.TraitedSpec):
+    in_file = nib.File(desc='a file')
+    fwhm = nib.traits.Int(desc='a parameter')
+
+class TestInterface(nib.BaseInterface):
+    input_spec = InputSpec
+
+def _write(fname, data):
+    fp = open(fname, 'wb')
+    fp.write(data)
+    fp.close()
+
+@parametric
+def test_input_signature():
+    tmpdir = mkdtemp()
+    fname1 = os.path.join(tmpdir, 'subj1.nii')
+    fname2 = os.path.join(tmpdir, 'subj2.nii')
+    _write(fname1, 'a' * 1000)
+    _write(fname2, 'b' * 1001)
+    iface = TestInterface(in_file=fname1, fwhm=4)
+    signature = input_signature(iface.inputs)
+    # comparable data of another subject
+    yield assert_equal(input_signature(TestInterface(in_file=fname2,
+                                                     fwhm=4).inputs),
+                       signature)
+    yield assert_not_equal(input_signature(TestInterface(in_file=fname2,
+                                                         fwhm=6).inputs),
+                           signature)
+    yield assert_equal(interface_name(iface),
+                       'nipype.utils.tests.test_runtimedb.TestInterface')
+    rmtree(tmpdir)
+
+@parametric
+def test_record_estimate():
+    tmpdir = mkdtemp()
+    history = RuntimeHistory(os.path.join(tmpdir, 'runtime.db'))
+    yield assert_equal(history.estimate('foo.Bar'), None)
+    history.record('foo.Bar', 'sig1', 'host1', 10., 100., 1000)
+    history.record('foo.Bar', 'sig1', 'host2', 20., 200., 1000)
+    history.record('foo.Bar', 'sig2', 'host1', 60., None, None)
+    history.record('foo.Baz', 'sig1', 'host1', 1., 10., 0)
+    estimate = history.estimate('foo.Bar', 'sig1', 'host1')
+    yield assert_equal(estimate, dict(count=1, duration=10., peak_rss=100.))
+    estimate = history.estimate('foo.Bar', 'sig1', 'host3')
+    yield assert_equal(estimate, dict(count=2, duration=15., peak_rss=200.))
+    estimate = history.estimate('foo.Bar', 'sig3')
+    yield assert_equal(estimate, dict(count=3, duration=30., peak_rss=200.))
+    slowest = history.slowest()
+    yield assert_equal([row[:3] for row in slowest],
+                       [('foo.Bar', 3, 90.), ('foo.Baz', 1, 1.)])
+    slowest = history.slowest(limit=1, host='host1')
+    yield assert_equal([row[:3] for row in slowest], [('foo.Bar', 2, 70.)])
+    rmtree(tmpdir)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Simulate the dispatch order of the workflow scheduler
+
+Generates synthetic execution graphs, schedules them on a number of
+identical workers and reports the makespan obtained when ready nodes are
+dispatched in graph order (the old behaviour) and in order of their
+critical path length (see `Workflow._get_priorities`).
+
+Usage::
+
+    python tools/schedule_sim.py --procs 8 --subjects 20 --trials 10
+"""
+from heapq import heapify, heappop, heappush
+from optparse import OptionParser
+import random
+
+import networkx as nx
+
+from nipype.pipeline.utils import critical_path_lengths
+
+
+def subject_graph(nsubjects, rng):
+    """Per subject pipelines: a long structural chain (recon-all ->
+    bbregister -> applyvoltransform) next to many short functional runs
+    """
+    graph = nx.DiGraph()
+    durations = {}
+    for subject in range(nsubjects):
+        chain = ['recon%d' % subject, 'bbreg%d' % subject,
+                 'apply%d' % subject]
+        durations[chain[0]] = rng.uniform(300, 600)
+        durations[chain[1]] = rng.uniform(10, 30)
+        durations[chain[2]] = rng.uniform(1, 5)
+        graph.add_edges_from(zip(chain[:-1], chain[1:]))
+        for run in range(rng.randint(2, 6)):
+            nodes = ['%s%d_%d' % (name, subject, run)
+                     for name in ['realign', 'smooth', 'model']]
+            for node in nodes:
+                durations[node] = rng.uniform(5, 40)
+            graph.add_edges_from(zip(nodes[:-1], nodes[1:]))
+            graph.add_edge(nodes[0], chain[1])
+    return graph, durations
+
+def random_graph(nnodes, rng, edge_prob=0.05):
+    """A random DAG with heavy tailed durations
+    """
+    graph = nx.DiGraph()
+    durations = {}
+    for node in range(nnodes):
+        graph.add_node(node)
+        durations[node] = rng.lognormvariate(2, 1.5)
+        for parent in range(node):
+            if rng.random() < edge_prob:
+                graph.add_edge(parent, node)
+    return graph, durations
+
+def makespan(graph, durations, nprocs, priority=None):
+    """Simulate list scheduling on `nprocs` workers
+
+    Ready nodes are started in the order of their position in
+    graph.nodes() or, if `priority` is given, highest priority first.
+    """
+    nodes = graph.nodes()
+    order = dict([(node, idx) for idx, node in enumerate(nodes)])
+    if priority is None:
+        key = lambda node: order[node]
+    else:
+        key = lambda node: (-priority[node], order[node])
+    indegree = dict([(node, graph.in_degree(node)) for node in nodes])
+    ready = [(key(node), node) for node in nodes if not indegree[node]]
+    heapify(ready)
+    running = []
+    now = 0.
+    while ready or running:
+        while ready and len(running) < nprocs:
+            _, node = heappop(ready)
+            heappush(running, (now + durations[node], node))
+        now, node = heappop(running)
+        for child in graph.successors_iter(node):
+            indegree[child] -= 1
+            if not indegree[child]:
+                heappush(ready, (key(child), child))
+    return now
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--procs', type='int', default=8,
+                      help='number of workers')
+    parser.add_option('--subjects', type='int', default=20,
+                      help='subjects of the per subject graphs')
+    parser.add_option('--nodes', type='int', default=500,
+                      help='nodes of the random graphs')
+    parser.add_option('--trials', type='int', default=10,
+                      help='graphs generated of each kind')
+    parser.add_option('--seed', type='int', default=0)
+    options, _ = parser.parse_args()
+    rng = random.Random(options.seed)
+    for kind in ['subject', 'random']:
+        improvements = []
+        for trial in range(options.trials):
+            if kind == 'subject':
+                graph, durations = subject_graph(options.subjects, rng)
+            else:
+                graph, durations = random_graph(options.nodes, rng)
+            baseline = makespan(graph, durations, options.procs)
+            lengths = critical_path_lengths(graph, durations)
+            prioritized = makespan(graph, durations, options.procs, lengths)
+            improvements.append(1 - prioritized / baseline)
+            print '%s graph %d: %d nodes, makespan %.0f -> %.0f (%.1f%%)' % \
+                (kind, trial, len(graph), baseline, prioritized,
+                 100 * improvements[-1])
+        print '%s graphs: mean makespan reduction %.1f%%' % \
+            (kind, 100 * sum(improvements) / len(improvements))
+
+if __name__ == '__main__':
+    main()